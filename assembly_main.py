@@ -1,8 +1,15 @@
-import pandas as pd
+import os
 import tkinter as tk
 from tkinter import filedialog
 import re
 import tkinter.font as tkfont
+import planner
+import generator
+import plan_cache
+import hierarchy
+import ledger
+import plan_csv
+import registry as location_registry
 
 def safe_float(entry, default=1.0):
     try:
@@ -12,7 +19,10 @@ def safe_float(entry, default=1.0):
         return default
 
 # Template script with placeholders
-template = open("template.py").read()
+template = generator.load_template()
+
+# Local cache of plans and rendered protocols, keyed on a hash of the inputs
+protocol_cache = plan_cache.ProtocolCache()
 
 def select_file_1():
     global path_fragments
@@ -30,103 +40,72 @@ def accept_files():
     root.destroy()
     load_data_and_display_confirmation()
 
-def load_data_and_display_confirmation():
-    global constructs_df, num_inserts, insert_locations, master_mix, construct_tubes, constructs, vol_per_insert_dict, toolkit_plate_wells, water_loc, enzyme_loc
-
-    # Load volume data from CSV files
-    fragments = pd.read_csv(path_fragments)
-    constructs_df = pd.read_csv(path_constructs)
-
-    # Extract Bin values for each insert (assumes columns: [Name, ..., Bin, ...])
-    bin_dict = dict(zip(fragments.iloc[:, 0], fragments["Bin"]))
-
-    # --- Check for toolkit fragments in fragment names ---
-    fragment_names = fragments.iloc[:, 0].astype(str)
+def plan_source(level, kind):
+    # Input CSV a level was planned from
+    if level_plans:
+        return hierarchy.read_manifest(path_hierarchy)[level][kind]
+    paths = design_paths(0 if kind == "fragments" else 1)
+    return paths[0] if len(paths) == 1 else ", ".join(paths)
+
+def design_paths(idx):
+    # Fragments (idx 0) or constructs (idx 1) exports of every design merged into this run
+    pairs = added_designs + ([(path_fragments, path_constructs)] if path_fragments and path_constructs else [])
+    return [pair[idx] for pair in pairs]
+
+def plan_design(tc_steps):
+    # Plan of the selected designs, from the cache when these exact inputs were planned before.
+    # Pipelined plates are sized for the holds of the thermocycler program tc_steps.
+    batches = min(max(int(safe_float(batches_var, 1)), 1), planner.MAX_BATCHES)
+    registry = location_registry.LocationRegistry() if keep_positions_var.get() else None
+    try:
+        return protocol_cache.get_plan(
+            design_paths(0), design_paths(1), use_myt_var.get(), overflow_labware=overflow_var.get(),
+            registry=registry,
+            target_fmol=safe_float(target_fmol_var, planner.DEFAULT_TARGET_FMOL),
+            batches=batches,
+            cycle_seconds=planner.cycling_prep_seconds(tc_steps) if batches > 1 else None
+        )
+    finally:
+        if registry is not None:
+            registry.close()
 
-    toolkit_locations = {}  # {toolkit_name: {plasmid_name: position}}
-    toolkit_plate_wells = {}  # {fragment_name: (plate, position)}
-    toolkit_keys = set()
-    if use_myt_var.get():
-        toolkit_df = pd.read_csv("toolkit_data.csv")
-        # Build a mapping: {plasmid_name: (plate, position)}
-        for _, row in toolkit_df.iterrows():
-            toolkit = str(row["Plate"])
-            toolkit_keys.add(toolkit)
-            if toolkit not in toolkit_locations:
-                toolkit_locations[toolkit] = {}
-            toolkit_locations[toolkit][row["Name"]] = row["Position"]
-
-        # For each fragment, if its name contains a toolkit key, and matches a toolkit entry, assign it
-        for frag_name in fragment_names:
-            found = False
-            for toolkit in toolkit_keys:
-                if toolkit in frag_name:
-                    # Try to find a matching toolkit entry for this fragment
-                    for plasmid_name, position in toolkit_locations[toolkit].items():
-                        if plasmid_name in frag_name:
-                            toolkit_plate_wells[frag_name] = (toolkit, position)
-                            found = True
-                            break
-                if found:
-                    break
-
-    # Remove unnecessary columns
-    constructs_df.drop(columns=[col for col in constructs_df.columns if "Overhang" in col], inplace=True, errors='ignore')
-    constructs_df.drop(columns=["Status"], inplace=True, errors='ignore')
-
-    # Calculate the number of inserts
-    num_inserts = len(fragments)
-
-    # Define locations for non-toolkit fragments
-    locations = [f"{chr(65 + i // 6)}{i % 6 + 1}" for i in range(24)]
-    inserts = []
-    insert_plate_map = {}  # Map fragment name to (plate, well)
-
-    non_toolkit_idx = 0
-    for i, frag_name in enumerate(fragment_names):
-        # Check if fragment is in any toolkit
-        if use_myt_var.get() and frag_name in toolkit_plate_wells:
-            toolkit_plate, toolkit_position = toolkit_plate_wells[frag_name]
-            insert_plate_map[frag_name] = (toolkit_plate, toolkit_position)
-            inserts.append((toolkit_plate, toolkit_position))
-        else:
-            insert_plate_map[frag_name] = ("tube_rack", locations[non_toolkit_idx])
-            inserts.append(("tube_rack", locations[non_toolkit_idx]))
-            non_toolkit_idx += 1
-
-    remaining_locations = locations[non_toolkit_idx:]
-    master_mix = remaining_locations[0]  # Use first remaining location for MM
-    water_loc = remaining_locations[1]
-    enzyme_loc = remaining_locations[2]  # Assign next available for enzyme
-
-    # Assign locations in thermocycler to constructs
-    construct_tubes = [f"{chr(65 + i // 12)}{i % 12 + 1}" for i in range(len(constructs_df))]
-
-    # Create a dictionary mapping insert names to their locations (well only, for script compatibility)
-    insert_locations = {fragments.iloc[i, 0]: inserts[i] for i in range(num_inserts)}
-
-    # Extract constructs as a list of lists and get construct names if available
-    constructs = [row[1:].tolist() for _, row in constructs_df.iterrows()]
-    
-    if 'Name' in constructs_df.columns:
-        construct_names = constructs_df['Name'].tolist()
-    else:
-        construct_names = [f"Construct {i+1}" for i in range(len(constructs))]
+def load_data_and_display_confirmation():
+    global construct_table, num_inserts, insert_locations, master_mix, construct_tubes, constructs, vol_per_insert_dict, toolkit_plate_wells, water_loc, enzyme_loc, library_size, plan_key, plan, level_plans
 
-    # --- NEW: Get per-insert volumes from CSV if available, else default to 1 ---
-    if "Volume" in fragments.columns:
-        vol_per_insert_dict = dict(zip(fragments.iloc[:, 0], fragments["Volume"]))
+    if path_hierarchy:
+        # Multi-level assembly: every level is planned now, the first level is reviewed below
+        level_plans = hierarchy.plan_hierarchy(
+            hierarchy.read_manifest(path_hierarchy), use_myt_var.get(), overflow_labware=overflow_var.get()
+        )
+        plan_key, plan = None, level_plans[0]
     else:
-        vol_per_insert_dict = {name: 1 for name in fragments.iloc[:, 0]}
+        # Pipelined plates are sized for the default thermocycler program until it is edited
+        level_plans = []
+        plan_key, plan = plan_design(generator.DEFAULT_TC_STEPS)
+
+    num_inserts = len(plan["fragment_names"])
+    insert_locations = plan["insert_locations"]
+    insert_plate_map = plan["insert_plate_map"]
+    toolkit_plate_wells = plan["toolkit_plate_wells"]
+    bin_dict = plan["bin_dict"]
+    master_mix = plan["master_mix"]
+    water_loc = plan["water_loc"]
+    enzyme_loc = plan["enzyme_loc"]
+    construct_table = plan["construct_table"]
+    construct_names = construct_table.names
+    constructs = construct_table.to_lists()  # name lists, only for the generated script
+    construct_tubes = plan["construct_tubes"]
+    vol_per_insert_dict = plan["vol_per_insert_dict"]
+    library_size = plan["library_size"]
 
     # Display the confirmation window, passing MM info and toolkit info
     display_confirmation_window(
-        constructs_df, num_inserts, insert_locations, construct_tubes, construct_names,
+        construct_table, num_inserts, insert_locations, construct_tubes, construct_names,
         insert_plate_map, vol_per_insert_dict, bin_dict, enzyme_loc
     )
 
 def display_confirmation_window(
-    constructs_df, num_inserts, insert_locations, construct_tubes, construct_names,
+    construct_table, num_inserts, insert_locations, construct_tubes, construct_names,
     insert_plate_map, vol_per_insert_dict, bin_dict, enzyme_loc
 ):
     global confirmation_window, file_name_entry
@@ -153,62 +132,29 @@ def display_confirmation_window(
 
     # Tube placements info
     global tube_placements
-    tube_placements = ""
-
-    # --- Identify all toolkit plates and assign deck slots ---
-    toolkit_plate_slots = {}
-    # Use the same available slots as the rest of the script (for tip racks and toolkit plates)
-    available_slots = ["1", "2", "3", "5", "6", "9"]
-
-    # Calculate number of tips needed as in template.py
-    num_master_mix_transfers = len(construct_tubes)
-    num_insert_transfers = sum(len(construct) for construct in constructs)
-    total_p20_tips = num_insert_transfers + num_master_mix_transfers  # assuming all MM and inserts use p20
-    total_p300_tips = 0  # not used if all volumes < 20
-
-    num_p20_racks = (total_p20_tips - 1) // 96 + 1 if total_p20_tips > 0 else 0
-    num_p300_racks = (total_p300_tips - 1) // 96 + 1 if total_p300_tips > 0 else 0
-
-    p20_slots = available_slots[:num_p20_racks]
-    p300_slots = available_slots[num_p20_racks:num_p20_racks+num_p300_racks]
-    toolkit_slots = available_slots[num_p20_racks+num_p300_racks:]
-
-    used_toolkits = set()
-    for insert, (plate, well) in insert_plate_map.items():
-        if plate not in ("tube_rack", "temp_module", "myt_plate"):
-            used_toolkits.add(plate)
-    for idx, toolkit in enumerate(sorted(used_toolkits)):
-        if idx < len(toolkit_slots):
-            toolkit_plate_slots[toolkit] = toolkit_slots[idx]
-        else:
-            toolkit_plate_slots[toolkit] = "extra"
-
-    # --- Build tube placements string with plate and slot info ---
-    for insert, (plate, well) in insert_plate_map.items():
-        if plate in toolkit_plate_slots:
-            slot = toolkit_plate_slots[plate]
-            tube_placements += f"[{well}] ({plate} Plate, Slot {slot}): {insert}, \n"
-        elif plate == "myt_plate":
-            tube_placements += f"[{well}] (MYT Plate): {insert}, \n"
-        else:
-            tube_placements += f"[{well}] (Temp Module): {insert}, \n"
-
-    tube_placements += f"\n[{master_mix}] (Temp Module): Master Mix,"
-    tube_placements += f"\n[{water_loc}] (Temp Module): Molecular Grade Water,"
-    tube_placements += f"\n[{enzyme_loc}] (Temp Module): Enzyme, \n"
-    tube_placements += "\nConstructs will be built in the thermocycler module:\n\n"
-    tube_placements += "\n".join([f"[{location}]: {construct_names[i]}, " for i, location in enumerate(construct_tubes)])
-
-    # Add plate/slot summary for user clarity
-    if used_toolkits:
-        tube_placements += "\n\nToolkit plate locations on deck:\n"
-        for toolkit, slot in toolkit_plate_slots.items():
-            tube_placements += f"  {toolkit} Plate: Slot {slot}\n"
+    tube_placements = plan["tube_placements"]
 
     # Confirmation message
+    library_note = ""
+    if library_size > len(constructs):
+        library_note = (
+            f"The library has {library_size} constructs ({(library_size - 1) // planner.PLATE_SIZE + 1} plates), "
+            f"this protocol builds the first {len(constructs)}.\n\n"
+        )
+    if len(plan["batches"]) > 1:
+        library_note += (
+            f"They are cycled on {len(plan['batches'])} plates of {', '.join(map(str, plan['batches']))} constructs, "
+            "each plate after the first pipetted while the one before cycles.\n\n"
+        )
+    if level_plans:
+        library_note += (
+            f"{len(level_plans)} levels from {path_hierarchy}. The first level is shown here, later levels "
+            "use the volumes from their own fragments CSVs and are saved as one protocol per level.\n\n"
+        )
     confirmation_message = (
-        f"Loaded {num_inserts} fragments using {path_fragments} and\n"
-        f"{len(constructs_df)} constructs using {path_constructs}.\n\n"
+        f"Loaded {num_inserts} fragments using {plan_source(0, 'fragments')} and\n"
+        f"{len(constructs)} constructs using {plan_source(0, 'constructs')}.\n\n"
+        f"{library_note}"
         "Reagents will be pulled from these locations:\n\n"
         f"{tube_placements}\n"
     )
@@ -225,7 +171,10 @@ def display_confirmation_window(
     # --- Per-insert volume input section (FIRST) ---
     tk.Label(
         scrollable_frame,
-        text="Volumes (µL) need to be manually calculated for 25/50 fmol of each fragment, each should be ≥1 µL for pipetting:",
+        text=(
+            f"Volumes (µL) are pre-filled for {plan['target_fmol']:g} fmol of each fragment from the concentration and length "
+            "columns (or the Volume column), each should be ≥1 µL for pipetting:"
+        ),
         anchor="w", justify="left"
     ).pack(pady=5, fill="x", anchor="w")
     insert_volume_entries = {}
@@ -234,6 +183,8 @@ def display_confirmation_window(
         frame.pack(fill="x", pady=2, anchor="w")
         bin_val = bin_dict.get(insert_name, "")
         label_text = f"({bin_val}) {insert_name}" if bin_val != "" else insert_name
+        if insert_name in plan["dilution_proposals"]:
+            label_text += f" [dilute {plan['dilution_proposals'][insert_name]}x]"
         tk.Label(frame, text=label_text, width=50, anchor="w", justify="left").pack(side="left", padx=(0, 5))
         entry = tk.Entry(frame, width=10, justify="left")
         entry.insert(0, str(vol_per_insert_dict[insert_name]))
@@ -273,6 +224,22 @@ def display_confirmation_window(
     reaction_vol_entry.insert(0, "15")
     reaction_vol_entry.pack(side="left", padx=(0, 5))
 
+    # Insert-major pipetting: one tip per fragment instead of one per insert (libraries)
+    global insert_major_var
+    insert_major_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(
+        scrollable_frame, text="Pipette inserts fragment by fragment (one tip per fragment)",
+        variable=insert_major_var, command=lambda: update_mm_info()
+    ).pack(anchor="w", pady=2)
+
+    # Enzyme after the inserts, so early wells do not hold enzyme through the whole insert phase
+    global enzyme_last_var
+    enzyme_last_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(
+        scrollable_frame, text="Add enzyme last (shortest wait before cycling)",
+        variable=enzyme_last_var, command=lambda: update_mm_info()
+    ).pack(anchor="w", pady=2)
+
     # Info label for water and master mix, to be updated live
     mm_info_var = tk.StringVar()
     def update_mm_info(*args):
@@ -288,17 +255,28 @@ def display_confirmation_window(
             enzyme_per_reaction = float(enzyme_per_reaction_entry.get())
         except Exception:
             enzyme_per_reaction = 1.0
-        n_reactions = len(constructs)
-        water_per_reaction = []
-        for construct in constructs:
-            total_insert_vol = sum(safe_float(insert_volume_entries[insert]) for insert in construct)
-            water_vol = reaction_vol - (mm_per_reaction + enzyme_per_reaction + total_insert_vol)
-            water_per_reaction.append(round(water_vol,2))
+        n_reactions = len(construct_table)
+        vol_by_id = planner.fragment_values(
+            construct_table.fragments,
+            {insert: safe_float(entry) for insert, entry in insert_volume_entries.items()}
+        )
+        water_per_reaction = planner.water_per_reaction(
+            construct_table, vol_by_id, reaction_vol, mm_per_reaction, enzyme_per_reaction
+        )
         total_mm = mm_per_reaction * n_reactions
+        try:
+            ledger_text = ledger.describe_ledger(ledger.build_ledger(
+                plan, reaction_vol, mm_per_reaction, enzyme_per_reaction,
+                {insert: safe_float(entry) for insert, entry in insert_volume_entries.items()},
+                insert_major_var.get(), enzyme_last_var.get(), generator.DEFAULT_TC_STEPS
+            ))
+        except ValueError as e:
+            ledger_text = f"WARNING: {e}"
         mm_info_var.set(
             f"Total master mix needed: {total_mm} uL\n"
             f"Water per reaction (should all be positive): {water_per_reaction} uL\n"
-            f"Total water needed: {round(sum(water_per_reaction),2)} uL"
+            f"Total water needed: {round(sum(water_per_reaction),2)} uL\n\n"
+            f"{ledger_text}"
         )
     reaction_vol_entry.bind("<KeyRelease>", update_mm_info)
     mm_per_reaction_entry.bind("<KeyRelease>", update_mm_info)
@@ -429,6 +407,22 @@ def display_confirmation_window(
     browse_button = tk.Button(file_name_row, text="Browse", width=10, command=browse_save_file)
     browse_button.pack(side="left", padx=5)
 
+    # Compact output for large designs: fragments written once, constructs as index lists
+    global compact_var, compress_var
+    compact_var = tk.BooleanVar(value=False)
+    compress_var = tk.BooleanVar(value=False)
+    compact_row = tk.Frame(file_name_frame)
+    compact_row.pack(side="top", anchor="w", fill="x", pady=(2, 0))
+    tk.Checkbutton(compact_row, text="Compact protocol (large designs)", variable=compact_var).pack(side="left")
+    tk.Checkbutton(compact_row, text="Compress", variable=compress_var).pack(side="left", padx=(10, 0))
+
+    # Stable protocol: one protocol imported into the Opentrons App once, each design is a plan CSV
+    global stable_var
+    stable_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(
+        file_name_frame, text="Plan CSV for the stable protocol (no new protocol per design)", variable=stable_var
+    ).pack(side="top", anchor="w")
+
     # Confirm button to generate the script (extra space above)
     confirm_button = tk.Button(
         scrollable_frame,
@@ -441,6 +435,13 @@ def display_confirmation_window(
     )
     confirm_button.pack(pady=(20, 10), anchor="w")
 
+    # Errors that stop the script from being written, shown here rather than only on the console
+    global generate_error_var
+    generate_error_var = tk.StringVar()
+    tk.Label(
+        scrollable_frame, textvariable=generate_error_var, justify="left", anchor="w", wraplength=500, fg="red"
+    ).pack(pady=(0, 10), fill="x", anchor="w")
+
     # --- Runtime estimation label ---
     runtime_var = tk.StringVar()
     runtime_label = tk.Label(
@@ -454,15 +455,7 @@ def display_confirmation_window(
 
     def update_runtime(*args):
         try:
-            t1 = int(tc_step_entries['step1_time'].get() or 0)
-            t2 = int(tc_step_entries['step2_time'].get() or 0)
-            t3 = int(tc_step_entries['step3_time'].get() or 0)
-            cycles = int(tc_step_entries['step4_cycles'].get() or 0)
-            t5 = int(tc_step_entries['step5_time'].get() or 0)
-            t6 = int(tc_step_entries['step6_time'].get() or 0)
-            t7 = int(tc_step_entries['step7_time'].get() or 0)
-            t8 = int(tc_step_entries['step8_time'].get() or 0)
-            total_seconds = t1 + cycles * (t2 + t3) + t5 + t6 + t7 + t8
+            total_seconds = planner.thermocycler_seconds({key: entry.get() for key, entry in tc_step_entries.items()})
             hours = total_seconds // 3600
             minutes = (total_seconds % 3600) // 60
             seconds = total_seconds % 60
@@ -479,6 +472,7 @@ def generate_script(
     file_name_entry, reaction_vol_entry, insert_volume_entries,
     mm_per_reaction_entry, enzyme_per_reaction_entry, tc_step_entries, enzyme_loc
 ):
+    global plan_key, plan
     file_name = file_name_entry.get()
     try:
         reaction_vol = float(reaction_vol_entry.get())
@@ -497,71 +491,107 @@ def generate_script(
         except Exception:
             vol_per_insert_dict[insert_name] = 1.0  # fallback default
 
-    # Calculate water needed for each well
-    water_per_reaction = []
     enzyme_per_reaction = safe_float(enzyme_per_reaction_entry, 1)
-    for construct in constructs:
-        total_insert_vol = sum(float(vol_per_insert_dict.get(insert, 1)) for insert in construct)
-        water_vol = reaction_vol - (mm_per_reaction + enzyme_per_reaction + total_insert_vol)
-        water_per_reaction.append(round(water_vol, 2))  # Round to 2
-
-    # Calculate number of tips needed as in template.py
-    num_master_mix_transfers = len(construct_tubes)
-    num_insert_transfers = sum(len(construct) for construct in constructs)
-    total_p20_tips = num_insert_transfers + num_master_mix_transfers  # assuming all MM and inserts use p20
-    total_p300_tips = 0  # not used if all volumes < 20
-
-    num_p20_racks = (total_p20_tips - 1) // 96 + 1 if total_p20_tips > 0 else 0
-    num_p300_racks = (total_p300_tips - 1) // 96 + 1 if total_p300_tips > 0 else 0
-
-    script = template.format(
-        tube_placements=tube_placements,
-        inserts=insert_locations,
-        master_mix=master_mix,
-        construct_tubes=construct_tubes,
-        mm_per_reaction=mm_per_reaction,
-        enzyme_per_reaction=enzyme_per_reaction_entry.get(),
-        enzyme_loc=enzyme_loc,
-        vol_per_insert=vol_per_insert_dict,
-        water_per_reaction=water_per_reaction,
-        constructs=constructs,
-        total_p20_tips=total_p20_tips,
-        total_p300_tips=total_p300_tips,
+    tc_steps = {key: entry.get() for key, entry in tc_step_entries.items()}
+
+    # Check every level's sources before writing anything, build_ledger raises when reagents do not fit the deck
+    try:
+        if not level_plans:
+            # Pipelined plates were sized for the default program, size them for the edited one
+            sizes = plan["batches"]
+            plan_key, plan = plan_design(tc_steps)
+            if plan["batches"] != sizes:
+                print(f"Plates re-sized for the thermocycler program: {', '.join(map(str, plan['batches']))} constructs.")
+        for idx, level_plan in enumerate(level_plans or [plan]):
+            ledger.build_ledger(
+                level_plan, reaction_vol, mm_per_reaction, enzyme_per_reaction,
+                vol_per_insert_dict if idx == 0 else level_plan["vol_per_insert_dict"],
+                insert_major_var.get(), enzyme_last_var.get(), tc_steps
+            )
+    except ValueError as e:
+        generate_error_var.set(f"Could not generate the script: {e}")
+        return
+    generate_error_var.set("")
+
+    if stable_var.get():
+        # Only the small plan file changes per design, the stable protocol next to it changes with the template
+        base = os.path.splitext(file_name)[0]
+        stable_file = os.path.join(os.path.dirname(os.path.abspath(file_name)), generator.STABLE_PROTOCOL_NAME)
+        with open(stable_file, 'w') as file:
+            file.write(generator.render_stable_protocol(template))
+        for idx, level_plan in enumerate(level_plans or [plan]):
+            level_vols = vol_per_insert_dict if idx == 0 else level_plan["vol_per_insert_dict"]
+            level_base = f"{base}_L{level_plan['level']}" if level_plans else base
+            rows, run_ledger = generator.render_plan_csv(
+                level_plan, reaction_vol, mm_per_reaction, enzyme_per_reaction, level_vols, tc_steps,
+                insert_major=insert_major_var.get(), enzyme_last=enzyme_last_var.get()
+            )
+            plan_csv.write_plan_csv(level_base + "_plan.csv", rows)
+            with open(level_base + "_loading.txt", 'w') as file:
+                file.write(generator.loading_sheet(level_plan, run_ledger))
+            print(f"Plan saved as {level_base}_plan.csv, loading sheet as {level_base}_loading.txt.")
+        print(f"Stable protocol saved as {stable_file}, import it once and select the plan CSV when starting a run.")
+        confirmation_window.destroy()
+        return
+
+    if level_plans:
+        # One protocol per level, run in order on the same thermocycler plate
+        base, ext = os.path.splitext(file_name)
+        for idx, level_plan in enumerate(level_plans):
+            level_vols = vol_per_insert_dict if idx == 0 else level_plan["vol_per_insert_dict"]
+            level_file = f"{base}_L{level_plan['level']}{ext or '.py'}"
+            with open(level_file, 'w') as file:
+                file.write(generator.render_plan(
+                    template, level_plan, reaction_vol, mm_per_reaction, enzyme_per_reaction,
+                    level_vols, tc_steps, compact=compact_var.get(), compress=compress_var.get(),
+                    insert_major=insert_major_var.get(), enzyme_last=enzyme_last_var.get()
+                ))
+            print(f"Level {level_plan['level']} script saved as {level_file}.")
+        confirmation_window.destroy()
+        return
+
+    # Rendering is cached too, a repeat of the same settings returns the saved script
+    script = protocol_cache.get_script(
+        plan_key, plan, template,
         reaction_vol=reaction_vol,
-        vol_master_mix_per_reaction=[mm_per_reaction] * len(constructs),
-        water_loc=water_loc,
-        tc_step1_temp=tc_step_entries['step1_temp'].get(),
-        tc_step1_time=tc_step_entries['step1_time'].get(),
-        tc_step2_temp=tc_step_entries['step2_temp'].get(),
-        tc_step2_time=tc_step_entries['step2_time'].get(),
-        tc_step3_temp=tc_step_entries['step3_temp'].get(),
-        tc_step3_time=tc_step_entries['step3_time'].get(),
-        tc_step4_cycles=tc_step_entries['step4_cycles'].get(),
-        tc_step5_temp=tc_step_entries['step5_temp'].get(),
-        tc_step5_time=tc_step_entries['step5_time'].get(),
-        tc_step6_temp=tc_step_entries['step6_temp'].get(),
-        tc_step6_time=tc_step_entries['step6_time'].get(),
-        tc_step7_temp=tc_step_entries['step7_temp'].get(),
-        tc_step7_time=tc_step_entries['step7_time'].get(),
-        tc_step8_temp=tc_step_entries['step8_temp'].get(),
-        tc_step8_time=tc_step_entries['step8_time'].get(),
+        mm_per_reaction=mm_per_reaction,
+        enzyme_per_reaction=enzyme_per_reaction,
+        vol_per_insert_dict=vol_per_insert_dict,
+        tc_steps=tc_steps,
+        compact=compact_var.get(),
+        compress=compress_var.get(),
+        insert_major=insert_major_var.get(),
+        enzyme_last=enzyme_last_var.get(),
     )
 
     with open(file_name, 'w') as file:
         file.write(script)
 
+    # Compact protocols only carry a summary, so write every placement to a loading sheet
+    if compact_var.get():
+        sheet_name = os.path.splitext(file_name)[0] + "_loading.txt"
+        run_ledger = ledger.build_ledger(
+            plan, reaction_vol, mm_per_reaction, enzyme_per_reaction, vol_per_insert_dict, insert_major_var.get(),
+            enzyme_last_var.get(), tc_steps
+        )
+        with open(sheet_name, 'w') as file:
+            file.write(generator.loading_sheet(plan, run_ledger))
+        print(f"Loading sheet saved as {sheet_name}.")
+
     print(f"Script generated successfully and saved as {file_name}.")
     confirmation_window.destroy()
 
 # Initialize output variables
 path_fragments = ""
 path_constructs = ""
+path_hierarchy = ""
+added_designs = []  # (fragments, constructs) pairs merged into one run with the current selection
 
 # Create the main window
 root = tk.Tk()
 root.title("Golden Gate Assembly - Select Benchling Files")
 root.configure(padx=20, pady=20)  # Add horizontal (and vertical) padding
-root.geometry("500x220")  # Set a default size
+root.geometry("500x400")  # Set a default size
 
 # Add a variable to track the checkbox state
 use_myt_var = tk.BooleanVar(value=False)
@@ -580,10 +610,21 @@ def handle_myt_toolkit_unselected():
 
 # --- Add file selection buttons ---
 def check_accept_ready():
-    if path_fragments and path_constructs:
+    if (path_fragments and path_constructs) or added_designs or path_hierarchy:
         accept_button.config(state="normal")
     else:
         accept_button.config(state="disabled")
+    add_design_button.config(state="normal" if path_fragments and path_constructs else "disabled")
+
+def add_design():
+    # Keep the selected pair and start selecting the next design's exports
+    global path_fragments, path_constructs
+    added_designs.append((path_fragments, path_constructs))
+    path_fragments = path_constructs = ""
+    select_button_1.config(text="Select Fragments CSV")
+    select_button_2.config(text="Select Constructs CSV")
+    add_design_button.config(text=f"Add Another Design ({len(added_designs)} added)")
+    check_accept_ready()
 
 def select_file_1():
     global path_fragments
@@ -599,15 +640,59 @@ def select_file_2():
         select_button_2.config(text=f"Selected: {path_constructs}")
     check_accept_ready()
 
+def select_hierarchy():
+    global path_hierarchy
+    path_hierarchy = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
+    if path_hierarchy:
+        hierarchy_button.config(text=f"Selected: {path_hierarchy}")
+    check_accept_ready()
+
 select_button_1 = tk.Button(root, text="Select Fragments CSV", command=select_file_1)
 select_button_1.pack(pady=5)
 
 select_button_2 = tk.Button(root, text="Select Constructs CSV", command=select_file_2)
 select_button_2.pack(pady=5)
 
+# Several designs can share one run, fragments used by more than one are loaded once
+add_design_button = tk.Button(root, text="Add Another Design", command=add_design, state="disabled")
+add_design_button.pack(pady=5)
+
+# Multi-level assemblies list the fragments and constructs CSVs of each level in one manifest
+hierarchy_button = tk.Button(root, text="Select Hierarchy CSV (multi-level, optional)", command=select_hierarchy)
+hierarchy_button.pack(pady=5)
+
 myt_checkbox = tk.Checkbutton(root, text="Pull fragments from toolkit plates (MYT, YTK, YSD)", variable=use_myt_var, command=on_myt_checkbox)
 myt_checkbox.pack(pady=5)
 
+# Labware for custom fragments that do not fit on the temperature module
+# Fragments, reagents and toolkit plates keep their positions from earlier runs
+keep_positions_var = tk.BooleanVar(value=False)
+keep_positions_checkbox = tk.Checkbutton(
+    root, text=f"Keep positions from earlier runs ({location_registry.REGISTRY_PATH})", variable=keep_positions_var
+)
+keep_positions_checkbox.pack(pady=5)
+
+overflow_var = tk.StringVar(value="plate")
+overflow_frame = tk.Frame(root)
+overflow_frame.pack(pady=5)
+tk.Label(overflow_frame, text="Overflow labware for extra fragments:").pack(side="left")
+tk.OptionMenu(overflow_frame, overflow_var, *planner.OVERFLOW_LABWARE.keys()).pack(side="left")
+
+# Fragment volumes are calculated for this amount from the concentration and length columns
+target_fmol_frame = tk.Frame(root)
+target_fmol_frame.pack(pady=5)
+tk.Label(target_fmol_frame, text="Target fmol per fragment:").pack(side="left")
+# A variable rather than the Entry, the first window is destroyed before planning
+target_fmol_var = tk.StringVar(value=str(planner.DEFAULT_TARGET_FMOL))
+tk.Entry(target_fmol_frame, width=6, textvariable=target_fmol_var).pack(side="left")
+
+# Plates cycled back to back in one run, each pipetted on a chilled prep plate while the one before cycles
+batches_frame = tk.Frame(root)
+batches_frame.pack(pady=5)
+tk.Label(batches_frame, text="Plates per run (pipelined while cycling):").pack(side="left")
+batches_var = tk.StringVar(value="1")
+tk.Spinbox(batches_frame, from_=1, to=planner.MAX_BATCHES, width=4, textvariable=batches_var).pack(side="left")
+
 accept_button = tk.Button(root, text="Confirm", command=accept_files, state="disabled")
 accept_button.pack(pady=20)
 
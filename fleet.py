@@ -0,0 +1,133 @@
+import argparse
+import os
+import pandas as pd
+import generator
+import ledger as source_ledger
+import planner
+
+def _split_list(cell):
+    if pd.isna(cell) or str(cell).strip() == "":
+        return []
+    return [item.strip() for item in str(cell).split(";") if item.strip()]
+
+def read_fleet(path_fleet):
+    # Fleet CSV with one row per robot: Robot, P20 Tips (tips stocked for the whole queue)
+    # and Toolkit Plates (";"-separated toolkit plate names already on the deck)
+    fleet = pd.read_csv(path_fleet)
+    robots = []
+    for _, row in fleet.iterrows():
+        robots.append({
+            "name": str(row["Robot"]),
+            "p20_tips": int(row["P20 Tips"]),
+            "toolkit_plates": set(_split_list(row.get("Toolkit Plates"))),
+        })
+    return robots
+
+def read_queue(path_queue):
+    # Queue CSV with one row per design: Design, Fragments, Constructs and optionally Toolkit (1/0).
+    # Paths are relative to the queue file.
+    queue = pd.read_csv(path_queue)
+    base = os.path.dirname(os.path.abspath(path_queue))
+    designs = []
+    for _, row in queue.iterrows():
+        use_toolkit = row.get("Toolkit", 0)
+        designs.append({
+            "name": str(row["Design"]),
+            "fragments": os.path.join(base, str(row["Fragments"])),
+            "constructs": os.path.join(base, str(row["Constructs"])),
+            "use_toolkit": bool(use_toolkit) and not pd.isna(use_toolkit),
+        })
+    return designs
+
+def plan_runs(designs, tc_steps=None, overflow_labware="plate"):
+    # Every plate of every design is one run, planned with its tip count, runtime and toolkit plates
+    tc_steps = tc_steps or generator.DEFAULT_TC_STEPS
+    runs = []
+    for design in designs:
+        # Plates are planned from one pass over the exports, not re-read per plate
+        for shard, plan in enumerate(planner.iter_plate_plans(
+            design["fragments"], design["constructs"], design["use_toolkit"], overflow_labware=overflow_labware,
+        )):
+            tips, _ = generator.count_tips(plan["construct_table"], plan["construct_tubes"])
+            runs.append({
+                "name": design["name"] if plan["library_size"] <= planner.PLATE_SIZE else f"{design['name']}_plate{shard + 1}",
+                "plan": plan,
+                "tips": tips,
+                "seconds": planner.estimate_runtime(plan, tc_steps),
+                "toolkit_plates": set(plan["toolkit_plate_slots"]),
+            })
+    return runs
+
+def schedule(runs, robots):
+    # Longest run first onto the robot that finishes earliest, among robots with enough tips
+    # left and every toolkit plate the run needs already on deck
+    assignments = {robot["name"]: [] for robot in robots}
+    finish = {robot["name"]: 0 for robot in robots}
+    tips_left = {robot["name"]: robot["p20_tips"] for robot in robots}
+    for run in sorted(runs, key=lambda run: -run["seconds"]):
+        candidates = [
+            robot for robot in robots
+            if tips_left[robot["name"]] >= run["tips"] and run["toolkit_plates"] <= robot["toolkit_plates"]
+        ]
+        if not candidates:
+            raise ValueError(
+                f"No robot can run {run['name']}: it needs {run['tips']} tips and toolkit plates "
+                f"{', '.join(sorted(run['toolkit_plates'])) or '(none)'}"
+            )
+        robot = min(candidates, key=lambda robot: (finish[robot["name"]], len(robot["toolkit_plates"])))
+        assignments[robot["name"]].append(run)
+        finish[robot["name"]] += run["seconds"]
+        tips_left[robot["name"]] -= run["tips"]
+    return assignments, finish
+
+def write_protocols(assignments, finish, out_dir, template, settings=None, tc_steps=None):
+    # One protocol per run and one loading sheet per robot listing its runs in order
+    settings = dict(generator.DEFAULT_SETTINGS, **(settings or {}))
+    tc_steps = tc_steps or generator.DEFAULT_TC_STEPS
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for robot_name, runs in assignments.items():
+        if not runs:
+            continue
+        sheet = [f"Robot {robot_name}: {len(runs)} runs, estimated {finish[robot_name] / 3600:.1f} h"]
+        for idx, run in enumerate(runs):
+            plan = run["plan"]
+            protocol_path = os.path.join(out_dir, f"{robot_name}_{idx + 1}_{run['name']}.py")
+            with open(protocol_path, "w") as f:
+                f.write(generator.render_plan(
+                    template, plan, settings["reaction_vol"], settings["mm_per_reaction"],
+                    settings["enzyme_per_reaction"], plan["vol_per_insert_dict"], tc_steps,
+                ))
+            run_ledger = source_ledger.build_ledger(
+                plan, settings["reaction_vol"], settings["mm_per_reaction"],
+                settings["enzyme_per_reaction"], plan["vol_per_insert_dict"], tc_steps=tc_steps,
+            )
+            sheet.append(
+                f"\n=== Run {idx + 1}: {run['name']} ({os.path.basename(protocol_path)}), "
+                f"{len(plan['construct_table'])} constructs, {run['tips']} tips, "
+                f"~{run['seconds'] // 60} min ===\n"
+            )
+            sheet.append(generator.loading_sheet(plan, run_ledger))
+            written.append(protocol_path)
+        sheet_path = os.path.join(out_dir, f"{robot_name}_loading.txt")
+        with open(sheet_path, "w") as f:
+            f.write("\n".join(sheet))
+        written.append(sheet_path)
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Spread a queue of designs across several OT-2s")
+    parser.add_argument("fleet", help="fleet CSV (Robot, P20 Tips, Toolkit Plates)")
+    parser.add_argument("queue", help="queue CSV (Design, Fragments, Constructs, Toolkit)")
+    parser.add_argument("--out", default="fleet_protocols", help="output folder")
+    parser.add_argument("--overflow", default="plate", choices=sorted(planner.OVERFLOW_LABWARE))
+    args = parser.parse_args()
+
+    runs = plan_runs(read_queue(args.queue), overflow_labware=args.overflow)
+    assignments, finish = schedule(runs, read_fleet(args.fleet))
+    for path in write_protocols(assignments, finish, args.out, generator.load_template()):
+        print(f"Saved {path}")
+    print(f"Estimated makespan: {max(finish.values()) / 3600:.1f} h")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import base64
+import hashlib
+import inspect
+import json
+import zlib
+import ledger as source_ledger
+import liquids
+import plan_csv
+import planner
+
+TEMPLATE_PATH = "template.py"
+
+# File name of the protocol written by render_stable_protocol
+STABLE_PROTOCOL_NAME = "golden_gate_stable.py"
+
+# Largest "Resume at toolkit plate round" of the stable protocol, which is written before any plan.
+# run() refuses rounds beyond the plan's swaps.
+STABLE_MAX_SWAP_ROUNDS = 12
+
+# Largest "Resume at fragment" of the stable protocol, run() refuses fragments beyond the plate's
+STABLE_MAX_INSERTS = 999
+
+# Reaction and thermocycler settings for protocols generated outside the GUI, same as its defaults
+DEFAULT_SETTINGS = {
+    "reaction_vol": 15.0,
+    "mm_per_reaction": 5.0,
+    "enzyme_per_reaction": 1.0,
+}
+DEFAULT_TC_STEPS = {
+    "step1_temp": 37, "step1_time": 900,
+    "step2_temp": 37, "step2_time": 90,
+    "step3_temp": 16, "step3_time": 180,
+    "step4_cycles": 25,
+    "step5_temp": 16, "step5_time": 1200,
+    "step6_temp": 50, "step6_time": 300,
+    "step7_temp": 65, "step7_time": 600,
+    "step8_temp": 4, "step8_time": 60,
+}
+
+def load_template(path=TEMPLATE_PATH):
+    with open(path) as f:
+        return f.read()
+
+def template_version(template):
+    # Generated protocols change whenever the template does
+    return hashlib.sha256(template.encode()).hexdigest()[:12]
+
+def count_tips(construct_table, construct_tubes):
+    # Tips needed before reaction volumes are known, all on the p20 (the ledger has exact counts)
+    return planner.count_plan_tips(construct_table, construct_tubes), 0
+
+def placements_summary(insert_locations, construct_tubes, master_mix, water_loc, enzyme_loc):
+    # Short description for compact protocols, the full placements go in the loading sheet
+    toolkit_plates = sorted({plate for plate, _ in insert_locations.values() if planner.is_toolkit_plate(plate)})
+    overflow_plates = {plate for plate, _ in insert_locations.values() if plate.startswith("overflow")}
+    on_temp_module = sum(1 for plate, _ in insert_locations.values() if plate == "tube_rack")
+    summary = (
+        f"{len(insert_locations)} fragments ({on_temp_module} on the Temp Module"
+        + (f", {len(overflow_plates)} overflow labware" if overflow_plates else "")
+        + (f", rest on {', '.join(toolkit_plates)} plates" if toolkit_plates else "")
+        + f"), {len(construct_tubes)} constructs in thermocycler wells "
+        + (f"{construct_tubes[0]}-{construct_tubes[-1]}" if construct_tubes else "(none)")
+        + f".\nMaster Mix [{master_mix}], Water [{water_loc}], Enzyme [{enzyme_loc}] on the Temp Module."
+        + "\nSee the loading sheet for every placement."
+    )
+    return summary
+
+def compact_plan(
+    construct_table, insert_locations, vol_per_insert_dict, construct_tubes, reagent_sources=None,
+    reaction_scale=None, replicate_splits=None
+):
+    # Fragments and reagent sources are written once, constructs and reactions refer to them by index
+    names = construct_table.fragments.names
+    reagent_sources = reagent_sources or {}
+    sources = sorted({tuple(source) for per_reaction in reagent_sources.values() for source in per_reaction if source})
+    source_ids = {source: i for i, source in enumerate(sources)}
+    return {
+        "fragments": names,
+        "locations": [list(insert_locations[name]) if name in insert_locations else None for name in names],
+        "volumes": [float(vol_per_insert_dict.get(name, 1)) for name in names],
+        "constructs": [list(construct_table.construct_ids(i)) for i in range(len(construct_table))],
+        "construct_tubes": list(construct_tubes),
+        "sources": [list(source) for source in sources],
+        **{
+            f"{reagent}_sources": [source_ids[tuple(source)] if source else None for source in per_reaction]
+            for reagent, per_reaction in reagent_sources.items()
+        },
+        "reaction_scale": list(reaction_scale or []),
+        # [building construct, constructs split into...]
+        "replicate_splits": [[idx, *members] for idx, members in (replicate_splits or {}).items()],
+    }
+
+def _plan_header(plan, compress):
+    if compress:
+        payload = json.dumps(plan, separators=(",", ":"))
+        blob = base64.b64encode(zlib.compress(payload.encode(), 9)).decode()
+        return (
+            "import base64, json, zlib\n"
+            f"_plan = json.loads(zlib.decompress(base64.b64decode('{blob}')))  # type: ignore\n"
+        )
+    return f"_plan = {plan!r}  # type: ignore\n"
+
+def render_script(
+    template, tube_placements, insert_locations, construct_table, construct_tubes,
+    master_mix, water_loc, enzyme_loc, vol_per_insert_dict, reaction_vol,
+    mm_per_reaction, enzyme_per_reaction, water_per_reaction, tc_steps,
+    compact=False, compress=False, ledger=None, overflow_labware=None, overflow_slots=None,
+    dilutions=None, start_message=None, toolkit_plate_slots=None, insert_major=False, toolkit_swaps=None,
+    batches=None, prep_plate_slot=None, enzyme_last=False
+):
+    # Without a ledger every reagent comes from its single tube and every transfer uses the p20
+    if ledger is None:
+        total_p20_tips, total_p300_tips = count_tips(construct_table, construct_tubes)
+        tip_rack_slots = {"p20": planner.AVAILABLE_SLOTS[:(total_p20_tips - 1) // 96 + 1], "p300": []}
+        n = len(construct_table)
+        reagent_sources = {
+            "master_mix": [("tube_rack", master_mix)] * n,
+            "water": [("tube_rack", water_loc)] * n,
+            "enzyme": [("tube_rack", enzyme_loc)] * n,
+        }
+        reservoir_slot = None
+        reaction_scale, replicate_splits = [1] * n, {}
+    else:
+        reagent_sources = ledger["per_reaction"]
+        reservoir_slot = ledger["reservoir_slot"]
+        total_p20_tips, total_p300_tips = ledger["tips"]["p20"], ledger["tips"]["p300"]
+        tip_rack_slots = ledger["tip_racks"]
+        reaction_scale, replicate_splits = ledger["scale"], ledger["splits"]
+
+    if compact:
+        # Data is decoded from one fragment table and index lists when the protocol loads
+        plan = compact_plan(
+            construct_table, insert_locations, vol_per_insert_dict, construct_tubes, reagent_sources,
+            reaction_scale, replicate_splits
+        )
+        data = dict(
+            plan_header=_plan_header(plan, compress),
+            tube_placements=placements_summary(insert_locations, construct_tubes, master_mix, water_loc, enzyme_loc),
+            inserts='{name: tuple(loc) for name, loc in zip(_plan["fragments"], _plan["locations"]) if loc}',
+            constructs='[[_plan["fragments"][i] for i in ids] for ids in _plan["constructs"]]',
+            vol_per_insert='dict(zip(_plan["fragments"], _plan["volumes"]))',
+            construct_tubes='_plan["construct_tubes"]',
+            vol_master_mix_per_reaction=f"[{mm_per_reaction}] * {len(construct_table)}",
+            **{
+                f"{reagent}_sources": (
+                    f'[tuple(_plan["sources"][i]) if i is not None else None for i in _plan["{reagent}_sources"]]'
+                )
+                for reagent in ("master_mix", "water", "enzyme")
+            },
+            reaction_scale='_plan["reaction_scale"]',
+            replicate_splits='{split[0]: split[1:] for split in _plan["replicate_splits"]}',
+        )
+    else:
+        data = dict(
+            plan_header="",
+            tube_placements=tube_placements,
+            inserts=insert_locations,
+            constructs=construct_table.to_lists(),
+            vol_per_insert=vol_per_insert_dict,
+            construct_tubes=construct_tubes,
+            vol_master_mix_per_reaction=[mm_per_reaction] * len(construct_table),
+            master_mix_sources=reagent_sources["master_mix"],
+            water_sources=reagent_sources["water"],
+            enzyme_sources=reagent_sources["enzyme"],
+            reaction_scale=reaction_scale,
+            replicate_splits=replicate_splits,
+        )
+
+    return template.format(
+        master_mix=master_mix,
+        mm_per_reaction=mm_per_reaction,
+        enzyme_per_reaction=enzyme_per_reaction,
+        enzyme_loc=enzyme_loc,
+        water_per_reaction=water_per_reaction,
+        total_p20_tips=total_p20_tips,
+        total_p300_tips=total_p300_tips,
+        reaction_vol=reaction_vol,
+        water_loc=water_loc,
+        reservoir_slot=repr(reservoir_slot),
+        tip_rack_slots=tip_rack_slots,
+        liquid_classes=liquids.LIQUID_CLASSES,
+        mix_classes=liquids.MIX_CLASSES,
+        pipette_specs=liquids.PIPETTES,
+        overflow_labware=repr(overflow_labware),
+        overflow_slots=overflow_slots or {},
+        toolkit_plate_slots=toolkit_plate_slots or {},
+        toolkit_swaps=toolkit_swaps or [],
+        dilutions=dilutions or [],
+        start_message=repr(start_message),
+        insert_major=bool(insert_major),
+        enzyme_last=bool(enzyme_last),
+        batch_sizes=batches or [len(construct_table)],
+        prep_plate_slot=repr(prep_plate_slot),
+        seconds_per_transfer=planner.SECONDS_PER_TRANSFER,
+        resume_construct_max="max(len(construct_tubes), 1)",
+        resume_round_max="max(len(toolkit_swaps), 1)",
+        resume_insert_max="max(len(inserts), 1)",
+        plan_parameter="",
+        load_plan="",
+        **{f"tc_{key}": value for key, value in tc_steps.items()},
+        **data,
+    )
+
+def render_stable_protocol(template):
+    # One protocol for every design: run() reads the plan from a CSV runtime parameter, so the
+    # file only changes with the template and is imported into the Opentrons App once
+    version = template_version(template)
+    empty = dict(
+        inserts={}, constructs=[], construct_tubes=[], vol_per_insert={}, vol_master_mix_per_reaction=[],
+        master_mix_sources=[], water_sources=[],
+        enzyme_sources=[], reservoir_slot=None, overflow_labware=None, overflow_slots={},
+        toolkit_plate_slots={}, toolkit_swaps=[], tip_rack_slots={"p20": [], "p300": []}, dilutions=[], start_message=None,
+        insert_major=False, enzyme_last=False, reaction_scale=[], replicate_splits={}, batch_sizes=[], prep_plate_slot=None,
+        seconds_per_transfer=planner.SECONDS_PER_TRANSFER, reaction_vol=0, enzyme_per_reaction=0,
+        **{f"tc_{key}": 0 for key in DEFAULT_TC_STEPS},
+    )
+    return template.format(
+        tube_placements=(
+            f"Golden Gate assembly, stable protocol {version} reading plan format {plan_csv.FORMAT_VERSION}. "
+            "Select the plan CSV written by the generator as the Plan parameter, its loading sheet lists every placement."
+        ),
+        plan_header=(
+            "import csv, io\n"
+            f"FORMAT_VERSION = {plan_csv.FORMAT_VERSION}\n\n"
+            + inspect.getsource(plan_csv.read_plan_csv)
+        ),
+        liquid_classes=liquids.LIQUID_CLASSES,
+        mix_classes=liquids.MIX_CLASSES,
+        pipette_specs=liquids.PIPETTES,
+        resume_construct_max=planner.PLATE_SIZE * planner.MAX_BATCHES,
+        resume_round_max=STABLE_MAX_SWAP_ROUNDS,
+        resume_insert_max=STABLE_MAX_INSERTS,
+        plan_parameter=(
+            "parameters.add_csv_file(\n"
+            "        variable_name=\"plan_csv\",\n"
+            "        display_name=\"Plan\",\n"
+            "        description=\"Plan CSV written by the generator for this design.\"\n"
+            "    )"
+        ),
+        load_plan="globals().update(read_plan_csv(protocol.params.plan_csv.contents))",
+        master_mix="", water_loc="", enzyme_loc="",
+        **{name: repr(value) for name, value in empty.items()},
+    )
+
+def render_plan_csv(
+    plan, reaction_vol, mm_per_reaction, enzyme_per_reaction, vol_per_insert_dict, tc_steps, insert_major=False,
+    enzyme_last=False
+):
+    # Rows of the plan CSV read by the stable protocol, the same data render_plan bakes into a script
+    ledger = source_ledger.build_ledger(
+        plan, reaction_vol, mm_per_reaction, enzyme_per_reaction, vol_per_insert_dict, insert_major, enzyme_last,
+        tc_steps,
+    )
+    return plan_csv.plan_rows(
+        plan["insert_locations"], plan["construct_table"], plan["construct_tubes"], plan["master_mix"],
+        plan["water_loc"], plan["enzyme_loc"], vol_per_insert_dict, reaction_vol, mm_per_reaction,
+        enzyme_per_reaction, tc_steps, ledger,
+        overflow_labware=planner.OVERFLOW_LABWARE[plan["overflow_labware"]]["load_name"],
+        overflow_slots=plan["overflow_slots"],
+        toolkit_plate_slots=plan["toolkit_plate_slots"],
+        toolkit_swaps=plan["toolkit_swaps"],
+        dilutions=plan.get("dilutions"),
+        start_message=plan.get("start_message"),
+        insert_major=insert_major,
+        batches=plan["batches"],
+        prep_plate_slot=plan["prep_plate_slot"],
+        enzyme_last=enzyme_last,
+    ), ledger
+
+def render_plan(
+    template, plan, reaction_vol, mm_per_reaction, enzyme_per_reaction,
+    vol_per_insert_dict, tc_steps, compact=False, compress=False, insert_major=False, enzyme_last=False
+):
+    # Render a plan from planner.build_plan with the reaction and thermocycler settings
+    construct_table = plan["construct_table"]
+    vol_by_id = planner.fragment_values(construct_table.fragments, vol_per_insert_dict)
+    water_per_reaction = planner.water_per_reaction(
+        construct_table, vol_by_id, reaction_vol, mm_per_reaction, enzyme_per_reaction
+    )
+    ledger = source_ledger.build_ledger(
+        plan, reaction_vol, mm_per_reaction, enzyme_per_reaction, vol_per_insert_dict, insert_major, enzyme_last,
+        tc_steps,
+    )
+    return render_script(
+        template, loading_sheet(plan, ledger), plan["insert_locations"], construct_table,
+        plan["construct_tubes"], plan["master_mix"], plan["water_loc"], plan["enzyme_loc"],
+        vol_per_insert_dict, reaction_vol, mm_per_reaction, enzyme_per_reaction,
+        water_per_reaction, tc_steps, compact=compact, compress=compress, ledger=ledger,
+        overflow_labware=planner.OVERFLOW_LABWARE[plan["overflow_labware"]]["load_name"],
+        overflow_slots=plan["overflow_slots"],
+        dilutions=plan.get("dilutions"),
+        start_message=plan.get("start_message"),
+        toolkit_plate_slots=plan["toolkit_plate_slots"],
+        insert_major=insert_major,
+        toolkit_swaps=plan["toolkit_swaps"],
+        batches=plan["batches"],
+        prep_plate_slot=plan["prep_plate_slot"],
+        enzyme_last=enzyme_last
+    )
+
+def loading_sheet(plan, ledger):
+    # Placements plus how much liquid goes in each source
+    return plan["tube_placements"] + "\n\n" + source_ledger.describe_ledger(ledger)
@@ -0,0 +1,109 @@
+import itertools
+import os
+import pandas as pd
+import planner
+
+# uL of a previous-level product used per reaction when the manifest gives none
+DEFAULT_PRODUCT_VOLUME = 2
+
+# Extra diluted product made per dilution well, on top of what the reactions draw (uL)
+DILUTION_OVERAGE = 0.1
+DILUTION_DEAD_VOLUME = 2
+
+# Thermocycler block limit, dilution wells sit on the same plate as the reactions
+MAX_WELL_VOLUME = 100
+
+def read_manifest(path_manifest):
+    # Hierarchy manifest CSV with one row per level: Level, Fragments, Constructs and optionally
+    # Dilution (fold, 1 = use products undiluted) and Product Volume (uL per reaction).
+    # Fragment and construct paths are relative to the manifest.
+    manifest = pd.read_csv(path_manifest).sort_values("Level", kind="stable")
+    base = os.path.dirname(os.path.abspath(path_manifest))
+    levels = []
+    for _, row in manifest.iterrows():
+        dilution = row["Dilution"] if "Dilution" in manifest.columns and not pd.isna(row["Dilution"]) else 1
+        product_vol = row["Product Volume"] if "Product Volume" in manifest.columns and not pd.isna(row["Product Volume"]) else DEFAULT_PRODUCT_VOLUME
+        levels.append({
+            "level": int(row["Level"]),
+            "fragments": os.path.join(base, str(row["Fragments"])),
+            "constructs": os.path.join(base, str(row["Constructs"])),
+            "dilution": float(dilution),
+            "product_volume": float(product_vol),
+        })
+    return levels
+
+def _dilution_volumes(uses, product_volume, dilution):
+    # Product and water (uL) to make enough diluted product for every use
+    total = uses * product_volume * (1 + DILUTION_OVERAGE) + DILUTION_DEAD_VOLUME
+    product = max(round(total / dilution, 1), 1.0)
+    water = round(product * (dilution - 1), 1)
+    return product, water
+
+def plan_hierarchy(levels, use_toolkit, toolkit_path=planner.TOOLKIT_PATH, overflow_labware="plate"):
+    # Plan every level of a multi-level assembly on one thermocycler plate. Each level builds its
+    # constructs in the wells after the previous level's products (and their dilutions), and uses
+    # those products as inserts straight from the thermocycler plate.
+    plans = []
+    product_wells = {}
+    next_well = 0
+    for idx, level in enumerate(levels):
+        dilutions = []
+        if product_wells and level["dilution"] > 1:
+            # Products of the previous level this level's constructs use get a dilution well after it
+            design = planner.read_design(level["fragments"], level["constructs"], use_toolkit, toolkit_path)
+            used = {
+                insert for _, inserts in itertools.islice(design["constructs"], planner.PLATE_SIZE)
+                for insert in inserts
+            }
+            diluted = dict(product_wells)
+            for name, well in product_wells.items():
+                if name in used:
+                    diluted[name] = planner.tc_well(next_well)
+                    dilutions.append((well, diluted[name]))
+                    next_well += 1
+            product_wells = diluted
+        if next_well >= planner.PLATE_SIZE:
+            raise ValueError(f"Level {level['level']} has no thermocycler wells left for its constructs")
+
+        plan = planner.build_plan(
+            level["fragments"], level["constructs"], use_toolkit, toolkit_path,
+            overflow_labware=overflow_labware, product_wells=product_wells, first_well=next_well,
+        )
+        construct_table = plan["construct_table"]
+        if plan["library_size"] > len(construct_table):
+            raise ValueError(
+                f"Level {level['level']} has {plan['library_size']} constructs but only "
+                f"{len(construct_table)} thermocycler wells are left"
+            )
+        for name in product_wells:
+            plan["vol_per_insert_dict"].setdefault(name, level["product_volume"])
+
+        # Only dilute products this level actually uses, sized for the number of uses
+        use_counts = planner.fragment_use_counts(construct_table)
+        plan["dilutions"] = []
+        for source_well, dilution_well in dilutions:
+            name = next(name for name, well in product_wells.items() if well == dilution_well)
+            if name not in construct_table.fragments:
+                continue
+            uses = int(use_counts[construct_table.fragments.ids[name]])
+            if uses == 0:
+                continue
+            product, water = _dilution_volumes(uses, plan["vol_per_insert_dict"][name], level["dilution"])
+            if product + water > MAX_WELL_VOLUME:
+                raise ValueError(
+                    f"Diluting {name} for {uses} reactions needs {product + water} uL, "
+                    f"more than a thermocycler well holds ({MAX_WELL_VOLUME} uL)"
+                )
+            plan["dilutions"].append((source_well, dilution_well, product, water))
+
+        if idx > 0:
+            plan["start_message"] = (
+                f"Level {level['level']}: leave the thermocycler plate from the previous level in place. "
+                "Replace tips, load the reagents and fragments for this level, then resume."
+            )
+        plan["level"] = level["level"]
+        plans.append(plan)
+
+        product_wells = dict(zip(construct_table.names, plan["construct_tubes"]))
+        next_well += len(construct_table)
+    return plans
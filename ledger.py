@@ -0,0 +1,273 @@
+import math
+import liquids
+import planner
+
+# Usable volume and dead volume (uL) of every source labware type
+LABWARE_VOLUMES = {
+    "tube_rack": {"capacity": 1500, "dead_volume": 20},  # 1.5 mL snapcap on the temp module block
+    "toolkit_plate": {"capacity": 200, "dead_volume": 10},  # nest_96_wellplate_200ul_flat
+    "reservoir": {"capacity": 15000, "dead_volume": 1000},  # nest_12_reservoir_15ml, per well
+    # Products of an earlier level, a well holds one reaction (or the diluted product made in it), see build_ledger
+    "tc_plate": {"capacity": 200, "dead_volume": 2},
+}
+
+# Extra liquid drawn per transfer (droplets, pipetting inaccuracy), as a fraction of the volume
+PIPETTING_OVERAGE = 0.05
+
+RESERVOIR_WELLS = [f"A{i + 1}" for i in range(12)]
+
+REAGENT_LABELS = {
+    "master_mix": "Master Mix",
+    "water": "Molecular Grade Water",
+    "enzyme": "Enzyme",
+}
+
+def _labware_volumes(labware, overflow_labware="plate"):
+    if labware.startswith("overflow"):
+        return planner.OVERFLOW_LABWARE[overflow_labware]
+    return LABWARE_VOLUMES.get(labware, LABWARE_VOLUMES["toolkit_plate"])
+
+def load_volume(consumed, labware, overflow_labware="plate"):
+    # Volume to put in a source so it never runs below its dead volume
+    dead_volume = _labware_volumes(labware, overflow_labware)["dead_volume"]
+    return math.ceil(consumed * (1 + PIPETTING_OVERAGE) + dead_volume)
+
+def _split(volumes, labware, wells):
+    # Fill sources in order, starting a new one once the next reaction would exhaust it
+    spec = LABWARE_VOLUMES[labware]
+    usable = spec["capacity"] - spec["dead_volume"]
+    sources = []
+    per_reaction = []
+    current = None
+    for idx, vol in enumerate(volumes):
+        drawn = vol * (1 + PIPETTING_OVERAGE)
+        if vol <= 0:
+            per_reaction.append(None)
+            continue
+        if current is None or current["drawn"] + drawn > usable:
+            if len(sources) == len(wells):
+                return None, None
+            current = {"labware": labware, "well": wells[len(sources)], "reactions": [], "consumed": 0.0, "drawn": 0.0}
+            sources.append(current)
+        current["reactions"].append(idx)
+        current["consumed"] += vol
+        current["drawn"] += drawn
+        per_reaction.append((labware, current["well"]))
+    for source in sources:
+        del source["drawn"]
+        source["load_volume"] = load_volume(source["consumed"], labware)
+    return sources, per_reaction
+
+def free_slots(plan, also_taken=()):
+    # Deck slots after the planned p20 tip racks not taken by toolkit plates, overflow labware or the prep plate
+    taken = set(plan["toolkit_plate_slots"].values()) | set(plan["overflow_slots"].values()) | set(also_taken)
+    taken.add(plan.get("prep_plate_slot"))
+    return [slot for slot in planner.AVAILABLE_SLOTS[plan["tip_racks"]:] if slot not in taken]
+
+def reservoir_slot(plan):
+    # First deck slot after tip racks not taken by a toolkit plate
+    slots = free_slots(plan)
+    return slots[0] if slots else None
+
+def plan_tip_racks(plan, volumes, constructs, insert_major=False, splits=None, enzyme_last=False):
+    # Tips per pipette for the run and the slots of their racks. The p20 racks take the slots
+    # reserved by the planner, the p300 (only used where it saves aspirations) gets a free slot if
+    # there is one. splits maps building wells to the volumes split from them. With pipelined
+    # batches the racks are refilled at every plate swap, so they hold the most tips used between
+    # two refills.
+    def racks(tips):
+        return (tips - 1) // 96 + 1 if tips > 0 else 0
+
+    dilutions = plan.get("dilutions", [])
+    splits = splits or {}
+    spare = free_slots(plan, [plan.get("reservoir_slot")])
+    batches = plan.get("batches", [len(constructs)])
+    for available in (("p20", "p300"), ("p20",)):
+        per_batch = [
+            liquids.count_tips(
+                volumes["water"][start:stop], volumes["master_mix"][start:stop], volumes["enzyme"][start:stop],
+                constructs[start:stop], dilutions if b == 0 else (), available, insert_major=insert_major,
+                splits=[splits.get(idx, ()) for idx in range(start, stop)], enzyme_last=enzyme_last,
+            )
+            for b, (start, stop) in enumerate(planner.batch_ranges(batches))
+        ]
+        tips = {name: sum(batch[name] for batch in per_batch) for name in liquids.PIPETTES}
+        refill = {
+            name: max(sum(per_batch[b][name] for b in period) for period in planner.tip_periods(batches))
+            for name in liquids.PIPETTES
+        }
+        if racks(refill["p300"]) <= len(spare):
+            break
+    if racks(refill["p20"]) > plan["tip_racks"]:
+        raise ValueError(f"The run needs {refill['p20']} p20 tips, more than the {plan['tip_racks']} racks planned")
+    return tips, {
+        "p20": planner.AVAILABLE_SLOTS[:racks(refill["p20"])],
+        "p300": spare[:racks(refill["p300"])],
+    }
+
+def build_ledger(
+    plan, reaction_vol, mm_per_reaction, enzyme_per_reaction, vol_per_insert_dict, insert_major=False, enzyme_last=False,
+    tc_steps=None
+):
+    # Per-source consumption for the whole run, splitting reagents across several tubes
+    # (or reservoir wells once the temp module is full) so no source runs dry. Replicates are
+    # assembled as one scaled reaction and split, so volumes are per well, not per reaction.
+    # tc_steps (the thermocycler program) times how long pipelined plates wait to start cycling.
+    construct_table = plan["construct_table"]
+    n = len(construct_table)
+    vol_by_id = planner.fragment_values(construct_table.fragments, vol_per_insert_dict)
+    insert_vols = planner.insert_volume_totals(construct_table, vol_by_id)
+    scale, splits = planner.replicate_scales(plan.get("replicates", []), n, reaction_vol)
+    water = reaction_vol - (mm_per_reaction + enzyme_per_reaction + insert_vols)
+    volumes = {
+        "master_mix": [mm_per_reaction * k for k in scale],
+        "water": [float(v) * k for v, k in zip(water, scale)],
+        "enzyme": [enzyme_per_reaction * k for k in scale],
+    }
+    primary = {"master_mix": plan["master_mix"], "water": plan["water_loc"], "enzyme": plan["enzyme_loc"]}
+
+    tubes = plan["construct_tubes"]
+    batches = plan.get("batches", [n])
+    labels = list(tubes)
+    if len(batches) > 1:
+        labels = [
+            f"{tubes[i]}, plate {b + 1}"
+            for b, (start, stop) in enumerate(planner.batch_ranges(batches)) for i in range(start, stop)
+        ]
+    cycle_seconds = planner.thermocycler_seconds(tc_steps) if tc_steps else 0
+    dilution_steps = 2 * len(plan.get("dilutions", []))
+    exposure, latency = planner.cycling_schedule(
+        construct_table.lengths(), batches, enzyme_last, splits, cycle_seconds, dilution_steps
+    )
+    exposure_last, _ = planner.cycling_schedule(
+        construct_table.lengths(), batches, True, splits, cycle_seconds, dilution_steps
+    )
+    ledger = {
+        "sources": {}, "per_reaction": {}, "fragments": [], "reservoir_slot": None, "warnings": [],
+        "scale": scale, "splits": splits, "batches": len(batches),
+        # {building well: wells split into} for the loading sheet
+        "replicates": {labels[idx]: [tubes[member] for member in members] for idx, members in splits.items()},
+        # {well: seconds its enzyme waits before its plate starts cycling}, the longest wait with the
+        # enzyme added last, and per plate the seconds from its first dispense until it starts cycling
+        "enzyme_exposure": dict(zip(labels, exposure)),
+        "enzyme_exposure_last": max(exposure_last, default=0),
+        "cycling_latency": latency,
+        "enzyme_last": enzyme_last,
+    }
+    free_tubes = list(plan["free_locations"])
+    free_reservoir_wells = list(RESERVOIR_WELLS)
+    for reagent in ("enzyme", "master_mix", "water"):
+        sources, per_reaction = _split(volumes[reagent], "tube_rack", [primary[reagent]] + free_tubes)
+        if sources is not None:
+            del free_tubes[:max(len(sources) - 1, 0)]
+        else:
+            sources, per_reaction = _split(volumes[reagent], "reservoir", free_reservoir_wells)
+            if sources is None:
+                raise ValueError(f"Not enough source capacity on deck for {REAGENT_LABELS[reagent]}")
+            del free_reservoir_wells[:len(sources)]
+        ledger["sources"][reagent] = sources
+        ledger["per_reaction"][reagent] = per_reaction
+
+    # On-deck dilutions of earlier-level products draw from the first water source
+    dilution_water = sum(water_vol for _, _, _, water_vol in plan.get("dilutions", []))
+    if dilution_water:
+        water_source = ledger["sources"]["water"][0] if ledger["sources"]["water"] else None
+        if water_source is None:
+            water_source = {"labware": "tube_rack", "well": plan["water_loc"], "reactions": [], "consumed": 0.0}
+            ledger["sources"]["water"].append(water_source)
+        water_source["consumed"] += dilution_water
+        water_source["load_volume"] = load_volume(water_source["consumed"], water_source["labware"])
+
+    if len(free_reservoir_wells) < len(RESERVOIR_WELLS):
+        ledger["reservoir_slot"] = reservoir_slot(plan)
+        if ledger["reservoir_slot"] is None:
+            raise ValueError("Reagents need a reservoir but no deck slot is free for it")
+
+    # Inserts in the order template.py pipettes them: those on swapped toolkit plates in rounds, one per plate
+    swaps = plan.get("toolkit_swaps", [])
+    swap_round = {
+        frag_id: swaps.index(plan["insert_locations"][name][0])
+        for frag_id, name in enumerate(construct_table.fragments.names)
+        if name in plan["insert_locations"] and plan["insert_locations"][name][0] in swaps
+    }
+    constructs = [
+        sorted(
+            [(frag_id, float(vol_by_id[frag_id]) * scale[i]) for frag_id in construct_table.construct_ids(i)],
+            key=lambda insert: swap_round.get(insert[0], 0),
+        ) if scale[i] else []
+        for i in range(n)
+    ]
+    ledger["tips"], ledger["tip_racks"] = plan_tip_racks(
+        dict(plan, reservoir_slot=ledger["reservoir_slot"]), volumes, constructs, insert_major,
+        {idx: [reaction_vol] * len(members) for idx, members in splits.items()}, enzyme_last,
+    )
+
+    # Fragments cannot be split without changing their placement, so only check them
+    use_counts = planner.fragment_use_counts(construct_table)
+    product_volumes = {dilution_well: product_vol + water_vol for _, dilution_well, product_vol, water_vol in plan.get("dilutions", [])}
+    for frag_id, name in enumerate(construct_table.fragments.names):
+        if use_counts[frag_id] == 0 or name not in plan["insert_locations"]:
+            continue
+        labware, well = plan["insert_locations"][name]
+        consumed = float(use_counts[frag_id] * vol_by_id[frag_id])
+        needed = load_volume(consumed, labware, plan["overflow_labware"])
+        capacity = _labware_volumes(labware, plan["overflow_labware"])["capacity"]
+        if labware == planner.TC_PLATE:
+            # Products are made on the plate, not loaded, so they are not rounded up to whole uL
+            capacity = product_volumes.get(well, reaction_vol)
+            needed = round(consumed * (1 + PIPETTING_OVERAGE) + LABWARE_VOLUMES[labware]["dead_volume"], 1)
+        ledger["fragments"].append({
+            "name": name, "labware": labware, "well": well,
+            "consumed": consumed, "load_volume": needed, "capacity": capacity,
+        })
+        if needed > capacity:
+            ledger["warnings"].append(
+                f"{name} [{well}] needs {needed} uL but the {labware} well holds {capacity} uL"
+            )
+    return ledger
+
+def describe_ledger(ledger):
+    # Loading sheet section: exactly how much to put in each source
+    lines = []
+    for pipette, slots in ledger.get("tip_racks", {}).items():
+        if slots:
+            refill = ", refilled at every plate swap" if ledger.get("batches", 1) > 1 else ""
+            lines.append(f"{pipette} tip racks ({ledger['tips'][pipette]} tips{refill}): Slot {', '.join(slots)}")
+    lines.append("Load volumes (include pipetting overage and dead volume):")
+    for reagent in REAGENT_LABELS:
+        for source in ledger["sources"].get(reagent, []):
+            where = "Temp Module" if source["labware"] == "tube_rack" else f"Reservoir, Slot {ledger['reservoir_slot']}"
+            lines.append(
+                f"[{source['well']}] ({where}): {REAGENT_LABELS[reagent]}, {source['load_volume']} uL "
+                f"for {sum(ledger['scale'][idx] for idx in source['reactions']):g} reactions"
+            )
+    for fragment in ledger["fragments"]:
+        if fragment["labware"] == "tube_rack":
+            where = "Temp Module"
+        elif fragment["labware"].startswith("overflow"):
+            where = fragment["labware"].replace("_", " ").capitalize()
+        else:
+            where = f"{fragment['labware']} Plate"
+        lines.append(f"[{fragment['well']}] ({where}): {fragment['name']}, at least {fragment['load_volume']} uL")
+    for well, members in ledger.get("replicates", {}).items():
+        lines.append(
+            f"[{well}] (Thermocycler): builds {len(members) + 1} replicate reactions, then splits into {', '.join(members)}"
+        )
+    if ledger.get("enzyme_exposure"):
+        well, seconds = max(ledger["enzyme_exposure"].items(), key=lambda item: item[1])
+        line = f"Enzyme waits up to {seconds / 60:.0f} min at room temperature before its plate starts cycling ({well})"
+        if not ledger["enzyme_last"] and ledger["enzyme_exposure_last"] < seconds:
+            line += f", {ledger['enzyme_exposure_last'] / 60:.0f} min with the enzyme added last"
+        lines.append(line)
+    if ledger.get("cycling_latency"):
+        minutes = ", ".join(f"{seconds / 60:.0f}" for seconds in ledger["cycling_latency"])
+        if len(ledger["cycling_latency"]) == 1:
+            lines.append(f"Cycling starts about {minutes} min after the first dispense")
+        else:
+            lines.append(
+                f"Cycling starts about {minutes} min after each plate's first dispense "
+                "(later plates wait for the program of the plate before, plus the plate swap)"
+            )
+    for warning in ledger["warnings"]:
+        lines.append(f"WARNING: {warning}")
+    return "\n".join(lines)
@@ -0,0 +1,103 @@
+import math
+
+# Handling per liquid: flow rates as a fraction of the pipette default, delay after aspirating (s),
+# air gap (uL) and whether to blow out and touch tip after dispensing
+LIQUID_CLASSES = {
+    "water": {"aspirate_rate": 1.0, "dispense_rate": 1.0, "delay": 0, "air_gap": 0, "blow_out": False, "touch_tip": False},
+    "master_mix": {"aspirate_rate": 0.5, "dispense_rate": 0.5, "delay": 0.5, "air_gap": 0, "blow_out": True, "touch_tip": True},
+    # Enzymes are stored in 50% glycerol, slow plungers and a pause let the viscous liquid follow
+    "enzyme": {"aspirate_rate": 0.2, "dispense_rate": 0.2, "delay": 1.5, "air_gap": 0, "blow_out": False, "touch_tip": True},
+    # Inserts are mixed (with blow out and touch tip) after the last one, an air gap stops drips between labware
+    "dna": {"aspirate_rate": 1.0, "dispense_rate": 1.0, "delay": 0, "air_gap": 1, "blow_out": False, "touch_tip": False},
+    # A finished reaction (glycerol from the enzyme) split from the well that built it into replicate wells
+    "reaction": {"aspirate_rate": 0.5, "dispense_rate": 0.5, "delay": 0.5, "air_gap": 0, "blow_out": True, "touch_tip": True},
+}
+
+# Mixing per liquid being mixed: each stroke moves fraction of the well volume (at most what the pipette
+# holds), and strokes repeat until turnovers well volumes went through the tip, within min_reps and
+# max_reps. Flow rates are multiples of the pipette default. The tip aspirates 1 mm above the bottom
+# and dispenses at dispense_depth of a liquid height that errs low (never below the aspirate
+# height), so it stays below the surface and no droplets are left on the wall. A finished reaction
+# holds the enzyme's glycerol and gets more strokes.
+MIX_CLASSES = {
+    "dna": {"fraction": 0.5, "turnovers": 1, "min_reps": 2, "max_reps": 6, "aspirate_rate": 4, "dispense_rate": 6,
+            "dispense_depth": 0.7, "blow_out": True, "touch_tip": False},
+    "reaction": {"fraction": 0.5, "turnovers": 1.5, "min_reps": 3, "max_reps": 8, "aspirate_rate": 3, "dispense_rate": 4,
+                 "dispense_depth": 0.7, "blow_out": True, "touch_tip": True},
+}
+
+# Largest volume per aspiration and smallest volume each pipette dispenses accurately (uL). When one
+# aspiration serves several wells, min_volume extra is drawn and returned to the source, like the
+# disposal volume of the Opentrons distribute()
+PIPETTES = {
+    "p20": {"max_volume": 20, "min_volume": 1},
+    "p300": {"max_volume": 300, "min_volume": 30},
+}
+
+def choose_pipette(vol, liquid, available=("p20", "p300")):
+    # Pipette and number of aspirations for one transfer: the fewest aspirations among pipettes
+    # accurate at the split volume, the smaller pipette on a tie. template.py has the same rule.
+    best = None
+    for name in available:
+        usable = PIPETTES[name]["max_volume"] - LIQUID_CLASSES[liquid]["air_gap"]
+        count = max(math.ceil(vol / usable), 1)
+        if vol / count < PIPETTES[name]["min_volume"] and name != "p20":
+            continue
+        if best is None or count < best[1]:
+            best = (name, count)
+    return best
+
+def count_tips(
+    water_vols, mm_vols, enzyme_vols, constructs, dilutions=(), available=("p20", "p300"), insert_major=False,
+    splits=(), enzyme_last=False
+):
+    # Tips per pipette for a whole run, as used by template.py: one tip per pipette for all water
+    # and for all master mix, one per enzyme transfer and diluted product. Inserts take one tip
+    # each, or with insert_major one per fragment and pipette. constructs holds the (fragment, uL)
+    # inserts of each well in the order they are pipetted, empty for wells filled by splitting a
+    # replicate reaction. splits holds the volumes split from each well (empty for most).
+    # The tip adding a well's last component (the enzyme with enzyme_last, else the last insert)
+    # mixes it and splits it too if it is on the pipette the split needs. Insert-major wells
+    # without enzyme_last are mixed (and split) with a fresh tip.
+    tips = {name: 0 for name in PIPETTES}
+
+    def shared_tip(vols, liquid):
+        for name in {choose_pipette(vol, liquid, available)[0] for vol in vols if vol > 0}:
+            tips[name] += 1
+
+    def own_tips(vols, liquid):
+        for vol in vols:
+            if vol > 0:
+                tips[choose_pipette(vol, liquid, available)[0]] += 1
+
+    shared_tip([water_vol for _, _, _, water_vol in dilutions], "water")
+    own_tips([product_vol for _, _, product_vol, _ in dilutions], "dna")
+    shared_tip(water_vols, "water")
+    shared_tip(mm_vols, "master_mix")
+    if enzyme_last:
+        for vol, inserts in zip(enzyme_vols, constructs):
+            if inserts:
+                tips[choose_pipette(vol, "enzyme", available)[0]] += 1
+    else:
+        own_tips(enzyme_vols, "enzyme")
+    if insert_major:
+        for _, name in {(frag, choose_pipette(vol, "dna", available)[0]) for inserts in constructs for frag, vol in inserts}:
+            tips[name] += 1
+    else:
+        own_tips([vol for inserts in constructs for _, vol in inserts], "dna")
+    for i, inserts in enumerate(constructs):
+        if not inserts:
+            continue
+        if enzyme_last:
+            finisher = choose_pipette(enzyme_vols[i], "enzyme", available)[0]
+        elif insert_major:
+            finisher = None
+        else:
+            finisher = choose_pipette(inserts[-1][1], "dna", available)[0]
+        split_vols = splits[i] if i < len(splits) else ()
+        splitter = choose_pipette(split_vols[0], "reaction", available)[0] if split_vols else None
+        if finisher is None:
+            tips[splitter or choose_pipette(sum(vol for _, vol in inserts), "dna", available)[0]] += 1
+        elif splitter and splitter != finisher:
+            tips[splitter] += 1
+    return tips
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import generator
+import planner
+
+CACHE_DIR = ".protocol_cache"
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# Bump when the plan built by planner.build_plan changes shape, so old entries are not reused
+PLAN_VERSION = 9
+
+def _normalized_bytes(path):
+    # Line endings and trailing whitespace do not change the plan
+    with open(path, "rb") as f:
+        data = f.read()
+    lines = data.replace(b"\r\n", b"\n").split(b"\n")
+    return b"\n".join(line.rstrip() for line in lines).strip()
+
+def plan_key(
+    path_fragments, path_constructs, use_toolkit, toolkit_path=planner.TOOLKIT_PATH, overflow_labware="plate",
+    registry=None, target_fmol=planner.DEFAULT_TARGET_FMOL, batches=1, cycle_seconds=None
+):
+    # Plans built against a location registry change whenever a registered position does
+    registry_state = f"{registry.path}@{registry.version()}" if registry is not None else "none"
+    h = hashlib.sha256(
+        f"plan-v{PLAN_VERSION}|toolkit={bool(use_toolkit)}|overflow={overflow_labware}|registry={registry_state}"
+        f"|fmol={target_fmol}|batches={batches}|cycle={cycle_seconds}".encode()
+    )
+    paths = planner.as_path_list(path_fragments) + planner.as_path_list(path_constructs)
+    paths += [toolkit_path] if use_toolkit else []
+    for path in paths:
+        h.update(b"\0")
+        h.update(_normalized_bytes(path))
+    return h.hexdigest()
+
+def script_key(key, template, render_params):
+    h = hashlib.sha256(key.encode())
+    h.update(generator.template_version(template).encode())
+    h.update(json.dumps(render_params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+class ProtocolCache:
+    # Plans are keyed on the input files only, so changing reaction or thermocycler
+    # settings re-renders from the cached plan. Least recently used entries are
+    # evicted once the cache grows past max_bytes.
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, key + ext)
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        os.utime(path)  # mark as recently used
+        return data
+
+    def _write(self, path, data):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Unique per writer, several threads of the protocol service may write the same entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # removed by another writer
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def get_plan(
+        self, path_fragments, path_constructs, use_toolkit, toolkit_path=planner.TOOLKIT_PATH, overflow_labware="plate",
+        registry=None, target_fmol=planner.DEFAULT_TARGET_FMOL, batches=1, cycle_seconds=None
+    ):
+        key = plan_key(
+            path_fragments, path_constructs, use_toolkit, toolkit_path, overflow_labware, registry, target_fmol,
+            batches, cycle_seconds
+        )
+        path = self._path(key, ".plan")
+        data = self._read(path)
+        if data is not None:
+            try:
+                return key, pickle.loads(data)
+            except Exception:
+                pass  # unreadable entry, plan again and overwrite it
+        plan = planner.build_plan(
+            path_fragments, path_constructs, use_toolkit, toolkit_path, overflow_labware, registry=registry,
+            target_fmol=target_fmol, batches=batches, cycle_seconds=cycle_seconds
+        )
+        if registry is not None:
+            # Planning records the plan's positions, which may bump the registry version. The plan
+            # is what the same inputs give against the registry as it is now, so it is kept under that.
+            key = plan_key(
+                path_fragments, path_constructs, use_toolkit, toolkit_path, overflow_labware, registry, target_fmol,
+                batches, cycle_seconds
+            )
+            path = self._path(key, ".plan")
+        self._write(path, pickle.dumps(plan))
+        return key, plan
+
+    def get_script(self, key, plan, template, **render_params):
+        path = self._path(script_key(key, template, render_params), ".py")
+        data = self._read(path)
+        if data is not None:
+            return data.decode()
+        script = generator.render_plan(template, plan, **render_params)
+        self._write(path, script.encode())
+        return script
@@ -0,0 +1,125 @@
+import csv
+import io
+
+# Bumped whenever the rows below change, the stable protocol refuses plan files of another format
+FORMAT_VERSION = 7
+
+# Plan CSV for the stable protocol, one row per item with the kind of row first:
+#   setting,<name>,<value>                 reaction and reagent settings, tc,<step key>,<value> likewise
+#   tip_rack,<pipette>,<slot>              toolkit_plate,<plate>,<slot>    overflow,<name>,<slot>
+#   toolkit_swap,<plate>                   plates sharing the swap slot, in the order they are asked for
+#   fragment,<name>,<labware>,<well>,<uL>
+#   construct,<well>,<reactions in the well>,<master mix uL>,<master mix labware>,<well>,<water labware>,
+#             <well>,<enzyme labware>,<well>,<fragment>,<fragment>,...
+#   replicate,<construct building the reactions>,<construct split into>,...   (construct numbers from 1)
+#   batch,<constructs>                     constructs per pipelined plate, in order
+#   dilution,<product well>,<dilution well>,<product uL>,<water uL>
+# Empty labware and well cells mean no source (no water needed for that reaction).
+SETTINGS = ("format", "reaction_vol", "enzyme_per_reaction", "master_mix", "water_loc", "enzyme_loc",
+            "reservoir_slot", "overflow_labware", "start_message", "insert_major", "prep_plate_slot",
+            "enzyme_last")
+
+def _source_cells(source):
+    return list(source) if source else ["", ""]
+
+def plan_rows(
+    insert_locations, construct_table, construct_tubes, master_mix, water_loc, enzyme_loc,
+    vol_per_insert_dict, reaction_vol, mm_per_reaction, enzyme_per_reaction, tc_steps, ledger,
+    overflow_labware=None, overflow_slots=None, toolkit_plate_slots=None, dilutions=None, start_message=None,
+    insert_major=False, toolkit_swaps=None, batches=None, prep_plate_slot=None, enzyme_last=False
+):
+    settings = {
+        "format": FORMAT_VERSION, "reaction_vol": reaction_vol, "enzyme_per_reaction": enzyme_per_reaction,
+        "master_mix": master_mix, "water_loc": water_loc, "enzyme_loc": enzyme_loc,
+        "reservoir_slot": ledger["reservoir_slot"] or "", "overflow_labware": overflow_labware or "",
+        "start_message": start_message or "", "insert_major": int(bool(insert_major)),
+        "prep_plate_slot": prep_plate_slot or "", "enzyme_last": int(bool(enzyme_last)),
+    }
+    rows = [["setting", name, settings[name]] for name in SETTINGS]
+    rows += [["tc", key, value] for key, value in tc_steps.items()]
+    rows += [["tip_rack", pipette, slot] for pipette, slots in ledger["tip_racks"].items() for slot in slots]
+    rows += [["toolkit_plate", plate, slot] for plate, slot in (toolkit_plate_slots or {}).items()]
+    rows += [["toolkit_swap", plate] for plate in toolkit_swaps or []]
+    rows += [["overflow", name, slot] for name, slot in (overflow_slots or {}).items()]
+    for name in construct_table.fragments.names:
+        if name in insert_locations:
+            rows.append(["fragment", name, *insert_locations[name], float(vol_per_insert_dict.get(name, 1))])
+    sources = ledger["per_reaction"]
+    for idx, (well, inserts) in enumerate(zip(construct_tubes, construct_table.to_lists())):
+        rows.append([
+            "construct", well, ledger["scale"][idx], mm_per_reaction, *_source_cells(sources["master_mix"][idx]),
+            *_source_cells(sources["water"][idx]), *_source_cells(sources["enzyme"][idx]), *inserts,
+        ])
+    # Wells repeat on every pipelined plate, so replicates refer to construct numbers
+    rows += [["replicate", idx + 1, *(member + 1 for member in members)] for idx, members in ledger["splits"].items()]
+    rows += [["batch", size] for size in batches or [len(construct_tubes)]]
+    rows += [["dilution", *dilution] for dilution in dilutions or []]
+    return rows
+
+def write_plan_csv(path, rows):
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+def read_plan_csv(text):
+    # Variables of template.py from a plan CSV. Copied into the stable protocol by the generator,
+    # so only the standard library is used here.
+    plan = {
+        "inserts": {}, "vol_per_insert_dict": {}, "constructs": [], "construct_tubes": [],
+        "vol_master_mix_per_reaction": [], "master_mix_sources": [], "water_sources": [], "enzyme_sources": [],
+        "tip_rack_slots": {"p20": [], "p300": []}, "toolkit_plate_slots": {}, "toolkit_swaps": [], "overflow_slots": {}, "dilutions": [],
+        "reaction_scale": [], "replicate_splits": {}, "batch_sizes": [],
+    }
+
+    def source(labware, well):
+        return (labware, well) if labware else None
+
+    for row in csv.reader(io.StringIO(text)):
+        if not row:
+            continue
+        kind, name, values = row[0], row[1], row[2:]
+        if kind == "setting":
+            plan[name] = values[0]
+        elif kind == "tc":
+            plan[f"tc_{name}"] = float(values[0])
+        elif kind == "tip_rack":
+            plan["tip_rack_slots"][name].append(values[0])
+        elif kind == "toolkit_plate":
+            plan["toolkit_plate_slots"][name] = values[0]
+        elif kind == "toolkit_swap":
+            plan["toolkit_swaps"].append(name)
+        elif kind == "overflow":
+            plan["overflow_slots"][name] = values[0]
+        elif kind == "fragment":
+            plan["inserts"][name] = (values[0], values[1])
+            plan["vol_per_insert_dict"][name] = float(values[2])
+        elif kind == "construct":
+            plan["construct_tubes"].append(name)
+            plan["reaction_scale"].append(float(values[0]))
+            plan["vol_master_mix_per_reaction"].append(float(values[1]))
+            plan["master_mix_sources"].append(source(values[2], values[3]))
+            plan["water_sources"].append(source(values[4], values[5]))
+            plan["enzyme_sources"].append(source(values[6], values[7]))
+            plan["constructs"].append(values[8:])
+        elif kind == "replicate":
+            plan["replicate_splits"][int(name) - 1] = [int(member) - 1 for member in values]
+        elif kind == "batch":
+            plan["batch_sizes"].append(int(name))
+        elif kind == "dilution":
+            plan["dilutions"].append((name, values[0], float(values[1]), float(values[2])))
+        else:
+            raise ValueError(f"Unknown row in plan file: {kind}")
+    if int(plan.get("format", 0)) != FORMAT_VERSION:
+        raise ValueError(
+            f"Plan file has format {plan.get('format')}, this protocol reads format {FORMAT_VERSION}. "
+            "Regenerate the plan file or import the matching stable protocol."
+        )
+    plan["reaction_vol"] = float(plan["reaction_vol"])
+    plan["enzyme_per_reaction"] = float(plan["enzyme_per_reaction"])
+    plan["reservoir_slot"] = plan["reservoir_slot"] or None
+    plan["overflow_labware"] = plan["overflow_labware"] or None
+    plan["start_message"] = plan["start_message"] or None
+    plan["insert_major"] = plan["insert_major"] == "1"
+    plan["prep_plate_slot"] = plan["prep_plate_slot"] or None
+    plan["enzyme_last"] = plan["enzyme_last"] == "1"
+    del plan["format"]
+    return plan
@@ -0,0 +1,951 @@
+import itertools
+import math
+import os
+import sys
+from array import array
+import numpy as np
+import pandas as pd
+
+# Prefix for a constructs CSV cell that references every fragment in a bin,
+# e.g. "bin:2" expands to all fragments whose Bin column is 2
+BIN_PREFIX = "bin:"
+
+# The thermocycler plate holds 96 reactions, libraries are sharded into plates of this size
+PLATE_SIZE = 96
+
+# Most plates cycled one after another in a pipelined run
+MAX_BATCHES = 6
+
+# Rows parsed at a time when streaming a constructs export
+CHUNK_SIZE = 10000
+
+def _bin_key(val):
+    # Normalize Bin values so 2, 2.0 and "2" all refer to the same bin
+    if isinstance(val, float) and val.is_integer():
+        val = int(val)
+    return str(val).strip()
+
+def fragments_by_bin(bin_dict):
+    # Group fragment names by Bin value, keeping fragments CSV order within each bin
+    bins = {}
+    for frag_name, bin_val in bin_dict.items():
+        if pd.isna(bin_val):
+            continue
+        bins.setdefault(_bin_key(bin_val), []).append(frag_name)
+    return bins
+
+def _as_chunks(constructs_df):
+    # Accept either a whole DataFrame or an iterable of DataFrame chunks
+    if isinstance(constructs_df, pd.DataFrame):
+        return [constructs_df]
+    return constructs_df
+
+def construct_cells(chunk):
+    # Fragment cells of a constructs chunk as a long table: the row and cell code of every non-empty
+    # cell after the first column, in row then column order, and the distinct stripped cells the
+    # codes refer to. Ragged rows leave NaN or blank cells, dropped here in bulk, and each distinct
+    # cell is parsed once however many rows use it.
+    values = chunk.iloc[:, 1:].to_numpy(dtype=object)
+    rows, positions = np.nonzero(pd.notna(values))
+    codes, uniques = pd.factorize(values[rows, positions])
+    cells = [str(cell).strip() for cell in uniques]
+    keep = ~np.array([cell == "" for cell in cells], dtype=bool)[codes] if cells else np.ones(0, dtype=bool)
+    return rows[keep], codes[keep], cells
+
+def bin_references(cells, bins):
+    # Bin key of every cell that references a bin ("bin:<value>"), None for a plain fragment
+    keys = [_bin_key(cell[len(BIN_PREFIX):]) if cell.lower().startswith(BIN_PREFIX) else None for cell in cells]
+    for key in keys:
+        if key is not None and key not in bins:
+            raise ValueError(f"Combination rule references unknown bin '{key}'")
+    return keys
+
+def count_constructs(constructs_df, bin_dict):
+    # Size of the library described by the constructs table, without expanding it: the product
+    # of each row's options (1 per fragment, the bin size per bin reference), summed over rows
+    bins = fragments_by_bin(bin_dict)
+    total = 0
+    for chunk in _as_chunks(constructs_df):
+        rows, codes, cells = construct_cells(chunk)
+        options = np.array([len(bins[key]) if key is not None else 1 for key in bin_references(cells, bins)], dtype=np.int64)
+        per_row = np.ones(len(chunk), dtype=np.int64)
+        if len(options):
+            options = options[codes]
+            multiple = options > 1
+            np.multiply.at(per_row, rows[multiple], options[multiple])
+        total += int(per_row.sum())
+    return total
+
+def iter_constructs(constructs_df, bin_dict):
+    # Lazily yield (construct_name, [fragment, ...]) for every construct in the table.
+    # Rows without bin references yield a single construct, as before.
+    bins = fragments_by_bin(bin_dict)
+    n = 0
+    for chunk in _as_chunks(constructs_df):
+        names = chunk["Name"].to_numpy(dtype=object) if "Name" in chunk.columns else None
+        rows, codes, cells = construct_cells(chunk)
+        keys = bin_references(cells, bins)
+        referenced = np.array([key is not None for key in keys], dtype=bool)
+        row_has_bin = np.zeros(len(chunk), dtype=bool)
+        if len(referenced):
+            row_has_bin[rows[referenced[codes]]] = True
+        bounds = np.searchsorted(rows, np.arange(len(chunk) + 1)).tolist()
+        codes = codes.tolist()
+        for row in range(len(chunk)):
+            row_codes = codes[bounds[row]:bounds[row + 1]]
+            if not row_has_bin[row]:
+                # Plain fragment names, one construct
+                name = names[row] if names is not None else f"Construct {n + 1}"
+                n += 1
+                yield name, [cells[code] for code in row_codes]
+                continue
+            slots = [bins[keys[code]] if keys[code] is not None else [cells[code]] for code in row_codes]
+            is_library = any(len(options) > 1 for options in slots)
+            for combo in itertools.product(*slots):
+                if is_library:
+                    name = "-".join(combo)
+                elif names is not None:
+                    name = names[row]
+                else:
+                    name = f"Construct {n + 1}"
+                n += 1
+                yield name, list(combo)
+
+def _keep_construct_column(col):
+    # Overhang and Status columns are never needed for planning, skip them while parsing
+    return "Overhang" not in col and col != "Status"
+
+def read_construct_chunks(path_constructs, chunksize=CHUNK_SIZE):
+    # Stream a constructs export as DataFrame chunks instead of loading it whole
+    return pd.read_csv(
+        path_constructs,
+        usecols=_keep_construct_column,
+        dtype=str,
+        chunksize=chunksize,
+    )
+
+class FragmentIndex:
+    # Interns fragment names: each name is stored once and referred to by an integer ID
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        frag_id = self.ids.get(name)
+        if frag_id is None:
+            name = sys.intern(str(name))
+            frag_id = len(self.names)
+            self.ids[name] = frag_id
+            self.names.append(name)
+        return frag_id
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+class ConstructTable:
+    # Integer-encoded constructs: the fragment IDs of construct i are
+    # ids[offsets[i]:offsets[i + 1]], names only live in the FragmentIndex
+    def __init__(self, fragments=None):
+        self.fragments = fragments if fragments is not None else FragmentIndex()
+        self.offsets = array("I", [0])
+        self.ids = array("I")
+        self.names = []
+
+    @classmethod
+    def from_stream(cls, constructs, fragments=None, limit=None):
+        table = cls(fragments)
+        for name, inserts in itertools.islice(constructs, limit):
+            table.append(name, inserts)
+        return table
+
+    def append(self, name, inserts):
+        for insert in inserts:
+            self.ids.append(self.fragments.intern(insert))
+        self.offsets.append(len(self.ids))
+        self.names.append(name)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def construct_ids(self, i):
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def inserts(self, i):
+        return [self.fragments.names[frag_id] for frag_id in self.construct_ids(i)]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.names[i], self.inserts(i)
+
+    def lengths(self):
+        # Number of inserts per construct
+        return np.diff(np.frombuffer(self.offsets, dtype=np.uint32)).astype(np.int64)
+
+    def id_array(self):
+        return np.frombuffer(self.ids, dtype=np.uint32)
+
+    def row_index(self):
+        # Construct index of every entry in ids, for grouped sums with bincount
+        return np.repeat(np.arange(len(self)), self.lengths())
+
+    def take(self, order):
+        # New table holding the constructs in the given order, sharing the fragment index
+        table = ConstructTable(self.fragments)
+        for i in order:
+            table.ids.extend(self.construct_ids(i))
+            table.offsets.append(len(table.ids))
+            table.names.append(self.names[i])
+        return table
+
+    def slice(self, start, stop):
+        # Contiguous shard of the table, e.g. one 96-well plate of a library
+        return self.take(range(start, min(stop, len(self))))
+
+    def to_lists(self):
+        return [self.inserts(i) for i in range(len(self))]
+
+def fragment_values(fragments, values, default=1.0):
+    # Array indexed by fragment ID from a {fragment_name: value} mapping
+    return np.array([float(values.get(name, default)) for name in fragments.names], dtype=float)
+
+def insert_volume_totals(table, vol_by_id):
+    # Total insert volume per construct
+    return np.bincount(table.row_index(), weights=vol_by_id[table.id_array()], minlength=len(table))
+
+def water_per_reaction(table, vol_by_id, reaction_vol, mm_per_reaction, enzyme_per_reaction):
+    water = reaction_vol - (mm_per_reaction + enzyme_per_reaction + insert_volume_totals(table, vol_by_id))
+    return [round(float(v), 2) for v in water]
+
+def fragment_use_counts(table):
+    # Number of constructs each fragment ID is pipetted into
+    return np.bincount(table.id_array(), minlength=len(table.fragments))
+
+# Most liquid a scaled-up replicate reaction may hold in one PCR well, leaving room to mix (uL)
+MAX_SCALED_REACTION = 160
+
+# Extra reaction assembled in a building well for every replicate split from it, as a fraction of
+# one reaction, so the well keeps a full reaction after mixing and what the split tips retain
+REPLICATE_EXCESS = 0.1
+
+def replicate_groups(table, batches=None):
+    # Constructs with the same inserts (in any order) as lists of construct indices, only
+    # groups with more than one member. Replicates are only grouped within a batch (plate).
+    groups = {}
+    for batch, (start, stop) in enumerate(batch_ranges(batches or [len(table)])):
+        for i in range(start, stop):
+            groups.setdefault((batch, *sorted(table.construct_ids(i))), []).append(i)
+    return [group for group in groups.values() if len(group) > 1]
+
+def replicate_scales(groups, n, reaction_vol):
+    # Reactions assembled in each well and {building well index: indices filled by splitting}.
+    # The first replicate builds the reaction for its group (scale k plus REPLICATE_EXCESS per
+    # split), the others get theirs by splitting (scale 0). Groups are cut so a scaled reaction
+    # stays within MAX_SCALED_REACTION.
+    scale = [1] * n
+    splits = {}
+    per_well = max(int((MAX_SCALED_REACTION + REPLICATE_EXCESS * reaction_vol) // ((1 + REPLICATE_EXCESS) * reaction_vol)), 1)
+    for group in groups:
+        for start in range(0, len(group), per_well):
+            chunk = group[start:start + per_well]
+            if len(chunk) < 2:
+                continue
+            scale[chunk[0]] = round(len(chunk) + REPLICATE_EXCESS * (len(chunk) - 1), 6)
+            for idx in chunk[1:]:
+                scale[idx] = 0
+            splits[chunk[0]] = chunk[1:]
+    return scale, splits
+
+# Toolkit well assignments shipped with the repo
+TOOLKIT_PATH = "toolkit_data.csv"
+
+# Deck slots shared by tip racks and toolkit plates, as in template.py
+AVAILABLE_SLOTS = ["1", "2", "3", "5", "6", "9"]
+
+# Parsed toolkit CSVs by path, reloaded when the file changes
+_toolkit_indexes = {}
+
+def load_toolkit_index(toolkit_path=TOOLKIT_PATH):
+    # {toolkit_name: {plasmid_name: position}}, kept in memory between plans
+    mtime = os.path.getmtime(toolkit_path)
+    cached = _toolkit_indexes.get(toolkit_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    toolkit_df = pd.read_csv(toolkit_path)
+    # Build a mapping: {plate: {plasmid_name: position}}, plates in order of first appearance
+    toolkit_locations = {
+        plate: dict(zip(group["Name"], group["Position"]))
+        for plate, group in toolkit_df.groupby(toolkit_df["Plate"].astype(str), sort=False)
+    }
+    _toolkit_indexes[toolkit_path] = (mtime, toolkit_locations)
+    return toolkit_locations
+
+def match_toolkit_wells(fragment_names, toolkit_path=TOOLKIT_PATH):
+    toolkit_plate_wells = {}  # {fragment_name: (plate, position)}
+    toolkit_locations = load_toolkit_index(toolkit_path)
+    toolkit_keys = toolkit_locations.keys()
+
+    # For each fragment, if its name contains a toolkit key, and matches a toolkit entry, assign it
+    for frag_name in fragment_names:
+        found = False
+        for toolkit in toolkit_keys:
+            if toolkit in frag_name:
+                # Try to find a matching toolkit entry for this fragment
+                for plasmid_name, position in toolkit_locations[toolkit].items():
+                    if plasmid_name in frag_name:
+                        toolkit_plate_wells[frag_name] = (toolkit, position)
+                        found = True
+                        break
+            if found:
+                break
+    return toolkit_plate_wells
+
+# Temperature module block positions, row A sits closest to the thermocycler
+TEMP_MODULE_LOCATIONS = [f"{chr(65 + i // 6)}{i % 6 + 1}" for i in range(24)]
+
+# Positions on the temperature module kept for master mix, water and enzyme
+NUM_REAGENT_TUBES = 3
+
+# Deck slots ordered by distance to the thermocycler plate (slot 7)
+SLOT_PROXIMITY = ["5", "9", "1", "6", "2", "3"]
+
+# Secondary labware for custom fragments that do not fit on the temperature module
+OVERFLOW_LABWARE = {
+    "plate": {"load_name": "nest_96_wellplate_200ul_flat", "rows": 8, "columns": 12, "capacity": 200, "dead_volume": 10},
+    "tube_rack": {"load_name": "opentrons_24_tuberack_nest_1.5ml_snapcap", "rows": 4, "columns": 6, "capacity": 1500, "dead_volume": 20},
+}
+
+# Products of an earlier assembly level, pipetted straight from the thermocycler plate
+TC_PLATE = "tc_plate"
+
+# Seconds per pipetting step (tip pickup, transfer, mix and drop), for runtime estimates
+SECONDS_PER_TRANSFER = 25
+
+def thermocycler_seconds(tc_steps):
+    # Hold times of the thermocycler program in template.py, cycling steps 2 and 3
+    t = {key: int(float(value or 0)) for key, value in tc_steps.items() if key.endswith(("_time", "_cycles"))}
+    return (
+        t.get("step1_time", 0) + t.get("step4_cycles", 0) * (t.get("step2_time", 0) + t.get("step3_time", 0))
+        + t.get("step5_time", 0) + t.get("step6_time", 0) + t.get("step7_time", 0) + t.get("step8_time", 0)
+    )
+
+def cycling_prep_seconds(tc_steps):
+    # Pipetting seconds the thermocycler program leaves for the next plate: every hold fits whole
+    # steps of SECONDS_PER_TRANSFER (template.py pipettes during holds, not ramps)
+    t = {key: int(float(value or 0)) for key, value in tc_steps.items() if key.endswith(("_time", "_cycles"))}
+    holds = [t.get(f"step{step}_time", 0) for step in (1, 5, 6, 7, 8)]
+    holds += [t.get("step2_time", 0), t.get("step3_time", 0)] * t.get("step4_cycles", 0)
+    return sum(hold // SECONDS_PER_TRANSFER for hold in holds) * SECONDS_PER_TRANSFER
+
+def prep_seconds(lengths):
+    # Pipetting seconds to assemble constructs with these insert counts (inserts, water, master mix,
+    # enzyme and the finishing mix)
+    return (int(np.sum(lengths)) + 4 * len(lengths)) * SECONDS_PER_TRANSFER
+
+def estimate_runtime(plan, tc_steps):
+    # Rough seconds for one run: every insert, master mix, water and enzyme transfer plus cycling.
+    # With pipelined batches each plate after the first is pipetted while the one before cycles.
+    lengths = plan["construct_table"].lengths()
+    cycle = thermocycler_seconds(tc_steps)
+    prep = [prep_seconds(lengths[start:stop]) for start, stop in batch_ranges(plan.get("batches", [len(lengths)]))]
+    prep[0] += len(plan.get("dilutions", [])) * SECONDS_PER_TRANSFER
+    return prep[0] + sum(max(cycle, seconds) for seconds in prep[1:]) + cycle
+
+def pipeline_batches(construct_table, batches, cycle_seconds=None, max_tips=None):
+    # Plate sizes for a run of up to batches plates cycled one after another. Each plate after the
+    # first is pipetted while the one before cycles, so it only takes the constructs whose pipetting
+    # fits in cycle_seconds. Tip racks are refilled at plate swaps and hold max_tips: the first two
+    # plates are pipetted before the first swap, so the first one takes at most half of them.
+    lengths = construct_table.lengths()
+
+    def tips(start, stop):
+        return count_plan_tips(construct_table.slice(start, stop), range(stop - start))
+
+    sizes = []
+    start = 0
+    while len(sizes) < batches and start < len(lengths):
+        tip_limit = None
+        if max_tips is not None:
+            tip_limit = max_tips // 2 if not sizes else max_tips - (tips(0, sizes[0]) if len(sizes) == 1 else 0)
+        size = 1
+        while size < PLATE_SIZE and start + size < len(lengths):
+            if sizes and cycle_seconds is not None and prep_seconds(lengths[start:start + size + 1]) > cycle_seconds:
+                break
+            if tip_limit is not None and tips(start, start + size + 1) > tip_limit:
+                break
+            size += 1
+        sizes.append(size)
+        start += size
+    return sizes or [0]
+
+def batch_ranges(batches):
+    # (start, stop) construct indices of each batch
+    stops = list(itertools.accumulate(batches))
+    return list(zip([0] + stops[:-1], stops))
+
+def cycling_schedule(lengths, batches=None, enzyme_last=False, splits=None, cycle_seconds=0, extra_steps=0):
+    # Seconds each construct's enzyme sits in its well until its plate starts cycling, and for each
+    # plate the seconds from its first dispense until it starts cycling, at SECONDS_PER_TRANSFER per
+    # step of template.py (water, master mix, enzyme, each insert, the finishing mix and each
+    # replicate split). The first plate (after extra_steps, e.g. dilutions) cycles once it is
+    # pipetted. A later plate is pipetted in the holds of the program of the plate before and waits
+    # for that program (cycle_seconds) to finish; the operator's plate swap is not counted.
+    # A replicate split from another well gets its enzyme with the split.
+    splits = splits or {}
+    split_members = {member for members in splits.values() for member in members}
+    exposure = [0] * len(lengths)
+    latency = []
+    for batch, (start, stop) in enumerate(batch_ranges(batches or [len(lengths)])):
+        building = [index for index in range(start, stop) if index not in split_members]
+        added = {}
+        steps = (extra_steps if batch == 0 else 0) + 2 * len(building)
+        if not enzyme_last:
+            for index in building:
+                steps += 1
+                added[index] = steps
+        for index in building:
+            steps += int(lengths[index])
+            if enzyme_last:
+                continue
+            steps += 1
+            for member in splits.get(index, ()):
+                steps += 1
+                added[member] = steps
+        if enzyme_last:
+            for index in building:
+                steps += 1
+                added[index] = steps
+                steps += 1
+                for member in splits.get(index, ()):
+                    steps += 1
+                    added[member] = steps
+        prep = steps * SECONDS_PER_TRANSFER
+        latency.append(prep if batch == 0 else max(cycle_seconds, prep))
+        for index, step in added.items():
+            exposure[index] = latency[-1] - step * SECONDS_PER_TRANSFER
+    return exposure, latency
+
+def tip_periods(batches):
+    # Batches pipetted between tip rack refills, which happen when the plates are swapped: the
+    # first two plates are pipetted before the first swap, every later plate while its predecessor
+    # cycles after a swap
+    return [list(range(min(2, len(batches))))] + [[b] for b in range(2, len(batches))]
+
+def is_toolkit_plate(plate):
+    return plate not in ("tube_rack", "temp_module", "myt_plate", TC_PLATE) and not plate.startswith("overflow")
+
+def tc_well(i):
+    # Thermocycler plate wells fill row by row
+    return f"{chr(65 + i // 12)}{i % 12 + 1}"
+
+def labware_wells(rows, columns):
+    # Row-major well names, front rows last so row A (nearest the thermocycler) fills first
+    return [f"{chr(65 + r)}{c + 1}" for r in range(rows) for c in range(columns)]
+
+def count_plan_tips(construct_table, construct_tubes, extra_tips=0, batches=None):
+    # Upper bound on p20 tips as used by template.py before reaction volumes are known: one per
+    # enzyme transfer, one for all water and one for all master mix, and one per insert (or one per
+    # fragment plus one mix per construct when inserts go insert-major). extra_tips covers
+    # dilutions of earlier-level products. Transfers moved to the p300 later only lower it.
+    # With pipelined batches the racks are refilled at every plate swap, so this is the most
+    # tips used between two refills.
+    if batches and len(batches) > 1:
+        per_batch = [
+            count_plan_tips(construct_table.slice(start, stop), construct_tubes[start:stop])
+            for start, stop in batch_ranges(batches)
+        ]
+        return max(sum(per_batch[b] for b in period) for period in tip_periods(batches)) + extra_tips
+    if not len(construct_tubes):
+        return 0
+    used_fragments = int(np.count_nonzero(fragment_use_counts(construct_table)))
+    insert_tips = max(len(construct_table.ids), used_fragments + len(construct_tubes))
+    return insert_tips + len(construct_tubes) + 2 + extra_tips
+
+def count_tip_racks(construct_table, construct_tubes, extra_tips=0, batches=None):
+    # p20 tip racks reserved in the first deck slots
+    total_p20_tips = count_plan_tips(construct_table, construct_tubes, extra_tips, batches)
+    return (total_p20_tips - 1) // 96 + 1 if total_p20_tips > 0 else 0
+
+def assign_deck_slots(
+    construct_table, construct_tubes, insert_plate_map, num_overflow, preferred_slots=None, extra_tips=0,
+    batches=None
+):
+    # Tip racks take the first slots, then toolkit plates in name order (or the slot they
+    # had before, from preferred_slots), then overflow labware in the free slots closest
+    # to the thermocycler. When toolkit plates outnumber the slots left after overflow
+    # labware, the last toolkit slot takes the remaining plates one after another: the
+    # protocol asks the operator to swap them, in the order of the returned swap list.
+    # Pipelined batches need the free slot closest to the thermocycler for the prep plate.
+    toolkit_slots = AVAILABLE_SLOTS[count_tip_racks(construct_table, construct_tubes, extra_tips, batches):]
+    preferred_slots = preferred_slots or {}
+    pipelined = bool(batches) and len(batches) > 1
+
+    # --- Identify all toolkit plates and assign deck slots ---
+    used_toolkits = sorted({plate for plate, _ in insert_plate_map.values() if is_toolkit_plate(plate)})
+    capacity = len(toolkit_slots) - num_overflow - pipelined
+    if used_toolkits and capacity < 1:
+        raise ValueError("No deck slot is left for toolkit plates after tip racks and overflow labware")
+    if pipelined and used_toolkits and len(used_toolkits) > capacity:
+        # Swap pauses would stop the robot while the previous plate cycles
+        raise ValueError(
+            f"Pipelined batches need a deck slot for each of the {len(used_toolkits)} toolkit plates but only "
+            f"{capacity} are free, run fewer plates per run or without pipelining"
+        )
+    fixed = used_toolkits
+    if len(used_toolkits) > capacity:
+        # Plates with a slot from earlier runs stay put, the rest share the swap slot
+        fixed = sorted(used_toolkits, key=lambda plate: (preferred_slots.get(plate) not in toolkit_slots, plate))
+        fixed = sorted(fixed[:capacity - 1])
+    toolkit_swaps = [plate for plate in used_toolkits if plate not in fixed]
+
+    toolkit_plate_slots = {}
+    for toolkit in fixed:
+        slot = preferred_slots.get(toolkit)
+        if slot in toolkit_slots and slot not in toolkit_plate_slots.values():
+            toolkit_plate_slots[toolkit] = slot
+    open_slots = [slot for slot in toolkit_slots if slot not in toolkit_plate_slots.values()]
+    for toolkit in fixed:
+        if toolkit not in toolkit_plate_slots:
+            toolkit_plate_slots[toolkit] = open_slots.pop(0)
+    for toolkit in toolkit_swaps:
+        toolkit_plate_slots[toolkit] = open_slots[0]
+    toolkit_plate_slots = {toolkit: toolkit_plate_slots[toolkit] for toolkit in used_toolkits}
+
+    free_slots = [slot for slot in SLOT_PROXIMITY if slot in toolkit_slots and slot not in toolkit_plate_slots.values()]
+    if num_overflow + pipelined > len(free_slots):
+        raise ValueError(
+            f"Custom fragments need {num_overflow} overflow labware but only {len(free_slots) - pipelined} deck slots are free"
+        )
+    prep_plate_slot = free_slots.pop(0) if pipelined else None
+    overflow_slots = {f"overflow_{i + 1}": free_slots[i] for i in range(num_overflow)}
+    return toolkit_plate_slots, overflow_slots, toolkit_swaps, prep_plate_slot
+
+# Average molecular weight of one base pair of dsDNA (g/mol), for fmol to ng conversion
+BP_MOLECULAR_WEIGHT = 650
+
+# Default amount of each fragment per reaction (fmol)
+DEFAULT_TARGET_FMOL = 25
+
+# Smallest volume the p20 pipettes reliably (uL)
+MIN_PIPETTE_VOLUME = 1.0
+
+# Dilution folds proposed for concentrated stocks, the smallest one that is enough is used
+DILUTION_FOLDS = np.array([2, 5, 10, 20, 50, 100, 200, 500, 1000])
+
+def _find_column(columns, keyword):
+    # Benchling column names vary ("Concentration (ng/uL)", "Length (bp)"), match on a keyword
+    for col in columns:
+        if keyword in str(col).lower():
+            return col
+    return None
+
+def fmol_volumes(fragments, target_fmol=DEFAULT_TARGET_FMOL, min_volume=MIN_PIPETTE_VOLUME):
+    # Volume (uL) of every fragment holding target_fmol, from ng/uL concentration and bp length.
+    # Stocks too concentrated to pipette min_volume get a proposed dilution fold, and their
+    # volume is that of the diluted stock. Returns ({name: uL}, {name: fold}) for fragments
+    # with a usable concentration and length.
+    conc_col = _find_column(fragments.columns, "concentration")
+    length_col = _find_column(fragments.columns, "length")
+    if conc_col is None or length_col is None:
+        return {}, {}
+    names = fragments.iloc[:, 0].astype(str).to_numpy()
+    conc = pd.to_numeric(fragments[conc_col], errors="coerce").to_numpy(dtype=float)
+    length = pd.to_numeric(fragments[length_col], errors="coerce").to_numpy(dtype=float)
+    ng = target_fmol * length * BP_MOLECULAR_WEIGHT / 1e6
+    with np.errstate(divide="ignore", invalid="ignore"):
+        volumes = ng / conc
+    valid = np.isfinite(volumes) & (volumes > 0)
+    fold = np.ones_like(volumes)
+    too_small = valid & (volumes < min_volume)
+    needed = min_volume / volumes[too_small]
+    fold[too_small] = DILUTION_FOLDS[np.minimum(np.searchsorted(DILUTION_FOLDS, needed), len(DILUTION_FOLDS) - 1)]
+    volumes = np.round(np.maximum(volumes * fold, min_volume), 2)
+    return (
+        dict(zip(names[valid], volumes[valid].tolist())),
+        dict(zip(names[too_small], fold[too_small].astype(int).tolist())),
+    )
+
+# Reagent tubes on the temperature module, in the order they are placed
+REAGENT_KEYS = ["master_mix", "water", "enzyme"]
+
+def count_overflow_labware(num_custom, overflow_wells):
+    # Overflow labware needed once the temperature module positions left after the reagent tubes are full
+    num_temp_fragments = len(TEMP_MODULE_LOCATIONS) - NUM_REAGENT_TUBES
+    return math.ceil(max(num_custom - num_temp_fragments, 0) / len(overflow_wells))
+
+def place_custom_fragments(
+    custom, overflow_labware, overflow_wells, registered=None, registered_reagents=None, reserved=()
+):
+    # Assign custom fragments (most used first) and reagent tubes to temperature module positions,
+    # spilling fragments onto overflow labware. Positions from the registry are kept when still free,
+    # new fragments fill the free positions closest to the thermocycler. Positions in reserved
+    # (registered to fragments of other designs) are only used once no other position is free.
+    registered = registered or {}
+    registered_reagents = registered_reagents or {}
+    num_temp_fragments = len(TEMP_MODULE_LOCATIONS) - NUM_REAGENT_TUBES
+    num_overflow = count_overflow_labware(len(custom), overflow_wells)
+
+    taken = set()
+    reagent_locations = {}
+    for key in REAGENT_KEYS:
+        loc = registered_reagents.get(key)
+        if loc and loc[0] == "tube_rack" and loc[1] in TEMP_MODULE_LOCATIONS and ("tube_rack", loc[1]) not in taken:
+            reagent_locations[key] = loc[1]
+            taken.add(("tube_rack", loc[1]))
+
+    placements = {}
+    temp_count = 0
+    for name in custom:
+        loc = registered.get(name)
+        if not loc:
+            continue
+        labware, well, labware_type, _ = loc
+        if (labware, well) in taken:
+            continue
+        if labware == "tube_rack" and well in TEMP_MODULE_LOCATIONS and temp_count < num_temp_fragments:
+            temp_count += 1
+        elif not (
+            labware.startswith("overflow") and labware_type == overflow_labware and well in overflow_wells
+            and int(labware.split("_")[1]) <= num_overflow
+        ):
+            continue
+        placements[name] = (labware, well)
+        taken.add((labware, well))
+
+    free_temp = [well for well in TEMP_MODULE_LOCATIONS if ("tube_rack", well) not in taken]
+    free_temp.sort(key=lambda well: ("tube_rack", well) in reserved)
+    free_overflow = [
+        (f"overflow_{i + 1}", well) for i in range(num_overflow) for well in overflow_wells
+        if (f"overflow_{i + 1}", well) not in taken
+    ]
+    free_overflow.sort(key=lambda loc: loc in reserved)
+    for name in custom:
+        if name in placements:
+            continue
+        if temp_count < num_temp_fragments:
+            placements[name] = ("tube_rack", free_temp.pop(0))
+            temp_count += 1
+        else:
+            placements[name] = free_overflow.pop(0)
+
+    for key in REAGENT_KEYS:
+        if key not in reagent_locations:
+            reagent_locations[key] = free_temp.pop(0)
+    return placements, reagent_locations, free_temp, num_overflow
+
+# Columns identifying the same physical fragment across designs, even under different names
+SEQUENCE_ID_COLUMNS = ("Sequence ID", "Registry ID", "ID")
+
+def as_path_list(paths):
+    # One export path or a list of them (one per design)
+    return [paths] if isinstance(paths, (str, os.PathLike)) else list(paths)
+
+def merge_fragments(frames):
+    # Concatenate fragments exports, keeping the first row of every fragment name. Rows sharing
+    # a sequence ID with an earlier fragment are dropped too, and returned as {alias: name}.
+    fragments = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    names = fragments.iloc[:, 0].astype(str)
+    fragments = fragments[~names.duplicated()]
+    aliases = {}
+    id_col = next((col for col in SEQUENCE_ID_COLUMNS if col in fragments.columns), None)
+    if id_col is not None and len(frames) > 1:
+        ids = fragments[id_col]
+        names = fragments.iloc[:, 0].astype(str)
+        duplicate = ids.notna() & ids.duplicated()
+        first = ids.notna() & ~duplicate
+        first_name = dict(zip(ids[first], names[first]))
+        aliases = dict(zip(names[duplicate], ids[duplicate].map(first_name)))
+        fragments = fragments[~duplicate]
+    return fragments.reset_index(drop=True), aliases
+
+def iter_design_constructs(construct_paths, design_bins, aliases=None):
+    # Constructs of every design in turn, with fragment aliases resolved. A construct name
+    # already used by an earlier design is prefixed with its design number.
+    aliases = aliases or {}
+    seen = set()
+    for design_idx, (path, bins) in enumerate(zip(construct_paths, design_bins)):
+        names = set()
+        for name, inserts in iter_constructs(read_construct_chunks(path), bins):
+            if len(construct_paths) > 1:
+                names.add(name)
+                if name in seen:
+                    name = f"D{design_idx + 1}:{name}"
+            yield name, [aliases.get(insert, insert) for insert in inserts]
+        seen |= names
+
+def read_design(path_fragments, path_constructs, use_toolkit, toolkit_path=TOOLKIT_PATH, target_fmol=DEFAULT_TARGET_FMOL):
+    # Load the Benchling exports: fragments with their toolkit wells and volumes, the library size
+    # and a stream of the constructs. Several designs (lists of fragments and constructs exports)
+    # are merged into one run.
+    fragment_paths = as_path_list(path_fragments)
+    construct_paths = as_path_list(path_constructs)
+    design_fragments = [pd.read_csv(path) for path in fragment_paths]
+    fragments, aliases = merge_fragments(design_fragments)
+
+    # Extract Bin values for each insert (assumes columns: [Name, ..., Bin, ...]).
+    # Bin references in a constructs export only expand to fragments of the same design.
+    bin_dict = dict(zip(fragments.iloc[:, 0], fragments["Bin"]))
+    design_bins = [dict(zip(frame.iloc[:, 0], frame["Bin"])) for frame in design_fragments]
+
+    # --- Check for toolkit fragments in fragment names ---
+    fragment_names = fragments.iloc[:, 0].astype(str)
+    toolkit_plate_wells = match_toolkit_wells(fragment_names, toolkit_path) if use_toolkit else {}
+
+    # Stream the constructs export in chunks (Overhang/Status columns are dropped while parsing)
+    # and expand rows lazily (rows may reference whole bins, e.g. "bin:2")
+    library_size = sum(
+        count_constructs(read_construct_chunks(path), bins) for path, bins in zip(construct_paths, design_bins)
+    )
+
+    # Per-insert volumes: the Volume column where set, else computed for target_fmol from the
+    # concentration and length columns, else 1
+    vol_per_insert_dict = {name: 1 for name in fragment_names}
+    fmol_vols, dilution_proposals = fmol_volumes(fragments, target_fmol)
+    vol_per_insert_dict.update(fmol_vols)
+    if "Volume" in fragments.columns:
+        set_volumes = fragments["Volume"].notna().to_numpy()
+        vol_per_insert_dict.update(zip(fragment_names[set_volumes], fragments["Volume"][set_volumes]))
+        dilution_proposals = {
+            name: fold for name, fold in dilution_proposals.items() if fmol_vols[name] == vol_per_insert_dict[name]
+        }
+    return {
+        "fragment_names": fragment_names,
+        "bin_dict": bin_dict,
+        "toolkit_plate_wells": toolkit_plate_wells,
+        "library_size": library_size,
+        "constructs": iter_design_constructs(construct_paths, design_bins, aliases),
+        "vol_per_insert_dict": vol_per_insert_dict,
+        "dilution_proposals": dilution_proposals,
+        "target_fmol": target_fmol,
+    }
+
+def build_plan(
+    path_fragments, path_constructs, use_toolkit, toolkit_path=TOOLKIT_PATH, overflow_labware="plate",
+    product_wells=None, first_well=0, shard=0, registry=None, target_fmol=DEFAULT_TARGET_FMOL,
+    batches=1, cycle_seconds=None
+):
+    # Load the Benchling exports and assign every reagent and construct a location.
+    # product_wells maps products of an earlier level to their thermocycler plate well,
+    # and constructs are built from well first_well onwards. shard selects which plate
+    # of a larger library is planned. With a registry.LocationRegistry, fragments, reagents
+    # and toolkit plates keep the positions they had in earlier runs.
+    # Several designs (lists of fragments and constructs exports) are merged into one run.
+    # With batches > 1 up to that many plates are cycled one after another, each pipetted on a
+    # prep plate while the one before cycles (sized by pipeline_batches for cycle_seconds).
+    if not 1 <= batches <= MAX_BATCHES:
+        raise ValueError(f"Plates per run must be between 1 and {MAX_BATCHES}, got {batches}")
+    if batches > 1 and (product_wells or first_well):
+        raise ValueError("Pipelined batches cannot build on products of an earlier level")
+    design = read_design(path_fragments, path_constructs, use_toolkit, toolkit_path, target_fmol)
+    # Only encode the planned plates of the library into the construct table
+    construct_table = ConstructTable.from_stream(
+        itertools.islice(design["constructs"], shard * (PLATE_SIZE - first_well), None),
+        fragments=FragmentIndex(design["fragment_names"]),
+        limit=(PLATE_SIZE - first_well) * batches,
+    )
+    return plan_constructs(
+        design, construct_table, overflow_labware, product_wells, first_well, registry, batches, cycle_seconds
+    )
+
+def iter_plate_plans(path_fragments, path_constructs, use_toolkit, toolkit_path=TOOLKIT_PATH, overflow_labware="plate"):
+    # Plan of every plate of a library in turn, reading the exports and streaming the constructs once
+    design = read_design(path_fragments, path_constructs, use_toolkit, toolkit_path)
+    while True:
+        construct_table = ConstructTable.from_stream(
+            design["constructs"], fragments=FragmentIndex(design["fragment_names"]), limit=PLATE_SIZE
+        )
+        if len(construct_table) == 0:
+            return
+        yield plan_constructs(design, construct_table, overflow_labware)
+
+def plan_constructs(
+    design, construct_table, overflow_labware="plate", product_wells=None, first_well=0, registry=None,
+    batches=1, cycle_seconds=None
+):
+    # Assign every reagent and construct of a table of design's constructs a location, see build_plan
+    product_wells = product_wells or {}
+    fragment_names = design["fragment_names"]
+    toolkit_plate_wells = design["toolkit_plate_wells"]
+    overflow_spec = OVERFLOW_LABWARE[overflow_labware]
+    overflow_wells = labware_wells(overflow_spec["rows"], overflow_spec["columns"])
+    batch_sizes = [len(construct_table)]
+    if batches > 1:
+        # Tip racks share the deck with the prep plate and the toolkit plates and overflow labware
+        # the candidate constructs would need
+        used = fragment_use_counts(construct_table) > 0
+        used_names = [name for name in fragment_names if used[construct_table.fragments.ids[name]]]
+        deck_labware = len({toolkit_plate_wells[name][0] for name in used_names if name in toolkit_plate_wells})
+        deck_labware += count_overflow_labware(
+            sum(name not in toolkit_plate_wells for name in used_names), overflow_wells
+        )
+        rack_slots = len(AVAILABLE_SLOTS) - 1 - deck_labware
+        if rack_slots < 1:
+            raise ValueError("Pipelined batches leave no deck slot for tip racks, run without pipelining")
+        batch_sizes = pipeline_batches(construct_table, batches, cycle_seconds, max_tips=96 * rack_slots)
+        construct_table = construct_table.slice(0, sum(batch_sizes))
+    # Every batch fills its own plate from the first well
+    construct_tubes = [tc_well(first_well + i) for size in batch_sizes for i in range(size)]
+
+    # Custom fragments used most often get the temperature module positions closest to the
+    # thermocycler, the rest spill onto overflow labware. Unused fragments are not placed.
+    use_counts = fragment_use_counts(construct_table)
+    custom = [
+        name for name in fragment_names
+        if name not in toolkit_plate_wells and name not in product_wells
+        and use_counts[construct_table.fragments.ids[name]] > 0
+    ]
+    custom.sort(key=lambda name: -use_counts[construct_table.fragments.ids[name]])
+    registered = registered_reagents = registered_plates = {}
+    reserved = set()
+    if registry is not None:
+        registered = registry.lookup("fragment", custom)
+        registered_reagents = registry.lookup("reagent", REAGENT_KEYS)
+        registered_plates = registry.lookup("toolkit_plate", {plate for plate, _ in toolkit_plate_wells.values()})
+        # Positions still holding fragments of other designs are left to them while others are free
+        positions = [("tube_rack", well) for well in TEMP_MODULE_LOCATIONS] + [
+            (f"overflow_{i + 1}", well)
+            for i in range(count_overflow_labware(len(custom), overflow_wells)) for well in overflow_wells
+        ]
+        custom_names = set(custom)
+        reserved = {
+            position for position, owners in registry.owners("fragment", positions).items()
+            if any(
+                name not in custom_names and (position[0] == "tube_rack" or labware_type == overflow_labware)
+                for name, labware_type in owners
+            )
+        }
+    # Products of an earlier level may each need a dilution (one tip each, plus one for the water)
+    dilution_tips = len(product_wells) + 1 if product_wells else 0
+    custom_placements, reagent_locations, remaining_locations, num_overflow = place_custom_fragments(
+        custom, overflow_labware, overflow_wells, registered, registered_reagents, reserved
+    )
+
+    insert_plate_map = {}  # Map fragment name to (plate, well)
+    for name, plate_well in toolkit_plate_wells.items():
+        if use_counts[construct_table.fragments.ids[name]] > 0:
+            insert_plate_map[name] = plate_well
+    for name, well in product_wells.items():
+        if name in construct_table.fragments and use_counts[construct_table.fragments.ids[name]] > 0:
+            insert_plate_map[name] = (TC_PLATE, well)
+    insert_plate_map.update(custom_placements)
+    # Keep fragments CSV order for display, products that are not in the CSV come last
+    insert_plate_map = {
+        name: insert_plate_map[name] for name in construct_table.fragments.names if name in insert_plate_map
+    }
+
+    toolkit_plate_slots, overflow_slots, toolkit_swaps, prep_plate_slot = assign_deck_slots(
+        construct_table, construct_tubes, insert_plate_map, num_overflow,
+        preferred_slots={plate: loc[1] for plate, loc in registered_plates.items()},
+        extra_tips=dilution_tips, batches=batch_sizes,
+    )
+
+    plan = {
+        "fragment_names": list(fragment_names),
+        "bin_dict": design["bin_dict"],
+        "toolkit_plate_wells": toolkit_plate_wells,
+        "insert_plate_map": insert_plate_map,
+        # Mapping of insert names to their locations, for script compatibility
+        "insert_locations": dict(insert_plate_map),
+        "master_mix": reagent_locations["master_mix"],
+        "water_loc": reagent_locations["water"],
+        "enzyme_loc": reagent_locations["enzyme"],
+        "free_locations": remaining_locations,  # extra reagent tubes when one is not enough
+        "construct_table": construct_table,
+        # Assign locations in thermocycler to constructs
+        "construct_tubes": construct_tubes,
+        "vol_per_insert_dict": dict(design["vol_per_insert_dict"]),
+        # {fragment: fold} to pre-dilute stocks whose volume for target_fmol is below MIN_PIPETTE_VOLUME
+        "dilution_proposals": dict(design["dilution_proposals"]),
+        "target_fmol": design["target_fmol"],
+        "library_size": design["library_size"],
+        # Constructs with identical inserts, built once and split (see replicate_scales)
+        "replicates": replicate_groups(construct_table, batch_sizes),
+        # Constructs per plate, in order. Plates after the first are pipetted on the prep plate
+        # while the one before cycles.
+        "batches": batch_sizes,
+        "prep_plate_slot": prep_plate_slot,
+        "toolkit_plate_slots": toolkit_plate_slots,
+        # Toolkit plates sharing one slot, in the order the protocol asks for them
+        "toolkit_swaps": toolkit_swaps,
+        "overflow_labware": overflow_labware,
+        "overflow_slots": overflow_slots,
+        "tip_racks": count_tip_racks(construct_table, construct_tubes, dilution_tips, batch_sizes),
+        # Freezer locations from the registry, shown on the loading sheet
+        "storage": {name: loc[3] for name, loc in registered.items() if loc[3]},
+    }
+    plan["tube_placements"] = describe_placements(plan)
+    if registry is not None:
+        registry.record_plan(plan)
+    return plan
+
+def describe_placements(plan):
+    # Human-readable loading instructions for every fragment, reagent and construct
+    construct_table = plan["construct_table"]
+    construct_tubes = plan["construct_tubes"]
+    toolkit_plate_slots = plan["toolkit_plate_slots"]
+    overflow_slots = plan["overflow_slots"]
+    overflow_name = OVERFLOW_LABWARE[plan["overflow_labware"]]["load_name"]
+
+    # --- Build tube placements string with plate and slot info ---
+    tube_placements = ""
+    storage = plan.get("storage", {})
+    dilution_proposals = plan.get("dilution_proposals", {})
+    for name, (plate, well) in plan["insert_plate_map"].items():
+        insert = name
+        if name in dilution_proposals:
+            insert += f" (dilute {dilution_proposals[name]}x)"
+        if name in storage:
+            insert += f" (freezer: {storage[name]})"
+        if plate in toolkit_plate_slots:
+            slot = toolkit_plate_slots[plate]
+            tube_placements += f"[{well}] ({plate} Plate, Slot {slot}): {insert}, \n"
+        elif plate in overflow_slots:
+            tube_placements += f"[{well}] (Overflow {overflow_name}, Slot {overflow_slots[plate]}): {insert}, \n"
+        elif plate == TC_PLATE:
+            tube_placements += f"[{well}] (Thermocycler, previous level): {insert}, \n"
+        elif plate == "myt_plate":
+            tube_placements += f"[{well}] (MYT Plate): {insert}, \n"
+        else:
+            tube_placements += f"[{well}] (Temp Module): {insert}, \n"
+
+    tube_placements += f"\n[{plan['master_mix']}] (Temp Module): Master Mix,"
+    tube_placements += f"\n[{plan['water_loc']}] (Temp Module): Molecular Grade Water,"
+    tube_placements += f"\n[{plan['enzyme_loc']}] (Temp Module): Enzyme, \n"
+    batches = plan.get("batches", [len(construct_tubes)])
+    if len(batches) > 1:
+        # Pipelined: each plate after the first is pipetted on the prep plate while the one before cycles
+        for b, (start, stop) in enumerate(batch_ranges(batches)):
+            where = "in the thermocycler module" if b == 0 else (
+                f"on the prep plate in Slot {plan['prep_plate_slot']} while plate {b} cycles"
+            )
+            tube_placements += f"\nPlate {b + 1} of {len(batches)}, built {where}:\n\n"
+            tube_placements += "\n".join([f"[{construct_tubes[i]}]: {construct_table.names[i]}, " for i in range(start, stop)])
+            tube_placements += "\n"
+    else:
+        tube_placements += "\nConstructs will be built in the thermocycler module:\n\n"
+        tube_placements += "\n".join([f"[{location}]: {construct_table.names[i]}, " for i, location in enumerate(construct_tubes)])
+
+    # Add plate/slot summary for user clarity
+    if toolkit_plate_slots or overflow_slots or plan.get("prep_plate_slot"):
+        tube_placements += "\n\nLabware locations on deck:\n"
+        for toolkit, slot in toolkit_plate_slots.items():
+            if toolkit not in plan["toolkit_swaps"]:
+                tube_placements += f"  {toolkit} Plate: Slot {slot}\n"
+        if plan["toolkit_swaps"]:
+            first, *later = plan["toolkit_swaps"]
+            tube_placements += (
+                f"  {first} Plate: Slot {toolkit_plate_slots[first]}, the protocol pauses to swap in "
+                f"{', then '.join(later)}\n"
+            )
+        for overflow, slot in overflow_slots.items():
+            tube_placements += f"  {overflow_name} ({overflow.replace('_', ' ')}): Slot {slot}\n"
+        if plan.get("prep_plate_slot"):
+            tube_placements += (
+                f"  Prep plate (PCR plate on a chilled 96-well aluminum block): Slot {plan['prep_plate_slot']}\n"
+            )
+
+    return tube_placements
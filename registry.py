@@ -0,0 +1,158 @@
+import argparse
+import sqlite3
+import time
+import pandas as pd
+
+REGISTRY_PATH = "location_registry.sqlite"
+
+# SQLite limits the number of bound parameters, so large lookups are batched
+LOOKUP_BATCH = 500
+
+# Kinds of entries: custom fragments (temp module or overflow well), reagent tubes on the
+# temp module and toolkit plates (deck slot)
+FRAGMENT = "fragment"
+REAGENT = "reagent"
+TOOLKIT_PLATE = "toolkit_plate"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS locations (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    labware TEXT NOT NULL,
+    well TEXT NOT NULL,
+    labware_type TEXT,
+    storage TEXT,
+    last_used REAL,
+    PRIMARY KEY (kind, name)
+);
+CREATE INDEX IF NOT EXISTS locations_by_position ON locations (kind, labware, well);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+INSERT OR IGNORE INTO meta VALUES ('version', 0);
+"""
+
+class LocationRegistry:
+    # Persistent record of where fragments, reagents and toolkit plates physically live, so
+    # a part keeps its tube position from one run to the next. storage is a free-text
+    # freezer location (e.g. "Box 3 C4") shown on the loading sheet.
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def version(self):
+        # Changes whenever a location is added or moved, plans depend on it
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def lookup(self, kind, names):
+        # {name: (labware, well, labware_type, storage)} for the registered names
+        names = [str(name) for name in names]
+        found = {}
+        for start in range(0, len(names), LOOKUP_BATCH):
+            batch = names[start:start + LOOKUP_BATCH]
+            rows = self.conn.execute(
+                f"SELECT name, labware, well, labware_type, storage FROM locations "
+                f"WHERE kind = ? AND name IN ({','.join('?' * len(batch))})",
+                [kind] + batch,
+            )
+            for name, labware, well, labware_type, storage in rows:
+                found[name] = (labware, well, labware_type, storage)
+        return found
+
+    def owners(self, kind, positions):
+        # {(labware, well): [(name, labware_type)]} for the registered names at the given positions
+        by_labware = {}
+        for labware, well in positions:
+            by_labware.setdefault(labware, []).append(well)
+        found = {}
+        for labware, wells in by_labware.items():
+            for start in range(0, len(wells), LOOKUP_BATCH):
+                batch = wells[start:start + LOOKUP_BATCH]
+                rows = self.conn.execute(
+                    f"SELECT name, labware, well, labware_type FROM locations "
+                    f"WHERE kind = ? AND labware = ? AND well IN ({','.join('?' * len(batch))})",
+                    [kind, labware] + batch,
+                )
+                for name, labware, well, labware_type in rows:
+                    found.setdefault((labware, well), []).append((name, labware_type))
+        return found
+
+    def record(self, kind, placements, labware_type=None):
+        # Save {name: (labware, well)}, bumping the version only if something moved. Other names
+        # still registered at these positions are stale and lose their position.
+        now = time.time()
+        existing = self.lookup(kind, placements)
+        changed = any(existing.get(name, (None, None))[:2] != tuple(loc) for name, loc in placements.items())
+        with self.conn:
+            evicted = self.conn.executemany(
+                "UPDATE locations SET labware = '', well = '' WHERE kind = ? AND labware = ? AND well = ? AND name != ?",
+                [(kind, labware, well, str(name)) for name, (labware, well) in placements.items()],
+            ).rowcount
+            self.conn.executemany(
+                "INSERT INTO locations (kind, name, labware, well, labware_type, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (kind, name) DO UPDATE SET labware = excluded.labware, well = excluded.well, "
+                "labware_type = excluded.labware_type, last_used = excluded.last_used",
+                [(kind, str(name), labware, well, labware_type, now) for name, (labware, well) in placements.items()],
+            )
+            if changed or evicted:
+                self._bump_version()
+
+    def _bump_version(self):
+        self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def record_plan(self, plan):
+        # Remember every deck position a plan assigned
+        fragments = {
+            name: loc for name, loc in plan["insert_plate_map"].items()
+            if loc[0] == "tube_rack" or loc[0].startswith("overflow")
+        }
+        self.record(FRAGMENT, fragments, labware_type=plan["overflow_labware"])
+        self.record(REAGENT, {
+            "master_mix": ("tube_rack", plan["master_mix"]),
+            "water": ("tube_rack", plan["water_loc"]),
+            "enzyme": ("tube_rack", plan["enzyme_loc"]),
+        })
+        self.record(TOOLKIT_PLATE, {
+            plate: ("deck", slot) for plate, slot in plan["toolkit_plate_slots"].items()
+            if plate not in plan["toolkit_swaps"]
+        })
+
+    def set_storage(self, storage_by_name):
+        # Freezer locations for fragments, kept separately from their deck positions. Plans show
+        # them on the loading sheet, so a changed location bumps the version too.
+        existing = self.lookup(FRAGMENT, storage_by_name)
+        changed = any(
+            name not in existing or existing[name][3] != str(storage) for name, storage in storage_by_name.items()
+        )
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO locations (kind, name, labware, well, storage) VALUES (?, ?, '', '', ?) "
+                "ON CONFLICT (kind, name) DO UPDATE SET storage = excluded.storage",
+                [(FRAGMENT, str(name), str(storage)) for name, storage in storage_by_name.items()],
+            )
+            if changed:
+                self._bump_version()
+
+def main():
+    parser = argparse.ArgumentParser(description="Import freezer locations into the location registry")
+    parser.add_argument("storage_csv", help="CSV with Name and Storage columns")
+    parser.add_argument("--registry", default=REGISTRY_PATH)
+    args = parser.parse_args()
+
+    storage = pd.read_csv(args.storage_csv, dtype=str)
+    registry = LocationRegistry(args.registry)
+    registry.set_storage(dict(zip(storage["Name"], storage["Storage"])))
+    registry.close()
+    print(f"Recorded {len(storage)} freezer locations in {args.registry}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import generator
+import ledger as source_ledger
+import plan_cache
+import planner
+
+DEFAULT_PORT = 8750
+DEFAULT_WORKERS = 4
+
+# Requests waiting for a worker beyond this are turned away with 503
+MAX_PENDING = 32
+
+def _object(request, name):
+    # Optional JSON object field of a request, e.g. tc_steps
+    value = request.get(name, {})
+    if not isinstance(value, dict):
+        raise ValueError(f"{name} must be a JSON object")
+    return value
+
+def _designs(request):
+    # Fragments and constructs CSV texts of a request, one design or equal lists of several
+    fragments, constructs = request["fragments_csv"], request["constructs_csv"]
+    if isinstance(fragments, str) and isinstance(constructs, str):
+        return [fragments], [constructs]
+    if (
+        isinstance(fragments, list) and isinstance(constructs, list) and fragments
+        and len(fragments) == len(constructs) and all(isinstance(text, str) for text in fragments + constructs)
+    ):
+        return fragments, constructs
+    raise ValueError(
+        "fragments_csv and constructs_csv must both be CSV text, or lists of CSV text of the same length"
+    )
+
+class ProtocolService:
+    # Plans and renders protocols for several users at once. The template and toolkit index stay
+    # loaded, plans and scripts are shared through the protocol cache, and work runs in a
+    # bounded pool so a burst of submissions cannot starve the machine.
+    def __init__(self, workers=DEFAULT_WORKERS, cache_dir=plan_cache.CACHE_DIR, toolkit_path=planner.TOOLKIT_PATH):
+        self.template = generator.load_template()
+        self.toolkit_path = toolkit_path
+        self.cache = plan_cache.ProtocolCache(cache_dir)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.workers = workers
+        self.pending = 0
+        self.lock = threading.Lock()
+        planner.load_toolkit_index(toolkit_path)
+
+    def submit(self, fn, request):
+        with self.lock:
+            if self.pending >= MAX_PENDING:
+                return None
+            self.pending += 1
+        submitted = time.perf_counter()
+        try:
+            return self.pool.submit(fn, request, submitted).result()
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def _plan(self, request, tmp_dir):
+        # Uploaded CSV text is written to files so the cache can key on it like any export
+        def write(name, text):
+            path = os.path.join(tmp_dir, name)
+            with open(path, "w") as f:
+                f.write(text)
+            return path
+        fragments, constructs = _designs(request)
+        # Pipelined plates are sized for the run's thermocycler program
+        batches = int(request.get("batches", 1))
+        tc_steps = dict(generator.DEFAULT_TC_STEPS, **_object(request, "tc_steps"))
+        return self.cache.get_plan(
+            [write(f"fragments_{i}.csv", text) for i, text in enumerate(fragments)],
+            [write(f"constructs_{i}.csv", text) for i, text in enumerate(constructs)],
+            bool(request.get("use_toolkit", False)), self.toolkit_path,
+            overflow_labware=request.get("overflow_labware", "plate"),
+            target_fmol=float(request.get("target_fmol", planner.DEFAULT_TARGET_FMOL)),
+            batches=batches,
+            cycle_seconds=planner.cycling_prep_seconds(tc_steps) if batches > 1 else None,
+        )
+
+    def plan(self, request, submitted):
+        started = time.perf_counter()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            key, plan = self._plan(request, tmp_dir)
+        return {
+            "plan_key": key,
+            "fragments": len(plan["insert_locations"]),
+            "constructs": plan["construct_table"].names,
+            "library_size": plan["library_size"],
+            "batches": plan["batches"],
+            "vol_per_insert": {name: float(vol) for name, vol in plan["vol_per_insert_dict"].items()},
+            "dilution_proposals": plan["dilution_proposals"],
+            "tube_placements": plan["tube_placements"],
+            "metrics": self._metrics(submitted, started, time.perf_counter()),
+        }
+
+    def protocol(self, request, submitted):
+        started = time.perf_counter()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            key, plan = self._plan(request, tmp_dir)
+        planned = time.perf_counter()
+        settings = {name: float(request.get(name, default)) for name, default in generator.DEFAULT_SETTINGS.items()}
+        vol_per_insert_dict = dict(plan["vol_per_insert_dict"], **_object(request, "vol_per_insert"))
+        tc_steps = dict(generator.DEFAULT_TC_STEPS, **_object(request, "tc_steps"))
+        insert_major = bool(request.get("insert_major", False))
+        enzyme_last = bool(request.get("enzyme_last", False))
+        script = self.cache.get_script(
+            key, plan, self.template, vol_per_insert_dict=vol_per_insert_dict, tc_steps=tc_steps,
+            compact=bool(request.get("compact", False)), compress=bool(request.get("compress", False)),
+            insert_major=insert_major, enzyme_last=enzyme_last, **settings,
+        )
+        run_ledger = source_ledger.build_ledger(
+            plan, settings["reaction_vol"], settings["mm_per_reaction"], settings["enzyme_per_reaction"],
+            vol_per_insert_dict, insert_major, enzyme_last, tc_steps,
+        )
+        metrics = self._metrics(submitted, started, planned)
+        metrics.update({
+            "render_seconds": round(time.perf_counter() - planned, 4),
+            "constructs": len(plan["construct_table"]),
+            "tips": run_ledger["tips"],
+            "estimated_runtime_seconds": planner.estimate_runtime(plan, tc_steps),
+            "enzyme_exposure_seconds": run_ledger["enzyme_exposure"],
+            "cycling_latency_seconds": run_ledger["cycling_latency"],
+            "script_bytes": len(script),
+        })
+        return {
+            "plan_key": key,
+            "protocol": script,
+            "loading_sheet": generator.loading_sheet(plan, run_ledger),
+            "warnings": run_ledger["warnings"],
+            "metrics": metrics,
+        }
+
+    def _metrics(self, submitted, started, planned):
+        return {
+            "queue_seconds": round(started - submitted, 4),
+            "plan_seconds": round(planned - started, 4),
+            "template_version": generator.template_version(self.template),
+        }
+
+    def health(self):
+        with self.lock:
+            pending = self.pending
+        return {"status": "ok", "workers": self.workers, "pending": pending,
+                "template_version": generator.template_version(self.template)}
+
+def make_handler(service):
+    routes = {"/plan": service.plan, "/protocol": service.protocol}
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, service.health())
+            else:
+                self._send(404, {"error": f"Unknown endpoint {self.path}"})
+
+        def do_POST(self):
+            if self.path not in routes:
+                self._send(404, {"error": f"Unknown endpoint {self.path}"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            except ValueError:
+                self._send(400, {"error": "Request body must be JSON"})
+                return
+            if not isinstance(request, dict):
+                self._send(400, {"error": "Request body must be a JSON object"})
+                return
+            if "fragments_csv" not in request or "constructs_csv" not in request:
+                self._send(400, {"error": "fragments_csv and constructs_csv are required"})
+                return
+            try:
+                result = service.submit(routes[self.path], request)
+            except (ValueError, KeyError, TypeError) as e:
+                # Settings of the wrong type (e.g. null) end up here too
+                self._send(422, {"error": str(e)})
+                return
+            except Exception as e:
+                # Still answer, so the client is not left waiting on a dead handler
+                self._send(500, {"error": f"Could not process the request: {e}"})
+                return
+            if result is None:
+                self._send(503, {"error": "Too many pending requests, try again shortly"})
+                return
+            self._send(200, result)
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve protocol planning and rendering over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+
+    service = ProtocolService(workers=args.workers)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving protocols on http://{args.host}:{args.port} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.pool.shutdown()
+
+if __name__ == "__main__":
+    main()
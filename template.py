@@ -1,6 +1,9 @@
+import math
+import time
 import opentrons.execute # type: ignore
 from opentrons import protocol_api # type: ignore
 metadata = {{"apiLevel": "2.22", "description": '''{tube_placements}'''}}
+{plan_header}
 
 # Fragments and constructs
 inserts = {inserts} # type: ignore
@@ -11,6 +14,51 @@ master_mix = f'{master_mix}' # type: ignore
 water_loc = f'{water_loc}'  # type: ignore
 enzyme_loc = f'{enzyme_loc}'  # type: ignore
 
+# Source of each reagent for every reaction as (labware, well), split across tubes or
+# reservoir wells by the planner so no source runs dry
+master_mix_sources = {master_mix_sources} # type: ignore
+water_sources = {water_sources} # type: ignore
+enzyme_sources = {enzyme_sources} # type: ignore
+reservoir_slot = {reservoir_slot} # type: ignore
+
+# Secondary labware for custom fragments that do not fit on the temp module, {{name: slot}}
+overflow_labware = {overflow_labware} # type: ignore
+overflow_slots = {overflow_slots} # type: ignore
+
+# Deck slots of toolkit plates from the planner, {{plate: slot}}. Plates in toolkit_swaps share one
+# slot, the operator is asked to swap them in this order.
+toolkit_plate_slots = {toolkit_plate_slots} # type: ignore
+toolkit_swaps = {toolkit_swaps} # type: ignore
+
+# Tip rack slots per pipette, and how each reagent is pipetted and mixed (see liquids.py)
+tip_rack_slots = {tip_rack_slots} # type: ignore
+liquid_classes = {liquid_classes} # type: ignore
+mix_classes = {mix_classes} # type: ignore
+pipette_specs = {pipette_specs} # type: ignore
+
+# Replicates: reactions assembled in each well (k in a well building k identical constructs, 0 in the
+# wells they are split into) and {{building construct index: construct indices split into}}
+reaction_scale = {reaction_scale} # type: ignore
+replicate_splits = {replicate_splits} # type: ignore
+
+# Inserts pipetted insert-major: each fragment source visited once for all its constructs
+insert_major = {insert_major} # type: ignore
+
+# Enzyme added after the inserts, mixed in with its own tip, so it only meets the DNA shortly before cycling
+enzyme_last = {enzyme_last} # type: ignore
+
+# Pipelined batches: constructs per plate, cycled one after another. Every plate after the first is
+# pipetted on the prep plate in prep_plate_slot while the plate before it cycles, as many steps of
+# about seconds_per_transfer as fit in each thermocycler hold.
+batch_sizes = {batch_sizes} # type: ignore
+prep_plate_slot = {prep_plate_slot} # type: ignore
+seconds_per_transfer = {seconds_per_transfer} # type: ignore
+
+# Multi-level assembly: products of the previous level diluted on the thermocycler plate,
+# as (product well, dilution well, product uL, water uL), and the message shown before starting
+dilutions = {dilutions} # type: ignore
+start_message = {start_message} # type: ignore
+
 # Construct Tube Locations
 construct_tubes = {construct_tubes} # type: ignore
 
@@ -37,35 +85,168 @@ tc_step7_time = {tc_step7_time} # type: ignore
 tc_step8_temp = {tc_step8_temp} # type: ignore
 tc_step8_time = {tc_step8_time} # type: ignore
 
+# Phases of run() in order (enzyme after inserts with enzyme_last), a stopped run can be resumed from any of them
+resume_phases = ["start", "dilutions", "water", "master_mix", "enzyme", "inserts", "thermocycler"]
+
+def add_parameters(parameters):
+    parameters.add_str(
+        variable_name="resume_phase",
+        display_name="Resume from phase",
+        description="Set after a stopped run to skip completed phases. Load fresh tip racks first.",
+        choices=[{{"display_name": phase.replace("_", " ").capitalize(), "value": phase}} for phase in resume_phases],
+        default="start"
+    )
+    parameters.add_int(
+        variable_name="resume_construct",
+        display_name="Resume at construct",
+        description="First construct (1-based, as logged) still to do in the resume phase.",
+        default=1,
+        minimum=1,
+        maximum={resume_construct_max}
+    )
+    parameters.add_int(
+        variable_name="resume_round",
+        display_name="Resume at toolkit plate round",
+        description="With swapped toolkit plates, the insert round (1-based, as logged) to resume inserts in.",
+        default=1,
+        minimum=1,
+        maximum={resume_round_max}
+    )
+    parameters.add_int(
+        variable_name="resume_insert",
+        display_name="Resume at fragment",
+        description="With insert-major pipetting, the fragment (1-based, as logged) to resume inserts at.",
+        default=1,
+        minimum=1,
+        maximum={resume_insert_max}
+    )
+    {plan_parameter}
+
 def run(protocol: protocol_api.ProtocolContext):
+    {load_plan}
+    # --- TRANSFER ENGINE ---
+    # The p300 is only used when the generator gave it a tip rack
+    pipettes_available = ["p20"] + (["p300"] if tip_rack_slots["p300"] else [])
+
+    # Pipette and number of aspirations for one transfer: the fewest aspirations among pipettes
+    # accurate at the split volume, the smaller pipette on a tie (same rule as liquids.py)
+    def choose_pipette(vol, liquid):
+        best = None
+        for name in pipettes_available:
+            usable = pipette_specs[name]["max_volume"] - liquid_classes[liquid]["air_gap"]
+            count = max(math.ceil(vol / usable), 1)
+            if vol / count < pipette_specs[name]["min_volume"] and name != "p20":
+                continue
+            if best is None or count < best[1]:
+                best = (name, count)
+        return best
+
+    # Volumes per well, scaled by the number of reactions assembled in it
+    def insert_volume(insert, index):
+        return vol_per_insert_dict.get(insert, 1) * reaction_scale[index]  # Default to 1 if not found
+
+    mm_per_well = [vol * scale for vol, scale in zip(vol_master_mix_per_reaction, reaction_scale)]
+    enzyme_per_well = [float(enzyme_per_reaction) * scale for scale in reaction_scale]
+    insert_totals = [sum(insert_volume(insert, index) for insert in construct) for index, construct in enumerate(constructs)]
+
+    # Water needed for each well to reach the correct total volume
+    water_per_construct = []
+    for index in range(len(construct_tubes)):
+        water_per_construct.append(
+            reaction_vol * reaction_scale[index] - (mm_per_well[index] + enzyme_per_well[index] + insert_totals[index])
+        )
+
+    # Construct indices of each pipelined plate
+    batch_starts = [sum(batch_sizes[:batch]) for batch in range(len(batch_sizes))]
+    construct_batch = [batch for batch, size in enumerate(batch_sizes) for _ in range(size)]
+
+    def batch_indices(batch):
+        return range(batch_starts[batch], batch_starts[batch] + batch_sizes[batch])
+
+    # Inserts from swapped plates are pipetted in rounds, one per plate in toolkit_swaps, so
+    # each plate is swapped in once. Everything else goes in the first round.
+    def swap_round(insert):
+        location = inserts.get(insert)
+        plate_type = location[0] if isinstance(location, (tuple, list)) else None
+        return toolkit_swaps.index(plate_type) if plate_type in toolkit_swaps else 0
+
+    # Pipette whose tip adds the last component of a well and mixes it: the enzyme's with enzyme_last,
+    # else the last insert's. None for insert-major wells, which are mixed with a fresh tip.
+    def finishing_pipette(index):
+        if enzyme_last:
+            return choose_pipette(enzyme_per_well[index], "enzyme")[0]
+        if insert_major:
+            return None
+        last_round = max(swap_round(insert) for insert in constructs[index])
+        last_insert = [insert for insert in constructs[index] if swap_round(insert) == last_round][-1]
+        return choose_pipette(insert_volume(last_insert, index), "dna")[0]
+
     # --- TIP USAGE CHECK & TIPRACK LOADING ---
-    num_master_mix_transfers = len(construct_tubes)
-    num_insert_transfers = sum(len(construct) for construct in constructs)
-    total_p20_tips = num_insert_transfers + sum(1 for v in vol_master_mix_per_reaction if v < 20)
-    total_p300_tips = sum(1 for v in vol_master_mix_per_reaction if v >= 20)
+    # Per plate, one tip per pipette for all water and for all master mix, one per enzyme transfer,
+    # insert and diluted product, and one to mix and split a replicate reaction unless the finishing
+    # tip is on the pipette the split needs
+    def count_tips(batch):
+        tips = {{"p20": 0, "p300": 0}}
 
-    # Calculate how many tip racks are needed (each rack has 96 tips)
-    num_p20_racks = (total_p20_tips - 1) // 96 + 1 if total_p20_tips > 0 else 0
-    num_p300_racks = (total_p300_tips - 1) // 96 + 1 if total_p300_tips > 0 else 0
+        def count_shared_tip(vols, liquid):
+            for name in {{choose_pipette(vol, liquid)[0] for vol in vols if vol > 0}}:
+                tips[name] += 1
 
-    # Assign deck slots for tip racks and toolkit plates
-    available_slots = ["1", "2", "3", "5", "6", "9"]
+        def count_own_tips(vols, liquid):
+            for vol in vols:
+                if vol > 0:
+                    tips[choose_pipette(vol, liquid)[0]] += 1
 
-    p20_slots = available_slots[:num_p20_racks]
-    p300_slots = available_slots[num_p20_racks:num_p20_racks+num_p300_racks]
-    toolkit_slots = available_slots[num_p20_racks+num_p300_racks:]
+        indices = batch_indices(batch)
+        if batch == 0:
+            count_shared_tip([water_vol for _, _, _, water_vol in dilutions], "water")
+            count_own_tips([product_vol for _, _, product_vol, _ in dilutions], "dna")
+        count_shared_tip([water_per_construct[index] for index in indices], "water")
+        count_shared_tip([mm_per_well[index] for index in indices], "master_mix")
+        if enzyme_last:
+            # The enzyme tip mixes the reaction, so every well building one takes a tip
+            for index in indices:
+                if reaction_scale[index]:
+                    tips[choose_pipette(enzyme_per_well[index], "enzyme")[0]] += 1
+        else:
+            count_own_tips([enzyme_per_well[index] for index in indices], "enzyme")
+        insert_vols = [(insert, insert_volume(insert, index)) for index in indices for insert in constructs[index]]
+        if insert_major:
+            # One tip per fragment and pipette
+            tips_by_insert = {{(insert, choose_pipette(vol, "dna")[0]) for insert, vol in insert_vols if vol > 0}}
+            for _, name in tips_by_insert:
+                tips[name] += 1
+        else:
+            count_own_tips([vol for _, vol in insert_vols], "dna")
+        for index in indices:
+            if not reaction_scale[index] or not constructs[index]:
+                continue
+            finisher = finishing_pipette(index)
+            splitter = choose_pipette(reaction_vol, "reaction")[0] if index in replicate_splits else None
+            if finisher is None:
+                tips[splitter or choose_pipette(insert_totals[index], "dna")[0]] += 1
+            elif splitter and splitter != finisher:
+                tips[splitter] += 1
+        return tips
+
+    # Tip racks are refilled when plates are swapped: the first two plates are pipetted before the
+    # first swap, every later plate while its predecessor cycles
+    batch_tips = [count_tips(batch) for batch in range(len(batch_sizes))]
+    tip_periods = [list(range(min(2, len(batch_sizes))))] + [[batch] for batch in range(2, len(batch_sizes))]
+    total_p20_tips = max(sum(batch_tips[batch]["p20"] for batch in period) for period in tip_periods)
+    total_p300_tips = max(sum(batch_tips[batch]["p300"] for batch in period) for period in tip_periods)
+
+    # Tip racks go in the slots chosen by the generator, toolkit plates in the planner's slots
+    p20_slots = tip_rack_slots["p20"]
+    p300_slots = tip_rack_slots["p300"]
 
     # Load tip racks
-    tips20_racks = []
-    tips300_racks = []
-    if total_p20_tips > 0:
-        tips20_racks = [protocol.load_labware("opentrons_96_tiprack_20ul", slot) for slot in p20_slots]
-    if total_p300_tips > 0:
-        tips300_racks = [protocol.load_labware("opentrons_96_tiprack_300ul", slot) for slot in p300_slots]
+    tips20_racks = [protocol.load_labware("opentrons_96_tiprack_20ul", slot) for slot in p20_slots]
+    tips300_racks = [protocol.load_labware("opentrons_96_tiprack_300ul", slot) for slot in p300_slots]
     # Load other labware
-    use_reservoir_for_mm = sum(vol_master_mix_per_reaction) > 1000
-    if use_reservoir_for_mm:
-        master_mix_reservoir = protocol.load_labware("nest_12_reservoir_15ml", available_slots[num_p20_racks:num_p20_racks+num_p300_racks:num_p300_racks+1])  # Use slot 5 for master mix
+    reservoir = None
+    if reservoir_slot is not None:
+        reservoir = protocol.load_labware("nest_12_reservoir_15ml", reservoir_slot)
     tc_mod = protocol.load_module(module_name="thermocyclerModuleV2")
     tc_plate = tc_mod.load_labware(name="opentrons_96_wellplate_200ul_pcr_full_skirt")
     temp_mod = protocol.load_module(
@@ -74,19 +255,28 @@ def run(protocol: protocol_api.ProtocolContext):
     temp_tubes = temp_mod.load_labware(
         "opentrons_24_aluminumblock_nest_1.5ml_snapcap"
     )
+    overflow_plates = {{
+        name: protocol.load_labware(overflow_labware, slot) for name, slot in overflow_slots.items()
+    }}
+    # Plates after the first are pipetted on a PCR plate on a chilled aluminum block, then moved onto the thermocycler
+    prep_plate = None
+    if prep_plate_slot is not None:
+        prep_plate = protocol.load_adapter("opentrons_96_well_aluminum_block", prep_plate_slot).load_labware(
+            "opentrons_96_wellplate_200ul_pcr_full_skirt", label="Prep plate"
+        )
     # --- Load all toolkit plates needed ---
-    toolkit_plate_types = set()
-    for val in inserts.values():
-        if isinstance(val, (tuple, list)):
-            plate_type, _ = val
-            if plate_type not in ("tube_rack", "temp_module"):
-                toolkit_plate_types.add(plate_type)
     toolkit_plates = {{}}
-    for idx, plate_type in enumerate(sorted(toolkit_plate_types)):
-        if idx < len(toolkit_slots):
-            toolkit_plates[plate_type] = protocol.load_labware("nest_96_wellplate_200ul_flat", toolkit_slots[idx])
-        else:
-            toolkit_plates[plate_type] = None
+    for plate_type, slot in toolkit_plate_slots.items():
+        if plate_type not in toolkit_swaps:
+            toolkit_plates[plate_type] = protocol.load_labware("nest_96_wellplate_200ul_flat", slot)
+    # Swapped plates have the same labware type, so one labware stands for whichever is in the slot
+    if toolkit_swaps:
+        swap_plate = protocol.load_labware(
+            "nest_96_wellplate_200ul_flat", toolkit_plate_slots[toolkit_swaps[0]], label=" / ".join(toolkit_swaps)
+        )
+        for plate_type in toolkit_swaps:
+            toolkit_plates[plate_type] = swap_plate
+    swap_state = {{"loaded": toolkit_swaps[0] if toolkit_swaps else None}}
 
     # Initialize pipettes with all loaded tip racks
     if tips300_racks:
@@ -98,26 +288,53 @@ def run(protocol: protocol_api.ProtocolContext):
     else:
         p20 = protocol.load_instrument("p20_single_gen2", "left")
 
+    pipettes = {{"p20": p20, "p300": p300}}
+
     # --- TIP USAGE CHECK ---
-    if (total_p20_tips + total_p300_tips) > 480:
+    if total_p20_tips > 96 * len(tips20_racks) or total_p300_tips > 96 * len(tips300_racks):
         raise Exception(
-            f"Not enough tips: Need {total_p20_tips} x 20uL tips and {total_p300_tips} x 300uL tips, "
-            "but only 5 racks are loaded. Please reduce the number of reactions."
+            f"Not enough tips: Need {{total_p20_tips}} x 20uL tips and {{total_p300_tips}} x 300uL tips, "
+            f"but {{len(tips20_racks)}} and {{len(tips300_racks)}} racks are loaded. Please reduce the number of reactions."
         )
 
     # Initialize thermocycler
     tc_mod.open_lid()
     protocol.set_rail_lights(True)
 
-    # Pipette transfer function to handle both pipettes
-    def pipette_transfer(vol, source, dest, pipette=None):
-        if pipette is not None:
-            pipette.transfer(vol, source, dest, new_tip='never')
-        else:
-            if vol < 20:
-                p20.transfer(vol, source, dest, new_tip='never')
-            else:
-                p300.transfer(vol, source, dest, new_tip='never')
+    # Move vol with the liquid's handling (flow rates, delay, air gap, blow out, touch tip),
+    # split into as few aspirations as the chosen pipette allows. The tip is handled by the caller.
+    def liquid_transfer(vol, source, dest, liquid):
+        name, count = choose_pipette(vol, liquid)
+        pipette = pipettes[name]
+        if vol <= 0:
+            return pipette
+        handling = liquid_classes[liquid]
+        split = vol / count
+        for _ in range(count):
+            pipette.aspirate(split, source, rate=handling["aspirate_rate"])
+            if handling["delay"]:
+                protocol.delay(seconds=handling["delay"])
+            if handling["air_gap"]:
+                pipette.air_gap(handling["air_gap"])
+            pipette.dispense(split + handling["air_gap"], dest, rate=handling["dispense_rate"])
+            if handling["blow_out"]:
+                pipette.blow_out(dest)
+            if handling["touch_tip"]:
+                pipette.touch_tip(dest)
+        return pipette
+
+    # Same liquid into many wells, one tip per pipette used. Yields after every transfer (see prepare_batch).
+    def distribute(liquid, volumes, sources, dest_wells):
+        by_pipette = {{}}
+        for vol, source, dest in zip(volumes, sources, dest_wells):
+            if vol > 0:
+                by_pipette.setdefault(choose_pipette(vol, liquid)[0], []).append((vol, source, dest))
+        for name, transfers in by_pipette.items():
+            pipettes[name].pick_up_tip()
+            for vol, source, dest in transfers:
+                liquid_transfer(vol, source, dest, liquid)
+                yield
+            pipettes[name].drop_tip()
 
     # Blink and pause function
     def pause(message):
@@ -129,93 +346,369 @@ def run(protocol: protocol_api.ProtocolContext):
         protocol.set_rail_lights(False)
         protocol.pause(message)
 
-    # Distribute master mix to tubes using multi-dispense (one tip per batch)
-    def distribute_master_mix(volumes, source, dest_wells, pipette):
-        pipette.pick_up_tip()
-        for vol, dest in zip(volumes, dest_wells):
-            pipette.aspirate(vol, source)
-            pipette.dispense(vol, dest)
-        pipette.drop_tip()
+    # Resume point: phases before resume_phase are skipped, and in resume_phase itself
+    # constructs before resume_construct. Tip racks and deck layout stay as in a full run.
+    # With pipelined batches, plates before the one holding resume_construct are skipped and
+    # that plate is finished on the thermocycler. Inserts from swapped plates also resume at
+    # resume_round: earlier rounds are done, later ones are still to do for every construct.
+    # Insert-major inserts resume at resume_insert instead, see prepare_batch.
+    resume_phase = protocol.params.resume_phase
+    resume_construct = protocol.params.resume_construct - 1
+    resume_round = protocol.params.resume_round - 1
+    resume_insert = protocol.params.resume_insert - 1
+    if resume_construct >= max(len(construct_tubes), 1) or resume_round >= max(len(toolkit_swaps), 1):
+        raise Exception(
+            f"Cannot resume at construct {{resume_construct + 1}} in round {{resume_round + 1}}: the plan has "
+            f"{{len(construct_tubes)}} constructs and {{max(len(toolkit_swaps), 1)}} toolkit plate rounds."
+        )
+    resume_batch = construct_batch[min(resume_construct, len(construct_batch) - 1)] if construct_batch else 0
+    phase_order = list(resume_phases)
+    if enzyme_last:
+        phase_order.remove("enzyme")
+        phase_order.insert(phase_order.index("inserts") + 1, "enzyme")
 
-    # Group wells by pipette type (p20 for <20uL, p300 for >=20uL)
-    wells_p20 = []
-    vols_p20 = []
-    wells_p300 = []
-    vols_p300 = []
-    for idx, vol in enumerate(vol_master_mix_per_reaction):
-        if vol < 20:
-            wells_p20.append(tc_plate[construct_tubes[idx]])
-            vols_p20.append(vol)
-        else:
-            wells_p300.append(tc_plate[construct_tubes[idx]])
-            vols_p300.append(vol)
+    def phase_todo(phase, batch):
+        return batch > resume_batch or phase_order.index(phase) >= phase_order.index(resume_phase)
 
-    # Use the correct source for master mix
-    if use_reservoir_for_mm:
-        mm_source = master_mix_reservoir[master_mix] if not isinstance(master_mix, (tuple, list)) else master_mix_reservoir[master_mix[1]]
-    else:
-        mm_source = temp_tubes[master_mix]
-
-    # Calculate water needed for each well to reach the correct total volume
-    wells_needing_water = []
-    water_vols = []
-    for index, construct_tube in enumerate(construct_tubes):
-        construct_inserts = constructs[index]
-        total_insert_vol = sum(vol_per_insert_dict.get(insert, 5) for insert in construct_inserts)
-        water_needed = reaction_vol - (vol_master_mix_per_reaction[index] + float(enzyme_per_reaction) + total_insert_vol)
-        if water_needed > 0:
-            wells_needing_water.append(tc_plate[construct_tube])
-            water_vols.append(water_needed)
-    if wells_needing_water:
-        p20.pick_up_tip()
-        for vol, dest in zip(water_vols, wells_needing_water):
-            p20.transfer(vol, temp_tubes[water_loc], dest, new_tip='never')
-        p20.drop_tip()
-
-    # Now distribute master mix to each well
-    if wells_p20:
-        distribute_master_mix(vols_p20, mm_source, wells_p20, p20)
-    if wells_p300:
-        distribute_master_mix(vols_p300, mm_source, wells_p300, p300)
-
-    # --- Distribute enzyme to each well (same as master mix, always use p20) ---
-    enzyme_source = temp_tubes[enzyme_loc]
-    for idx, well in enumerate(construct_tubes):
-        p20.pick_up_tip()
-        p20.transfer(float(enzyme_per_reaction), enzyme_source, tc_plate[well], new_tip='never')
-        p20.drop_tip()
-
-    # Now add inserts to each well
-    for index, construct_tube in enumerate(construct_tubes):
-        construct_inserts = constructs[index]
-        for i, insert in enumerate(construct_inserts):
-            insert_location = inserts[insert]
-            insert_vol = vol_per_insert_dict.get(insert, 1)  # Default to 1 if not found
-            p20.pick_up_tip()
-            # Decide which plate to use for each insert
-            if isinstance(insert_location, tuple) or isinstance(insert_location, list):
-                plate_type, well = insert_location
-                if plate_type in toolkit_plates and toolkit_plates[plate_type] is not None:
-                    pipette_transfer(insert_vol, toolkit_plates[plate_type][well], tc_plate[construct_tube], pipette=p20)
-                else:
-                    pipette_transfer(insert_vol, temp_tubes[well], tc_plate[construct_tube], pipette=p20)
+    def first_construct(phase, batch):
+        return resume_construct if batch == resume_batch and phase == resume_phase else batch_starts[batch]
+
+    # Whether the inserts of a swap round are still to go into a construct
+    def round_todo(index, round_index, batch):
+        if not phase_todo("inserts", batch):
+            return False
+        if batch != resume_batch or resume_phase != "inserts":
+            return True
+        return round_index > resume_round or (round_index == resume_round and index >= resume_construct)
+
+    def start_phase(phase, batch):
+        if phase_todo(phase, batch):
+            protocol.comment(f"Phase: {{phase}}" if len(batch_sizes) == 1 else f"Phase: {{phase}} (plate {{batch + 1}})")
+        return phase_todo(phase, batch)
+
+    # The plate on the thermocycler is built there, the next one on the prep plate
+    on_thermocycler = {{"batch": resume_batch}}
+
+    def reaction_well(index):
+        plate = tc_plate if construct_batch[index] == on_thermocycler["batch"] else prep_plate
+        return plate[construct_tubes[index]]
+
+    if resume_phase != "start":
+        on_plate = f" on plate {{resume_batch + 1}}, which goes on the thermocycler" if len(batch_sizes) > 1 else ""
+        in_round = ""
+        if toolkit_swaps:
+            # The plate of the resume round is in the swap slot, later swaps are asked for as usual
+            swap_state["loaded"] = toolkit_swaps[resume_round if resume_phase == "inserts" else 0]
+            in_round = (
+                f" Resuming inserts in round {{resume_round + 1}}, put the {{swap_state['loaded']}} plate "
+                f"in slot {{toolkit_plate_slots[swap_state['loaded']]}}." if resume_phase == "inserts"
+                else f" Put the {{swap_state['loaded']}} plate in slot {{toolkit_plate_slots[swap_state['loaded']]}}."
+            )
+        pause(
+            f"Resuming from {{resume_phase.replace('_', ' ')}} at construct {{resume_construct + 1}}{{on_plate}}.{{in_round}} "
+            "Check that fresh tip racks are loaded, then resume."
+        )
+        protocol.set_rail_lights(True)
+    elif start_message:
+        pause(start_message)
+        protocol.set_rail_lights(True)
+
+    # Reagent source well from the planner's (labware, well) assignment
+    def source_well(source):
+        labware, well = source
+        if labware == "reservoir":
+            return reservoir[well]
+        return temp_tubes[well]
+
+    # Source labware well of an insert
+    def insert_well(insert_location):
+        if isinstance(insert_location, tuple) or isinstance(insert_location, list):
+            plate_type, well = insert_location
+            if plate_type in toolkit_plates:
+                load_toolkit_plate(plate_type)
+                return toolkit_plates[plate_type][well]
+            if plate_type in overflow_plates:
+                return overflow_plates[plate_type][well]
+            if plate_type == "tc_plate":
+                return tc_plate[well]
+            return temp_tubes[well]
+        return temp_tubes[insert_location]
+
+    # Ask the operator to put a swapped toolkit plate in its slot if another one is there
+    def load_toolkit_plate(plate_type):
+        if plate_type in toolkit_swaps and swap_state["loaded"] != plate_type:
+            pause(
+                f"Swap the {{swap_state['loaded']}} plate in slot {{toolkit_plate_slots[plate_type]}} "
+                f"for the {{plate_type}} plate, then resume."
+            )
+            protocol.set_rail_lights(True)
+            swap_state["loaded"] = plate_type
+
+    # Liquid height of a well holding volume, treating the well as a cone, which overestimates it
+    def liquid_height(well, volume):
+        return well.depth * min(volume / well.max_volume, 1) ** (1 / 3)
+
+    # Liquid height treating the well as a column as wide as its top, which underestimates it
+    def low_liquid_height(well, volume):
+        area = math.pi * (well.diameter / 2) ** 2 if well.diameter else well.length * well.width
+        return volume / area
+
+    # Height above the bottom of a well clear of its liquid, so a tip dispensing there stays dry
+    def clear_height(well, volume):
+        return min(liquid_height(well, volume) + 2, well.depth - 1)
+
+    def above_liquid(well, volume):
+        return well.bottom(clear_height(well, volume))
+
+    # Touch a tip that dispensed above the liquid off against the well wall at the same height, so
+    # drops too small to fall go into the well. The tip reaches a little past the cone of
+    # liquid_height, which lies inside the real wall, and never touches the liquid.
+    def touch_wall(pipette, well, volume):
+        height = clear_height(well, volume)
+        pipette.touch_tip(well, radius=min(height / well.depth + 0.1, 1), v_offset=height - well.depth)
+
+    # --- MIXING ENGINE ---
+    # Mix a well holding volume uL of liquid with the tip on pipette, with the profile of the liquid's
+    # mix class (same rule as liquids.py). Flow rates are passed per stroke, so the pipette's own flow
+    # rates never change and transfers before and after are unaffected.
+    def mix_well(pipette, well, volume, liquid):
+        profile = mix_classes[liquid]
+        vol = max(min(pipette.max_volume, volume * profile["fraction"]), 1)
+        reps = min(max(math.ceil(profile["turnovers"] * volume / vol), profile["min_reps"]), profile["max_reps"])
+        aspirate_location = well.bottom(1)
+        dispense_location = well.bottom(max(low_liquid_height(well, volume) * profile["dispense_depth"], 1))
+        for _ in range(reps):
+            pipette.aspirate(vol, aspirate_location, rate=profile["aspirate_rate"])
+            pipette.dispense(vol, dispense_location, rate=profile["dispense_rate"])
+        if profile["blow_out"]:
+            pipette.blow_out(above_liquid(well, volume))
+        if profile["touch_tip"]:
+            pipette.touch_tip(well)
+
+    # Mix a finished reaction and give each replicate split from it one reaction volume, with the
+    # tip on pipette (that added the last component) or a fresh one. A scaled reaction is mixed and
+    # split by the pipette the split needs, so the finishing tip is dropped if it is on the other one.
+    # A generator that yields between the mix and each split (see prepare_batch), callers yield after it.
+    def finish_construct(index, pipette=None):
+        well = reaction_well(index)
+        if index in replicate_splits:
+            splitter = pipettes[choose_pipette(reaction_vol, "reaction")[0]]
+            if pipette is not None and pipette is not splitter:
+                pipette.drop_tip()
+                pipette = None
+            if pipette is None:
+                pipette = splitter
+                pipette.pick_up_tip()
+        elif pipette is None:
+            pipette = pipettes[choose_pipette(insert_totals[index], "dna")[0]]
+            pipette.pick_up_tip()
+        mix_well(pipette, well, reaction_vol * reaction_scale[index], "reaction")
+        if index in replicate_splits:
+            protocol.comment(f"Splitting construct {{index + 1}} ({{construct_tubes[index]}}) into its replicates")
+            for member in replicate_splits[index]:
+                yield
+                liquid_transfer(reaction_vol, well, reaction_well(member), "reaction")
+        pipette.drop_tip()
+
+    # --- Distribute enzyme to each well, a fresh tip each so the stock stays clean. Added last, the
+    # same tip mixes the finished reaction and splits its replicates. ---
+    def add_enzyme(batch):
+        start_phase("enzyme", batch)
+        for idx in batch_indices(batch):
+            if not phase_todo("enzyme", batch) or idx < first_construct("enzyme", batch):
+                continue
+            if enzyme_per_well[idx] <= 0 and not (enzyme_last and reaction_scale[idx]):
+                continue
+            pipette = pipettes[choose_pipette(enzyme_per_well[idx], "enzyme")[0]]
+            pipette.pick_up_tip()
+            liquid_transfer(enzyme_per_well[idx], source_well(enzyme_sources[idx]), reaction_well(idx), "enzyme")
+            if enzyme_last:
+                yield
+                yield from finish_construct(idx, pipette)
             else:
-                pipette_transfer(insert_vol, temp_tubes[insert_location], tc_plate[construct_tube], pipette=p20)
-            # After the last insert, custom mix in the destination well with the same tip, then drop
-            if i == len(construct_inserts) - 1:
-                custom_mix(
-                    pipette=p20,
-                    well=tc_plate[construct_tube],
-                    mixreps=4,
-                    vol=min(20, insert_vol * len(construct_inserts)),
-                    z_asp=1,
-                    z_disp_source_mix=8,
-                    z_disp_destination=8
+                pipette.drop_tip()
+            yield
+
+    # Assemble the reactions of one plate phase by phase. A generator that yields after every
+    # transfer, so a plate can be pipetted in the holds of the thermocycler program of the one before.
+    def prepare_batch(batch):
+        # Dilute products of the previous level into fresh wells before they are used as inserts
+        if batch == 0 and dilutions and start_phase("dilutions", batch):
+            dilution_water = source_well(next((s for s in water_sources if s), ("tube_rack", water_loc)))
+            yield from distribute(
+                "water",
+                [water_vol for _, _, _, water_vol in dilutions],
+                [dilution_water] * len(dilutions),
+                [tc_plate[dilution_well] for _, dilution_well, _, _ in dilutions],
+            )
+            for product_well, dilution_well, product_vol, water_vol in dilutions:
+                pipette = pipettes[choose_pipette(product_vol, "dna")[0]]
+                pipette.pick_up_tip()
+                liquid_transfer(product_vol, tc_plate[product_well], tc_plate[dilution_well], "dna")
+                mix_well(pipette, tc_plate[dilution_well], product_vol + water_vol, "dna")
+                pipette.drop_tip()
+                yield
+
+        # Water to bring each well to the reaction volume, one tip for all wells
+        if start_phase("water", batch):
+            todo = [idx for idx in batch_indices(batch) if idx >= first_construct("water", batch)]
+            yield from distribute(
+                "water",
+                [water_per_construct[idx] for idx in todo],
+                [source_well(water_sources[idx]) if water_sources[idx] else None for idx in todo],
+                [reaction_well(idx) for idx in todo],
+            )
+
+        # Now distribute master mix to each well
+        if start_phase("master_mix", batch):
+            todo = [idx for idx in batch_indices(batch) if idx >= first_construct("master_mix", batch)]
+            yield from distribute(
+                "master_mix",
+                [mm_per_well[idx] for idx in todo],
+                [source_well(master_mix_sources[idx]) if master_mix_sources[idx] else None for idx in todo],
+                [reaction_well(idx) for idx in todo],
+            )
+
+        if not enzyme_last:
+            yield from add_enzyme(batch)
+
+        # Insert-major: one tip per fragment. Each aspiration serves as many wells as fit, dispensing
+        # above the liquid and touching off on the wall so the tip never touches a reaction and can
+        # return to the source. A well is mixed (and split) with a fresh tip once its last insert is in.
+        start_phase("inserts", batch)
+        if insert_major and phase_todo("inserts", batch):
+            # Fragments in the logged order, grouped by swap round. On resume the fragments before
+            # resume_insert are in, and resume_insert itself is in the constructs before resume_construct.
+            uses = {{}}
+            for index in batch_indices(batch):
+                if reaction_scale[index]:
+                    for insert in constructs[index]:
+                        uses.setdefault(insert, []).append(index)
+            order = sorted(uses, key=swap_round)
+            resuming = batch == resume_batch and resume_phase == "inserts"
+            if resuming and resume_insert >= len(order):
+                raise Exception(
+                    f"Cannot resume at fragment {{resume_insert + 1}}: plate {{batch + 1}} has {{len(order)}} fragments."
+                )
+
+            def insert_todo(position, index):
+                if not resuming:
+                    return True
+                return position > resume_insert or (position == resume_insert and index >= resume_construct)
+
+            # Inserts already in on resume count towards the well volume
+            well_volumes = {{}}
+            inserts_left = {{}}
+            for position, insert in enumerate(order):
+                for index in uses[insert]:
+                    well_volumes.setdefault(index, reaction_vol * reaction_scale[index] - insert_totals[index])
+                    if insert_todo(position, index):
+                        inserts_left[index] = inserts_left.get(index, 0) + 1
+                    else:
+                        well_volumes[index] += insert_volume(insert, index)
+            dna = liquid_classes["dna"]
+            for position, insert in enumerate(order):
+                indices = [index for index in uses[insert] if insert_todo(position, index)]
+                if not indices:
+                    continue
+                source = insert_well(inserts[insert])
+                in_round = f" (round {{swap_round(insert) + 1}})" if toolkit_swaps else ""
+                protocol.comment(
+                    f"Insert {{position + 1}} of {{len(order)}}: {{insert}} into {{len(indices)}} constructs{{in_round}}"
                 )
-            p20.drop_tip()
+                by_pipette = {{}}
+                for index in indices:
+                    vol = insert_volume(insert, index)
+                    by_pipette.setdefault(choose_pipette(vol, "dna")[0], []).append((index, vol))
+                for name, dests in by_pipette.items():
+                    pipette = pipettes[name]
+                    disposal = pipette_specs[name]["min_volume"]
+                    usable = pipette.max_volume - disposal
+                    # Volumes too large for one aspiration are split, then packed into trips in order
+                    trips = [[]]
+                    for index, vol in dests:
+                        splits = max(math.ceil(vol / usable), 1)
+                        for _ in range(splits):
+                            if trips[-1] and sum(part for _, part in trips[-1]) + vol / splits > usable:
+                                trips.append([])
+                            trips[-1].append((index, vol / splits))
+                    pipette.pick_up_tip()
+                    for trip in trips:
+                        protocol.comment(f"Constructs {{', '.join(str(index + 1) for index in dict(trip))}}")
+                        pipette.aspirate(sum(part for _, part in trip) + disposal, source, rate=dna["aspirate_rate"])
+                        for index, part in trip:
+                            well = reaction_well(index)
+                            pipette.dispense(part, above_liquid(well, well_volumes[index]), rate=dna["dispense_rate"])
+                            touch_wall(pipette, well, well_volumes[index])
+                            well_volumes[index] += part
+                        pipette.blow_out(source.top())
+                        yield
+                    pipette.drop_tip()
+                for index in indices:
+                    inserts_left[index] -= 1
+                    if inserts_left[index] == 0 and not enzyme_last:
+                        yield from finish_construct(index)
+                        yield
+
+        # Otherwise construct by construct, a fresh tip for each insert
+        for round_index in range(max(len(toolkit_swaps), 1)):
+            for index in batch_indices(batch):
+                if insert_major or not round_todo(index, round_index, batch) or not reaction_scale[index]:
+                    continue
+                construct_tube = construct_tubes[index]
+                construct_inserts = constructs[index]
+                round_inserts = [insert for insert in construct_inserts if swap_round(insert) == round_index]
+                if not round_inserts:
+                    continue
+                last_round = max(swap_round(insert) for insert in construct_inserts) == round_index
+                in_round = f", round {{round_index + 1}}" if toolkit_swaps else ""
+                protocol.comment(f"Inserts for construct {{index + 1}} ({{construct_tube}}{{in_round}})")
+                for i, insert in enumerate(round_inserts):
+                    insert_vol = insert_volume(insert, index)
+                    pipette = pipettes[choose_pipette(insert_vol, "dna")[0]]
+                    # The source first, so a plate swap is asked for before a tip is on the pipette
+                    source = insert_well(inserts[insert])
+                    pipette.pick_up_tip()
+                    liquid_transfer(insert_vol, source, reaction_well(index), "dna")
+                    # After the last insert, mix the destination well (and split it) with the same tip
+                    if last_round and i == len(round_inserts) - 1 and not enzyme_last:
+                        yield
+                        yield from finish_construct(index, pipette)
+                    else:
+                        pipette.drop_tip()
+                    yield
 
-    # Close the thermocycler lid before starting the protocol
-    tc_mod.close_lid()
+        if enzyme_last:
+            yield from add_enzyme(batch)
+
+    # Hold the block at temperature for seconds. With work (a plate being prepared), its steps are
+    # pipetted while the block holds as long as the longest step so far still fits, and the rest of
+    # the hold is waited out. Steps are timed on the robot's clock, in simulation each counts
+    # seconds_per_transfer.
+    def hold(temperature, seconds, work=None, block_max_volume=reaction_vol):
+        if not work or not work["steps"]:
+            tc_mod.set_block_temperature(
+                temperature=temperature,
+                hold_time_seconds=seconds,
+                block_max_volume=block_max_volume
+            )
+            return
+        tc_mod.set_block_temperature(temperature=temperature, block_max_volume=block_max_volume)
+        started = time.monotonic()
+        steps = 0
+
+        def elapsed():
+            return steps * seconds_per_transfer if protocol.is_simulating() else time.monotonic() - started
+
+        # Until a step has been timed, seconds_per_transfer stands in for the longest
+        while work["steps"] and elapsed() + work.get("longest_step", seconds_per_transfer) <= seconds:
+            step_started = elapsed()
+            if next(work["steps"], "done") == "done":
+                work["steps"] = None
+            steps += 1
+            work["longest_step"] = max(work.get("longest_step", 0), elapsed() - step_started)
+        if seconds - elapsed() > 0:
+            protocol.delay(seconds=seconds - elapsed())
 
     '''
     Thermocycler protocol based on BsaI test protocol, variables passed from script generation
@@ -233,72 +726,58 @@ def run(protocol: protocol_api.ProtocolContext):
     '''    
 
     # --- THERMOCYCLER PROTOCOL (use new variables) ---
-    tc_mod.close_lid()
-    tc_mod.set_lid_temperature(temperature=(float(tc_step7_temp) + 10))
-
-    # Step 1
-    tc_mod.set_block_temperature(
-        temperature=float(tc_step1_temp),
-        hold_time_seconds=int(tc_step1_time),
-        block_max_volume=reaction_vol
-    )
-    # Step 2 & 3 cycling
-    for i in range(int(tc_step4_cycles)):
-        tc_mod.set_block_temperature(
-            temperature=float(tc_step2_temp),
-            hold_time_seconds=int(tc_step2_time),
-            block_max_volume=reaction_vol
-        )
-        tc_mod.set_block_temperature(
-            temperature=float(tc_step3_temp),
-            hold_time_seconds=int(tc_step3_time),
-            block_max_volume=reaction_vol
-        )
-    # Step 5
-    tc_mod.set_block_temperature(
-        temperature=float(tc_step5_temp),
-        hold_time_seconds=int(tc_step5_time),
-        block_max_volume=reaction_vol
-    )
-    # Step 6
-    tc_mod.set_block_temperature(
-        temperature=float(tc_step6_temp),
-        hold_time_seconds=int(tc_step6_time),
-        block_max_volume=reaction_vol
-    )
-    # Step 7
-    tc_mod.set_block_temperature(
-        temperature=float(tc_step7_temp),
-        hold_time_seconds=int(tc_step7_time),
-        block_max_volume=reaction_vol
-    )
-    # Step 8
-    tc_mod.set_block_temperature(
-        temperature=float(tc_step8_temp),
-        hold_time_seconds=int(tc_step8_time)
-    )
-    tc_mod.deactivate_lid()
-    protocol.delay(seconds=5)
-    pause("Thermocycler protocol complete, holding at 4 Celsius. Press continue to open thermocycler lid.")
-    protocol.set_rail_lights(True)
-    tc_mod.open_lid()
+    def run_thermocycler(work):
+        tc_mod.close_lid()
+        tc_mod.set_lid_temperature(temperature=(float(tc_step7_temp) + 10))
 
-def custom_mix(pipette, well, mixreps=3, vol=20, z_asp=1, z_disp_source_mix=8, z_disp_destination=8):
-    # Save original flow rates
-    orig_asp = pipette.flow_rate.aspirate
-    orig_disp = pipette.flow_rate.dispense
-    # Increase flow rates for mixing
-    pipette.flow_rate.aspirate *= 4
-    pipette.flow_rate.dispense *= 6
-    for _ in range(mixreps):
-        pipette.aspirate(vol, well.bottom(z_asp))
-        pipette.dispense(vol, well.bottom(z_disp_source_mix))
-    # Restore original flow rates BEFORE blow out
-    pipette.flow_rate.aspirate = orig_asp
-    pipette.flow_rate.dispense = orig_disp
-    # Blow out just above the bottom to help droplet detach
-    pipette.blow_out(well.bottom(z_disp_destination + 2))
-    # Touch tip to the well wall to remove any droplet
-    pipette.touch_tip(well)
+        # Step 1
+        hold(float(tc_step1_temp), int(tc_step1_time), work)
+        # Step 2 & 3 cycling
+        for i in range(int(tc_step4_cycles)):
+            hold(float(tc_step2_temp), int(tc_step2_time), work)
+            hold(float(tc_step3_temp), int(tc_step3_time), work)
+        # Step 5
+        hold(float(tc_step5_temp), int(tc_step5_time), work)
+        # Step 6
+        hold(float(tc_step6_temp), int(tc_step6_time), work)
+        # Step 7
+        hold(float(tc_step7_temp), int(tc_step7_time), work)
+        # Step 8
+        hold(float(tc_step8_temp), int(tc_step8_time), work, block_max_volume=None)
+        tc_mod.deactivate_lid()
 
+    # The first plate is prepared outright, then each plate cycles while the next one is prepared
+    for _ in prepare_batch(resume_batch):
+        pass
+    for batch in range(resume_batch, len(batch_sizes)):
+        last_batch = batch == len(batch_sizes) - 1
+        work = {{"steps": None if last_batch else prepare_batch(batch + 1)}}
 
+        # Close the thermocycler lid before starting the protocol
+        tc_mod.close_lid()
+        start_phase("thermocycler", batch)
+        run_thermocycler(work)
+        # Pipetting that did not fit in the holds finishes while the block holds at step 8
+        for _ in work["steps"] or ():
+            pass
+        protocol.delay(seconds=5)
+        if last_batch:
+            pause("Thermocycler protocol complete, holding at 4 Celsius. Press continue to open thermocycler lid.")
+            protocol.set_rail_lights(True)
+            tc_mod.open_lid()
+            continue
+        pause(
+            f"Plate {{batch + 1}} of {{len(batch_sizes)}} is done, holding at 4 Celsius. "
+            "Press continue to open the thermocycler lid."
+        )
+        protocol.set_rail_lights(True)
+        tc_mod.open_lid()
+        pause(
+            f"Take plate {{batch + 1}} out of the thermocycler, move the prep plate (plate {{batch + 2}}) from slot "
+            f"{{prep_plate_slot}} onto the thermocycler, put a fresh PCR plate on the chilled block and "
+            "refill the tip racks, then resume."
+        )
+        protocol.set_rail_lights(True)
+        for pipette in pipettes.values():
+            pipette.reset_tipracks()
+        on_thermocycler["batch"] = batch + 1
@@ -0,0 +1,18 @@
+import os
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(REPO, "tests", "data")
+sys.path.insert(0, REPO)
+
+import hierarchy
+
+# Level 2 uses 3 of the 50 level-1 products, so only those get dilution wells and its constructs
+# follow right after them
+def test_dilution_wells_only_for_used_products():
+    level1, level2 = hierarchy.plan_hierarchy(
+        hierarchy.read_manifest(os.path.join(DATA, "hierarchy", "manifest.csv")), False
+    )
+    assert len(level1["construct_tubes"]) == 50
+    assert [dilution_well for _, dilution_well, _, _ in level2["dilutions"]] == ["E3", "E4", "E5"]
+    assert level2["construct_tubes"] == ["E6", "E7"]
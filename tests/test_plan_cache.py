@@ -0,0 +1,26 @@
+import os
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(REPO, "tests", "data")
+sys.path.insert(0, REPO)
+
+import plan_cache
+import planner
+import registry
+
+# Planning against a registry records the plan's positions, and the same inputs planned again
+# come from the cache instead of being planned once more
+def test_registry_plan_is_cached_after_recording(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO)
+    paths = [os.path.join(DATA, "replicates", name) for name in ("fragments.csv", "constructs.csv")]
+    cache = plan_cache.ProtocolCache(str(tmp_path / "cache"))
+    builds = []
+    build_plan = planner.build_plan
+    monkeypatch.setattr(planner, "build_plan", lambda *args, **kwargs: builds.append(args) or build_plan(*args, **kwargs))
+    with registry.LocationRegistry(str(tmp_path / "registry.sqlite")) as location_registry:
+        first_key, _ = cache.get_plan(*paths, False, registry=location_registry)
+        assert location_registry.version() > 0
+        second_key, _ = cache.get_plan(*paths, False, registry=location_registry)
+    assert second_key == first_key
+    assert len(builds) == 1
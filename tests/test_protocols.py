@@ -0,0 +1,121 @@
+import io
+import os
+import re
+import sys
+from collections import Counter
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(REPO, "tests", "data")
+sys.path.insert(0, REPO)
+
+import generator
+import plan_csv
+import planner
+
+simulate = pytest.importorskip("opentrons.simulate")
+csv_parameter_interface = pytest.importorskip("opentrons.protocols.parameters.csv_parameter_interface")
+
+# Short thermocycler program, so pipelined plates stay small
+TC_STEPS = dict(generator.DEFAULT_TC_STEPS, step4_cycles=2)
+
+@pytest.fixture(autouse=True)
+def repo_dir(monkeypatch):
+    # The generator reads template.py relative to the working directory
+    monkeypatch.chdir(REPO)
+
+def design(name, use_toolkit=False, batches=1):
+    folder = os.path.join(DATA, name)
+    toolkit_path = os.path.join(folder, "toolkit.csv") if use_toolkit else planner.TOOLKIT_PATH
+    return planner.build_plan(
+        os.path.join(folder, "fragments.csv"), os.path.join(folder, "constructs.csv"), use_toolkit, toolkit_path,
+        batches=batches, cycle_seconds=planner.cycling_prep_seconds(TC_STEPS) if batches > 1 else None,
+    )
+
+def run_log(text, name):
+    runlog, _ = simulate.simulate(io.StringIO(text), file_name=name)
+    return simulate.format_runlog(runlog)
+
+def set_default(text, variable_name, value):
+    # Protocol text with a run parameter defaulting to value, as if set in the Opentrons App
+    return re.sub(rf'(variable_name="{variable_name}",.*?default=)[^,\n]+', rf"\g<1>{value}", text, count=1, flags=re.S)
+
+# The generated protocol picks up exactly the tips the ledger counts, and the stable protocol
+# reading the plan CSV runs the same steps
+@pytest.mark.parametrize("name, use_toolkit, batches, insert_major, enzyme_last", [
+    ("replicates", False, 1, False, False),
+    ("replicates", False, 1, True, False),
+    ("replicates", False, 1, True, True),
+    ("swaps", True, 1, False, False),
+    ("swaps", True, 1, True, True),
+    ("pipelined", False, 3, False, False),
+    ("pipelined", False, 3, True, True),
+])
+def test_tips_match_ledger_and_stable_protocol(tmp_path, monkeypatch, name, use_toolkit, batches, insert_major, enzyme_last):
+    plan = design(name, use_toolkit, batches)
+    template = generator.load_template()
+    settings = (15, 6, 1.0, plan["vol_per_insert_dict"], TC_STEPS)
+    script = generator.render_plan(template, plan, *settings, insert_major=insert_major, enzyme_last=enzyme_last)
+    rows, ledger = generator.render_plan_csv(plan, *settings, insert_major=insert_major, enzyme_last=enzyme_last)
+    plan_path = tmp_path / "plan.csv"
+    plan_csv.write_plan_csv(plan_path, rows)
+    monkeypatch.setattr(
+        csv_parameter_interface.CSVParameter, "contents", property(lambda self: plan_path.read_text())
+    )
+
+    log = run_log(script, "protocol.py")
+    picks = {
+        "p20": len(re.findall(r"Picking up tip .*20 µL", log)),
+        "p300": len(re.findall(r"Picking up tip .*300 µL", log)),
+    }
+    assert picks == ledger["tips"]
+    assert run_log(generator.render_stable_protocol(template), "stable.py") == log
+
+# Resuming in a later swap round skips the earlier rounds for every construct, but still
+# pipettes the later rounds into the constructs before the resume construct
+def test_resume_in_swap_round():
+    plan = design("swaps", use_toolkit=True)
+    script = generator.render_plan(
+        generator.load_template(), plan, 15, 6, 1.0, plan["vol_per_insert_dict"], TC_STEPS
+    )
+    script = set_default(script, "resume_phase", '"inserts"')
+    script = set_default(script, "resume_construct", 4)
+    script = set_default(script, "resume_round", 2)
+    rounds = re.findall(r"Inserts for construct (\d+) \(\w+, round (\d)\)", run_log(script, "resume.py"))
+    assert rounds
+    assert all(int(round_number) >= 2 for _, round_number in rounds)
+    assert all(int(construct) >= 4 for construct, round_number in rounds if round_number == "2")
+    assert any(int(construct) < 4 for construct, round_number in rounds if round_number == "3")
+
+def insert_dispenses(log):
+    # Dispenses into each thermocycler well during the inserts phase of a run log
+    phase = log[log.index("Phase: inserts"):log.index("Phase: thermocycler")]
+    return Counter(re.findall(r"Dispensing .* into (\w+) of .* on Thermocycler", phase))
+
+# Resuming insert-major inserts at a fragment and construct dispenses exactly what the stopped
+# run had not: here the second trip of the first fragment and everything after it
+def test_resume_insert_major_at_fragment():
+    plan = design("pipelined")
+    script = generator.render_plan(
+        generator.load_template(), plan, 15, 6, 1.0, plan["vol_per_insert_dict"], TC_STEPS, insert_major=True
+    )
+    full = run_log(script, "full.py")
+    first_trip = full[full.index("Constructs 1, "):full.index("Constructs 20, ")]
+    script = set_default(script, "resume_phase", '"inserts"')
+    script = set_default(script, "resume_insert", 1)
+    script = set_default(script, "resume_construct", 20)
+    resumed = insert_dispenses(run_log(script, "resume.py"))
+    first_trip_dispenses = Counter(re.findall(r"Dispensing .* into (\w+) of .* on Thermocycler", first_trip))
+    assert first_trip_dispenses
+    assert resumed + first_trip_dispenses == insert_dispenses(full)
+
+# Compact protocols carry every per-reaction list in the encoded plan and run the same steps
+@pytest.mark.parametrize("compress", [False, True])
+def test_compact_protocol_runs_the_same(compress):
+    plan = design("replicates")
+    settings = (generator.load_template(), plan, 15, 6, 1.0, plan["vol_per_insert_dict"], TC_STEPS)
+    script = generator.render_plan(*settings)
+    compact = generator.render_plan(*settings, compact=True, compress=compress)
+    assert "('tube_rack'" not in compact
+    assert run_log(compact, "compact.py") == run_log(script, "protocol.py")
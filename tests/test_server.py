@@ -0,0 +1,58 @@
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(REPO, "tests", "data")
+sys.path.insert(0, REPO)
+
+import server
+
+@pytest.fixture
+def url(tmp_path, monkeypatch):
+    # A service on a free port, with its own protocol cache
+    monkeypatch.chdir(REPO)
+    service = server.ProtocolService(workers=1, cache_dir=str(tmp_path / "cache"))
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), server.make_handler(service))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+    service.pool.shutdown()
+
+def post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def read(name):
+    with open(os.path.join(DATA, "replicates", name)) as f:
+        return f.read()
+
+def test_plan_of_one_design(url):
+    status, body = post(f"{url}/plan", {"fragments_csv": read("fragments.csv"), "constructs_csv": read("constructs.csv")})
+    assert status == 200
+    assert len(body["constructs"]) == body["library_size"]
+
+# Designs must pair up: both texts, or lists of texts of the same length
+@pytest.mark.parametrize("fragments, constructs", [
+    (["fragments.csv"], "constructs.csv"),
+    (["fragments.csv", "fragments.csv"], ["constructs.csv"]),
+    ([], []),
+    ("fragments.csv", None),
+])
+def test_mismatched_designs_are_refused(url, fragments, constructs):
+    def texts(names):
+        return [read(name) for name in names] if isinstance(names, list) else names and read(names)
+    status, body = post(f"{url}/plan", {"fragments_csv": texts(fragments), "constructs_csv": texts(constructs)})
+    assert status == 422
+    assert "constructs_csv" in body["error"]
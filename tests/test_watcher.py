@@ -0,0 +1,33 @@
+import os
+import shutil
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(REPO, "tests", "data")
+sys.path.insert(0, REPO)
+
+import watcher
+
+# A bad export pair gets an error file and does not stop the good pair next to it from being planned
+def test_bad_export_does_not_stop_the_folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO)
+    monkeypatch.setattr(watcher, "SETTLE_SECONDS", 0)
+    watch_dir = tmp_path / "exports"
+    watch_dir.mkdir()
+    for design in ("bad", "good"):
+        for kind in ("fragments", "constructs"):
+            shutil.copy(os.path.join(DATA, "replicates", f"{kind}.csv"), watch_dir / f"{design}_{kind}.csv")
+    folder = watcher.FolderWatcher(str(watch_dir), str(tmp_path / "out"), cache_dir=str(tmp_path / "cache"))
+    get_plan = folder.cache.get_plan
+
+    # Errors outside the planner's usual ValueError and KeyError, e.g. a TypeError from a malformed cell
+    def failing_get_plan(fragments, *args, **kwargs):
+        if os.path.basename(fragments).startswith("bad"):
+            raise TypeError("unsupported operand type(s)")
+        return get_plan(fragments, *args, **kwargs)
+
+    monkeypatch.setattr(folder.cache, "get_plan", failing_get_plan)
+    assert folder.poll() == ["bad", "good"]
+    assert "unsupported operand" in (tmp_path / "out" / "bad_error.txt").read_text()
+    assert (tmp_path / "out" / "good.py").exists()
+    assert not (tmp_path / "out" / "good_error.txt").exists()
@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import time
+import generator
+import ledger as source_ledger
+import plan_cache
+import planner
+
+# Seconds between scans of the watched folder
+POLL_SECONDS = 2
+
+# An export must be unchanged this long before it is planned, so files still being copied are skipped
+SETTLE_SECONDS = 2
+
+# Export pairs are matched on their name: <design>_fragments.csv and <design>_constructs.csv
+FRAGMENTS_SUFFIX = "_fragments.csv"
+CONSTRUCTS_SUFFIX = "_constructs.csv"
+
+def find_designs(watch_dir):
+    # {design: (fragments path, constructs path)} for every complete export pair in the folder
+    names = set(os.listdir(watch_dir))
+    designs = {}
+    for name in sorted(names):
+        if name.endswith(FRAGMENTS_SUFFIX):
+            design = name[:-len(FRAGMENTS_SUFFIX)]
+            if design + CONSTRUCTS_SUFFIX in names:
+                designs[design] = (os.path.join(watch_dir, name), os.path.join(watch_dir, design + CONSTRUCTS_SUFFIX))
+    return designs
+
+class FolderWatcher:
+    # Plans Benchling export pairs dropped in a shared folder as they arrive and writes the
+    # protocol, loading sheet and metrics of each into out_dir. The template and toolkit index
+    # stay loaded, and plans and scripts come from the protocol cache, so an export whose
+    # contents did not change is only re-rendered from cache.
+    def __init__(
+        self, watch_dir, out_dir, use_toolkit=False, toolkit_path=planner.TOOLKIT_PATH, cache_dir=plan_cache.CACHE_DIR,
+        overflow_labware="plate", insert_major=False, enzyme_last=False, batches=1, settings=None, tc_steps=None
+    ):
+        self.watch_dir = watch_dir
+        self.out_dir = out_dir
+        self.use_toolkit = use_toolkit
+        self.toolkit_path = toolkit_path
+        self.overflow_labware = overflow_labware
+        self.insert_major = insert_major
+        self.enzyme_last = enzyme_last
+        self.batches = batches
+        self.settings = dict(generator.DEFAULT_SETTINGS, **(settings or {}))
+        self.tc_steps = tc_steps or generator.DEFAULT_TC_STEPS
+        self.template = generator.load_template()
+        self.cache = plan_cache.ProtocolCache(cache_dir)
+        # {design: (mtime, size) of its exports when last planned}
+        self.planned = {}
+        if use_toolkit:
+            planner.load_toolkit_index(toolkit_path)
+
+    def _signature(self, paths):
+        stats = [os.stat(path) for path in paths]
+        return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats), max(stat.st_mtime for stat in stats)
+
+    def poll(self):
+        # Plan every export pair that is new or changed and has settled, returns the designs planned
+        planned = []
+        for design, paths in find_designs(self.watch_dir).items():
+            try:
+                signature, modified = self._signature(paths)
+            except FileNotFoundError:
+                continue  # removed while scanning
+            if self.planned.get(design) == signature or time.time() - modified < SETTLE_SECONDS:
+                continue
+            self.planned[design] = signature
+            self.process(design, paths)
+            planned.append(design)
+        return planned
+
+    def _path(self, design, suffix):
+        return os.path.join(self.out_dir, design + suffix)
+
+    def _write(self, path, text):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def process(self, design, paths):
+        # Protocol, loading sheet and metrics of one design. Errors go to <design>_error.txt so the
+        # person who dropped the export sees them, and the design is retried once it changes.
+        os.makedirs(self.out_dir, exist_ok=True)
+        error_path = self._path(design, "_error.txt")
+        started = time.perf_counter()
+        try:
+            key, plan = self.cache.get_plan(
+                paths[0], paths[1], self.use_toolkit, self.toolkit_path, overflow_labware=self.overflow_labware,
+                batches=self.batches,
+                cycle_seconds=planner.cycling_prep_seconds(self.tc_steps) if self.batches > 1 else None,
+            )
+            planned = time.perf_counter()
+            vol_per_insert_dict = plan["vol_per_insert_dict"]
+            script = self.cache.get_script(
+                key, plan, self.template, vol_per_insert_dict=vol_per_insert_dict, tc_steps=self.tc_steps,
+                insert_major=self.insert_major, enzyme_last=self.enzyme_last, **self.settings,
+            )
+            run_ledger = source_ledger.build_ledger(
+                plan, self.settings["reaction_vol"], self.settings["mm_per_reaction"],
+                self.settings["enzyme_per_reaction"], vol_per_insert_dict, self.insert_major, self.enzyme_last,
+                self.tc_steps,
+            )
+        except Exception as e:
+            # Any error, so one malformed export cannot stop the watcher for the whole folder
+            self._write(error_path, f"{design}: {e}\n")
+            print(f"Could not plan {design}: {e}")
+            return
+        metrics = {
+            "plan_key": key,
+            "plan_seconds": round(planned - started, 4),
+            "render_seconds": round(time.perf_counter() - planned, 4),
+            "constructs": len(plan["construct_table"]),
+            "library_size": plan["library_size"],
+            "batches": plan["batches"],
+            "tips": run_ledger["tips"],
+            "estimated_runtime_seconds": planner.estimate_runtime(plan, self.tc_steps),
+            "enzyme_exposure_seconds": run_ledger["enzyme_exposure"],
+            "cycling_latency_seconds": run_ledger["cycling_latency"],
+            "warnings": run_ledger["warnings"],
+            "template_version": generator.template_version(self.template),
+        }
+        self._write(self._path(design, ".py"), script)
+        self._write(self._path(design, "_loading.txt"), generator.loading_sheet(plan, run_ledger))
+        self._write(self._path(design, "_metrics.json"), json.dumps(metrics, indent=2))
+        if os.path.exists(error_path):
+            os.remove(error_path)
+        print(f"Planned {design} in {time.perf_counter() - started:.2f} s: {self._path(design, '.py')}")
+
+    def run(self, poll_seconds=POLL_SECONDS):
+        while True:
+            self.poll()
+            time.sleep(poll_seconds)
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan Benchling exports dropped in a folder as they arrive")
+    parser.add_argument("watch_dir", help=f"folder with <design>{FRAGMENTS_SUFFIX} and <design>{CONSTRUCTS_SUFFIX} exports")
+    parser.add_argument("--out", default="watched_protocols", help="output folder")
+    parser.add_argument("--toolkit", action="store_true", help="pull fragments from toolkit plates")
+    parser.add_argument("--overflow", default="plate", choices=sorted(planner.OVERFLOW_LABWARE))
+    parser.add_argument("--insert-major", action="store_true", help="pipette inserts fragment by fragment")
+    parser.add_argument("--enzyme-last", action="store_true", help="add the enzyme after the inserts")
+    parser.add_argument("--batches", type=int, default=1, help="plates per run, pipelined while cycling")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="seconds between scans")
+    args = parser.parse_args()
+
+    watcher = FolderWatcher(
+        args.watch_dir, args.out, use_toolkit=args.toolkit, overflow_labware=args.overflow,
+        insert_major=args.insert_major, enzyme_last=args.enzyme_last, batches=args.batches,
+    )
+    print(f"Watching {args.watch_dir} for export pairs, writing protocols to {args.out}")
+    try:
+        watcher.run(args.poll)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()